@@ -0,0 +1,145 @@
+import hashlib
+import re
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_text(text: str) -> str:
+    """Normalize a message so trivially different copies of a campaign share a cache entry"""
+    return _WHITESPACE.sub(' ', text.lower()).strip()
+
+def normalize_language(language: str) -> str:
+    """Normalize a language name so 'Hindi' and ' hindi' share cached and stored translations"""
+    return language.strip().lower()
+
+def ad_cache_key(kind: str, text: str, language: Optional[str] = None) -> str:
+    """Content-addressed key: the kind of entry, a hash of the normalized text and, for translations, the language"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    if language is None:
+        return f"{kind}:{digest}"
+    return f"{kind}:{digest}:{normalize_language(language)}"
+
+class AdCache:
+    """
+    LRU + TTL cache for generated ads and translations.
+    Entries live in memory and, when db_path is given, in a SQLite file that
+    survives restarts. The file holds at most about db_max_entries rows: expired
+    and oldest rows are deleted every PRUNE_EVERY writes. Safe to use from
+    several threads; get and set block on SQLite when the cache is persistent.
+    """
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 7 * 24 * 3600, db_path: Optional[str] = None,
+                 db_max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self._writes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ad_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ad_cache_created_at ON ad_cache (created_at)")
+            self._prune()
+            self._db.commit()
+            # A SQLite connection must not be shared with forked workers
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self._reopen_after_fork)
+
+    def _reopen_after_fork(self):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def get_cached(self, key: str) -> Optional[str]:
+        """
+        Value held in memory, never reading SQLite. A None is not counted as a
+        miss: follow it with get.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[1] >= self.ttl_seconds:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value, or None on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] >= self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, created_at FROM ad_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] < self.ttl_seconds:
+                    entry = (row[0], row[1])
+                    self._store(key, entry)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: str):
+        entry = (value, time.time())
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ad_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, entry[0], entry[1])
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    self._prune()
+                self._db.commit()
+
+    def _prune(self):
+        """Delete expired rows, then the oldest ones past db_max_entries (caller commits)"""
+        self._db.execute("DELETE FROM ad_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM ad_cache WHERE key IN "
+            "(SELECT key FROM ad_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.db_max_entries,)
+        )
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for /health"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._db is not None,
+                "db_max_entries": self.db_max_entries if self._db is not None else None
+            }
@@ -0,0 +1,246 @@
+# Background ad generation for /analyze in job mode.
+#
+# /analyze classifies inline and hands the slow part (Gemini ad and
+# translations) to a bounded pool of asyncio workers. Job status and results
+# are kept in SQLite so any worker process can answer a poll; the job itself
+# runs in the process that accepted it.
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from sqlite_store import ProcessLocalConnection
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+class JobQueueFull(Exception):
+    """Raised when the job queue is at its depth limit"""
+    def __init__(self, retry_after: float):
+        super().__init__(f"Job queue is full, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class JobStore:
+    """
+    Status and results of ad jobs in a SQLite table shared by all worker processes.
+    Its methods block (up to 30s on a locked database), so AdJobQueue calls them
+    on a thread.
+    """
+    def __init__(self, path: str, ttl_seconds: float = 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._db = ProcessLocalConnection(path, [
+            "CREATE TABLE IF NOT EXISTS ad_jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, "
+            "error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        ], wal=True)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def create(self, job_id: str):
+        now = time.time()
+        with self._lock:
+            db = self._db.get()
+            db.execute("INSERT INTO ad_jobs (id, status, created_at) VALUES (?, ?, ?)", (job_id, JOB_QUEUED, now))
+            # Drop expired jobs now and then
+            if now - self._last_purge > 60:
+                db.execute("DELETE FROM ad_jobs WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._last_purge = now
+            db.commit()
+
+    def update(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            db = self._db.get()
+            if status == JOB_RUNNING:
+                db.execute("UPDATE ad_jobs SET status = ?, started_at = ? WHERE id = ?", (status, now, job_id))
+            else:
+                db.execute("UPDATE ad_jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                           (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                            error, now, job_id))
+            db.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.get().execute(
+                "SELECT id, status, result, error, created_at, started_at, finished_at FROM ad_jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None or time.time() - row[4] > self.ttl_seconds:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "created_at": row[4],
+            "started_at": row[5],
+            "finished_at": row[6]
+        }
+
+class AdJobQueue:
+    """
+    Bounded queue of ad jobs served by a fixed number of asyncio workers.
+    submit() never waits: when max_queue jobs are already waiting it raises
+    JobQueueFull, so callers can tell clients to back off.
+    """
+    def __init__(self, store: JobStore, runner: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 workers: int = 4, max_queue: int = 100, poll_interval: float = 0.25):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+
+        self._queue: "Optional[asyncio.Queue[Tuple[str, Dict[str, Any], float]]]" = None
+        self._tasks: List[asyncio.Task] = []
+        # Set when a job of this process finishes, so local waiters don't poll
+        self._finished: Dict[str, asyncio.Event] = {}
+        # True once the job's row is written (False if that failed), for coalesced submits
+        self._created: Dict[str, asyncio.Future] = {}
+        # Coalescing keys of unfinished jobs, both ways
+        self._keys: Dict[str, str] = {}
+        self._job_keys: Dict[str, str] = {}
+        self._busy = 0
+        self._average_run = 0.0
+
+    def start(self):
+        """Start the workers on the running event loop (once per process)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._report_load()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs nobody will run any more
+        while self._queue is not None and not self._queue.empty():
+            job_id, _, _ = self._queue.get_nowait()
+            await asyncio.to_thread(self.store.update, job_id, JOB_FAILED,
+                                    error="Server shut down before the job ran")
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def submit(self, payload: Dict[str, Any], key: Optional[str] = None) -> str:
+        """
+        Queue a job and return its id; raises JobQueueFull when the queue is at its limit.
+        While a job submitted with the same key is queued or running, its id is returned instead.
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue is not started")
+        if key is not None and key in self._keys:
+            job_id = self._keys[key]
+            created = self._created.get(job_id)
+            # Don't hand out the id before its row exists; if writing it failed, submit anew
+            if created is not None and not await asyncio.shield(created):
+                return await self.submit(payload, key)
+            metrics.ad_jobs.inc(outcome='coalesced')
+            return job_id
+        if self._queue.qsize() + len(self._created) >= self.max_queue:
+            metrics.ad_jobs.inc(outcome='rejected')
+            raise JobQueueFull(self.estimated_wait())
+        job_id = uuid.uuid4().hex
+        # Registered before the row is written so identical submits arriving meanwhile coalesce
+        created = self._created[job_id] = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._keys[key] = job_id
+            self._job_keys[job_id] = key
+        try:
+            await asyncio.to_thread(self.store.create, job_id)
+        except BaseException:
+            if key is not None:
+                self._keys.pop(key, None)
+                self._job_keys.pop(job_id, None)
+            created.set_result(False)
+            raise
+        finally:
+            self._created.pop(job_id, None)
+        created.set_result(True)
+        self._finished[job_id] = asyncio.Event()
+        self._queue.put_nowait((job_id, payload, time.monotonic()))
+        self._report_load()
+        return job_id
+
+    def estimated_wait(self) -> float:
+        """Rough seconds until a newly queued job would start"""
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return max(1.0, (self._average_run or 1.0) * (depth + 1) / max(1, self.workers))
+
+    async def _worker(self):
+        while True:
+            job_id, payload, queued_at = await self._queue.get()
+            started = time.monotonic()
+            metrics.ad_job_wait_seconds.observe(started - queued_at)
+            self._busy += 1
+            self._report_load()
+            try:
+                await asyncio.to_thread(self.store.update, job_id, JOB_RUNNING)
+                result = await self.runner(payload)
+                await asyncio.to_thread(self.store.update, job_id, JOB_DONE, result=result)
+                metrics.ad_jobs.inc(outcome='done')
+            except asyncio.CancelledError:
+                # Blocking here is fine: the server is shutting down
+                self.store.update(job_id, JOB_FAILED, error="Server shut down while the job was running")
+                raise
+            except Exception as e:
+                print(f"Ad job {job_id} failed: {e}")
+                await asyncio.to_thread(self.store.update, job_id, JOB_FAILED, error=str(e) or type(e).__name__)
+                metrics.ad_jobs.inc(outcome='failed')
+            finally:
+                elapsed = time.monotonic() - started
+                metrics.ad_job_run_seconds.observe(elapsed)
+                self._average_run = elapsed if not self._average_run else self._average_run + 0.1 * (elapsed - self._average_run)
+                self._busy -= 1
+                self._report_load()
+                key = self._job_keys.pop(job_id, None)
+                if key is not None:
+                    self._keys.pop(key, None)
+                event = self._finished.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+    def _report_load(self):
+        metrics.ad_job_queue_depth.set(self._queue.qsize() if self._queue is not None else 0)
+        metrics.ad_job_workers.set(self._busy, state='busy')
+        metrics.ad_job_workers.set(len(self._tasks) - self._busy, state='idle')
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """The job once it has finished, or as it is after timeout seconds (None if unknown)"""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job['status'] in FINISHED_STATES or timeout <= 0:
+            return job
+        event = self._finished.get(job_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await asyncio.to_thread(self.store.get, job_id)
+        # Queued by another worker process: poll the shared store
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None or job['status'] in FINISHED_STATES:
+                break
+        return job
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "busy_workers": self._busy,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "average_job_seconds": round(self._average_run, 3)
+        }
@@ -0,0 +1,295 @@
+# Pre-generated awareness ads for recurring spam templates.
+#
+# Most spam is a variation of a few dozen campaigns (prize wins, suspended
+# accounts, failed deliveries, ...). The build step clusters known spam with
+# TF-IDF + KMeans and generates one ad (and its translations) per cluster.
+# At serving time a message close enough to a cluster centroid, or to one of
+# the cluster's known messages, gets the stored ad without calling Gemini;
+# only novel spam goes to the model.
+#
+# Usage: python ad_library.py build --data spam.csv --extra more_spam.txt --languages Hindi Tamil
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import KMeans
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from ad_cache import normalize_language
+from model_artifacts import export_vectorizer, load_vectorizer
+
+LIBRARY_FORMAT_VERSION = 1
+DEFAULT_LIBRARY_DIR = 'ad_library'
+
+# Words of any script, including Devanagari vowel signs that \w alone would split on
+_TOKEN_PATTERN = r'(?u)[\wऀ-ॿ]{2,}'
+_URL = re.compile(r'https?://\S+|www\.\S+', re.IGNORECASE)
+_NUMBER = re.compile(r'\d+')
+
+def normalize_message(text: str) -> str:
+    """Lowercase, with links and numbers (amounts, phone numbers, codes) reduced to placeholders"""
+    text = _URL.sub(' url ', text.lower())
+    return ' '.join(_NUMBER.sub(' num ', text).split())
+
+class LibraryMatch(NamedTuple):
+    cluster: int
+    similarity: float
+    # 'centroid' or 'example' (a known message of the cluster)
+    matched: str
+    ad: str
+
+class AdLibrary:
+    """
+    Nearest-template lookup of pre-generated ads, loaded from a library directory.
+    Loose clusters have centroids far from many of their messages, so a message
+    also matches the cluster of a known message it is very similar to.
+    """
+    def __init__(self, path: str, min_similarity: float, min_example_similarity: float):
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != LIBRARY_FORMAT_VERSION:
+            raise ValueError(f"Unsupported ad library format: {manifest.get('format_version')}")
+        self.path = path
+        self.min_similarity = min_similarity
+        self.min_example_similarity = min_example_similarity
+        self.created_at = manifest.get('created_at')
+        self.vectorizer = load_vectorizer(path, manifest)
+        # Rows are L2-normalized, as are the vectorized messages, so a dot product is the cosine similarity
+        self.centroids = np.load(os.path.join(path, 'centroids.npy'), mmap_mode='r', allow_pickle=False)
+        # Known messages of each template, term-major (one row per vocabulary term) for a fast lookup
+        self._example_indptr = np.load(os.path.join(path, 'example_indptr.npy'), mmap_mode='r', allow_pickle=False)
+        self._example_rows = np.load(os.path.join(path, 'example_rows.npy'), mmap_mode='r', allow_pickle=False)
+        self._example_weights = np.load(os.path.join(path, 'example_weights.npy'), mmap_mode='r', allow_pickle=False)
+        self.example_clusters = np.load(os.path.join(path, 'example_clusters.npy'), allow_pickle=False)
+        self.clusters = manifest['clusters']
+        # Translations are looked up by the ad they translate and the normalized language
+        self._translations = {(cluster['ad'], normalize_language(lang)): text
+                              for cluster in self.clusters for lang, text in cluster['translations'].items()}
+        self._hits = 0
+        self._misses = 0
+
+    def lookup(self, text: str) -> Optional[LibraryMatch]:
+        """
+        The stored ad for the message's template: the cluster of the most similar
+        known message if it reaches min_example_similarity, else the nearest
+        centroid if it reaches min_similarity
+        """
+        row = self.vectorizer.transform([normalize_message(text)])
+        match = self._match(row) if self.clusters and row.nnz else None
+        if match is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return match
+
+    def _example_similarities(self, row: sp.csr_matrix) -> np.ndarray:
+        """Cosine similarity of the message to every known message, gathering only the message's terms"""
+        starts = self._example_indptr[row.indices]
+        lengths = self._example_indptr[row.indices + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(len(self.example_clusters))
+        # Positions of all the entries of the message's terms, term after term
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = offsets + np.arange(total)
+        return np.bincount(self._example_rows[positions],
+                           weights=self._example_weights[positions] * np.repeat(row.data, lengths),
+                           minlength=len(self.example_clusters))
+
+    def _match(self, row: sp.csr_matrix) -> Optional[LibraryMatch]:
+        example_similarities = self._example_similarities(row)
+        if len(example_similarities):
+            best = int(np.argmax(example_similarities))
+            if example_similarities[best] >= self.min_example_similarity:
+                cluster = int(self.example_clusters[best])
+                return LibraryMatch(cluster, float(example_similarities[best]), 'example', self.clusters[cluster]['ad'])
+        similarities = self.centroids[:, row.indices] @ row.data
+        cluster = int(np.argmax(similarities))
+        if similarities[cluster] >= self.min_similarity:
+            return LibraryMatch(cluster, float(similarities[cluster]), 'centroid', self.clusters[cluster]['ad'])
+        return None
+
+    def translation(self, ad_text: str, language: str) -> Optional[str]:
+        return self._translations.get((ad_text, normalize_language(language)))
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "created_at": self.created_at,
+            "templates": len(self.clusters),
+            "min_similarity": self.min_similarity,
+            "min_example_similarity": self.min_example_similarity,
+            "hits": self._hits,
+            "misses": self._misses
+        }
+
+def load_ad_library(path: str, min_similarity: float, min_example_similarity: float) -> Optional[AdLibrary]:
+    """The library at path, or None if it hasn't been built"""
+    if not os.path.isfile(os.path.join(path, 'manifest.json')):
+        return None
+    try:
+        library = AdLibrary(path, min_similarity, min_example_similarity)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading ad library from {path}: {e}")
+        return None
+    print(f"Ad library loaded: {len(library.clusters)} templates from {path}")
+    return library
+
+def read_spam_messages(data_path: str, extra_paths: Iterable[str] = (), encoding: str = 'latin1') -> List[str]:
+    """Spam rows of the labelled CSV plus every line of the extra files (all taken as spam)"""
+    import pandas as pd
+    df = pd.read_csv(data_path, encoding=encoding)
+    messages = df.loc[df['v1'] == 'spam', 'v2'].astype(str).tolist()
+    for path in extra_paths:
+        with open(path, encoding='utf-8') as f:
+            messages.extend(line.strip() for line in f if line.strip())
+    return messages
+
+def cluster_messages(messages: List[str], clusters: int = 40, min_size: int = 3, min_cohesion: float = 0.25):
+    """
+    Cluster spam messages into templates. Returns the fitted vectorizer, the
+    normalized centroids of the kept clusters, and for each kept cluster its
+    size, cohesion (mean member similarity to the centroid) and members, the
+    closest first. Small or loose clusters are dropped.
+    """
+    # Copies of the same message only differ in amounts, numbers and links
+    unique = list({normalize_message(text): text for text in messages}.values())
+    vectorizer = TfidfVectorizer(token_pattern=_TOKEN_PATTERN, ngram_range=(1, 2), min_df=2,
+                                 sublinear_tf=True, stop_words='english')
+    X = vectorizer.fit_transform([normalize_message(text) for text in unique])
+    kmeans = KMeans(n_clusters=min(clusters, len(unique)), n_init=4, random_state=0).fit(X)
+    centroids = normalize(kmeans.cluster_centers_)
+    similarities = np.asarray(X @ centroids.T)
+
+    kept_centroids = []
+    kept = []
+    for cluster in range(centroids.shape[0]):
+        members = np.where(kmeans.labels_ == cluster)[0]
+        if len(members) < min_size:
+            continue
+        member_similarities = similarities[members, cluster]
+        cohesion = float(member_similarities.mean())
+        if cohesion < min_cohesion:
+            continue
+        ranked = members[np.argsort(-member_similarities)]
+        kept_centroids.append(centroids[cluster])
+        kept.append({"size": int(len(members)), "cohesion": round(cohesion, 3),
+                     "members": [unique[i] for i in ranked]})
+    print(f"{len(unique)} distinct messages -> {len(kept)} templates kept of {centroids.shape[0]} clusters")
+    return vectorizer, np.array(kept_centroids), kept
+
+def build_library(messages: List[str], out_dir: str, generate_ad: Callable[[str], Optional[str]],
+                  translate: Callable[[str, List[str]], Dict[str, str]], languages: List[str],
+                  clusters: int = 40, min_size: int = 3, min_cohesion: float = 0.25) -> str:
+    """
+    Cluster the messages and store one ad per template, generated from the message
+    closest to its centroid, with its translations. Templates whose ad can't be
+    generated are left out.
+    """
+    vectorizer, centroids, templates = cluster_messages(messages, clusters, min_size, min_cohesion)
+    keep = []
+    entries = []
+    for index, template in enumerate(templates):
+        representative = template['members'][0]
+        try:
+            ad = generate_ad(representative)
+        except Exception as e:
+            print(f"Template {index}: ad generation failed: {e}")
+            ad = None
+        if not ad:
+            continue
+        translations = translate(ad, languages) if languages else {}
+        translations = {normalize_language(lang): text for lang, text in translations.items()}
+        missing = [lang for lang in languages if normalize_language(lang) not in translations]
+        if missing:
+            print(f"Template {index}: no translation for {missing}")
+        keep.append(index)
+        entries.append({"size": template['size'], "cohesion": template['cohesion'],
+                        "examples": template['members'][:3], "ad": ad, "translations": translations})
+        print(f"Template {index}: {template['size']} messages, e.g. {representative[:60]!r}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    vectorizer_manifest = export_vectorizer(vectorizer, out_dir)
+    np.save(os.path.join(out_dir, 'centroids.npy'),
+            np.asarray(centroids[keep] if keep else np.empty((0, len(vectorizer.vocabulary_))), dtype=np.float64))
+    # Known messages of the stored templates, numbered like the clusters in the manifest
+    examples = [message for index in keep for message in templates[index]['members']]
+    by_term = sp.csr_matrix(vectorizer.transform([normalize_message(message) for message in examples]).T)
+    by_term.sort_indices()
+    np.save(os.path.join(out_dir, 'example_indptr.npy'), by_term.indptr.astype(np.int64))
+    np.save(os.path.join(out_dir, 'example_rows.npy'), by_term.indices.astype(np.int64))
+    np.save(os.path.join(out_dir, 'example_weights.npy'), by_term.data.astype(np.float64))
+    np.save(os.path.join(out_dir, 'example_clusters.npy'),
+            np.array([cluster for cluster, index in enumerate(keep) for _ in templates[index]['members']], dtype=np.int64))
+    manifest = {
+        'format_version': LIBRARY_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'vectorizer': vectorizer_manifest,
+        'languages': languages,
+        'clusters': entries
+    }
+    # Written last, so a library only becomes loadable once it is complete
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return out_dir
+
+def _gemini_generators():
+    """generate_ad and translate callables backed by the API's Gemini setup (limiter, batching, cache)"""
+    import enhanced_api
+
+    model = enhanced_api.get_model()
+    if model is None:
+        raise SystemExit("No Gemini model is available; check GEMINI_API_KEY")
+
+    def generate_ad(text: str) -> str:
+        return enhanced_api._llm_generate(model, enhanced_api._ad_prompt(text), 'ad')
+
+    def translate(ad_text: str, languages: List[str]) -> Dict[str, str]:
+        prompts = {lang: enhanced_api._ad_translation_prompt(lang, ad_text) for lang in languages}
+        try:
+            return asyncio.run(enhanced_api._translate_all(model, 'ad_translation', ad_text, prompts))
+        except Exception as e:
+            print(f"Translation failed: {e}")
+            return {}
+    return generate_ad, translate
+
+if __name__ == "__main__":
+    from config import get_ad_library_config
+
+    parser = argparse.ArgumentParser(description="Build the library of pre-generated ads for common spam templates")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    build = subcommands.add_parser('build', help="cluster spam and generate one ad per template with Gemini")
+    build.add_argument('--data', default='spam.csv', help="labelled CSV (v1 = ham/spam, v2 = text)")
+    build.add_argument('--extra', nargs='*', default=[], help="more spam, one message per line")
+    build.add_argument('--languages', nargs='*', default=[], help="translations to store with each ad")
+    build.add_argument('--clusters', type=int, default=40)
+    build.add_argument('--min-size', type=int, default=3, help="smallest cluster that becomes a template")
+    build.add_argument('--min-cohesion', type=float, default=0.25,
+                       help="lowest mean similarity of a cluster's messages to its centroid")
+    build.add_argument('--out', help="library directory (default: AD_LIBRARY_PATH)")
+    lookup = subcommands.add_parser('lookup', help="show the template a message would be served from")
+    lookup.add_argument('text')
+    args = parser.parse_args()
+
+    config = get_ad_library_config()
+    if args.command == 'build':
+        # Offline: waiting for the rate limiter is fine, being refused is not
+        os.environ.setdefault('GEMINI_LIMITER_MAX_WAIT', '300')
+        generate_ad, translate = _gemini_generators()
+        out_dir = build_library(read_spam_messages(args.data, args.extra), args.out or config['path'],
+                                generate_ad, translate, args.languages, args.clusters, args.min_size,
+                                args.min_cohesion)
+        print(f"Ad library written to {out_dir}; restart the API to serve it")
+    else:
+        library = load_ad_library(config['path'], config['min_similarity'], config['min_example_similarity'])
+        if library is None:
+            raise SystemExit(f"No ad library at {config['path']}")
+        match = library.lookup(args.text)
+        print(match if match is not None else "No template close enough; Gemini would generate the ad")
@@ -0,0 +1,60 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# Labels of the ad format requested in the ad prompt, and the section names sent to clients
+AD_SECTIONS = {
+    'headline': 'headline',
+    'ad content': 'ad_content',
+    'key takeaway': 'key_takeaway',
+    'call to action': 'call_to_action',
+}
+
+_LABEL = re.compile(r'^[*#\s]*(headline|ad content|key takeaway|call to action)\s*[*]*\s*:\s*[*]*\s*(.*)$', re.IGNORECASE)
+_BULLET = re.compile(r'^\s*(?:[-•*]|\d+[.)])\s+(.*)$')
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """One server-sent event; json.dumps keeps the payload on a single data line"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class AdSectionParser:
+    """
+    Splits a streamed ad into its sections as lines complete.
+    feed() takes the next chunk of generated text and returns the sections
+    finished by it, e.g. {"section": "headline", "text": "..."} or one
+    {"section": "ad_content", "text": "<bullet>"} per bullet.
+    """
+    def __init__(self):
+        self._buffer = ''
+        self._section: Optional[str] = None
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        return [section for line in lines for section in self._parse_line(line)]
+
+    def close(self) -> List[Dict[str, str]]:
+        """Sections from the last, unterminated line"""
+        line, self._buffer = self._buffer, ''
+        return self._parse_line(line)
+
+    def _parse_line(self, line: str) -> List[Dict[str, str]]:
+        line = line.strip()
+        if not line:
+            return []
+        match = _LABEL.match(line)
+        if match:
+            self._section = AD_SECTIONS[match.group(1).lower()]
+            line = match.group(2).strip()
+            if not line:
+                return []  # "Ad Content:" on its own line; its bullets follow
+        else:
+            bullet = _BULLET.match(line)
+            if bullet:
+                line = bullet.group(1).strip()
+        # Leftover bold markers when the model ignores "no markdown"
+        line = line.strip('*').strip()
+        if not line:
+            return []
+        # Text before the first label (a preamble) has no section
+        return [{"section": self._section or 'text', "text": line}]
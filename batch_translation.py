@@ -0,0 +1,55 @@
+# One Gemini call for every language of a translation request.
+#
+# The text is sent once and Gemini answers with a JSON object mapping each
+# language to its translation. Languages missing from the answer, or whose
+# value doesn't look like a translation, are then translated one by one.
+import json
+import re
+from typing import Dict, List
+
+# Gemini's JSON output mode; the parser also copes with models that wrap the JSON in a code fence
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+# A value much shorter than the source is taken as a truncated translation
+MIN_LENGTH_RATIO = 0.2
+
+_FENCE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.IGNORECASE)
+
+def batch_translation_prompt(languages: List[str], text: str) -> str:
+    return f"""
+    Translate the content below into each of these languages: {json.dumps(languages, ensure_ascii=False)}.
+    Keep the structure of the original in every translation: the same labels, bullets, emojis and line breaks,
+    and Markdown only where the original uses it.
+    Respond with ONLY a JSON object. Its keys are the language names exactly as listed above and each value
+    is the complete translation into that language as a string.
+    ---
+    {text}
+    """
+
+def parse_batch_translations(response: str, languages: List[str], source: str) -> Dict[str, str]:
+    """
+    Valid translations for the requested languages in a batch answer, keyed as
+    requested. Anything missing, empty, untranslated or truncated is left out.
+    """
+    try:
+        data = json.loads(_FENCE.sub('', response))
+    except (TypeError, ValueError):
+        return {}
+    if isinstance(data, dict) and set(data) == {'translations'} and isinstance(data['translations'], dict):
+        data = data['translations']
+    if not isinstance(data, dict):
+        return {}
+
+    # Language names as the model wrote them may differ in case or spacing
+    answers = {str(key).strip().lower(): value for key, value in data.items()}
+    source = source.strip()
+    translations = {}
+    for lang in languages:
+        value = answers.get(lang.strip().lower())
+        if not isinstance(value, str):
+            continue
+        value = value.strip()
+        if not value or value == source or len(value) < MIN_LENGTH_RATIO * len(source):
+            continue
+        translations[lang] = value
+    return translations
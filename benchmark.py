@@ -0,0 +1,231 @@
+# Replays spam.csv through every detection stage and reports throughput,
+# latency percentiles and peak RSS. Gemini is replaced by a local fake, so
+# this runs offline and measures only our own code.
+#
+# Usage: python benchmark.py --json results.json [--compare previous.json]
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeGeminiModel:
+    """Stands in for genai.GenerativeModel; returns a fixed ad after an optional delay"""
+    def __init__(self, model_name: str = "fake-gemini", delay: float = 0.0):
+        self.model_name = model_name
+        self.delay = delay
+
+    def generate_content(self, prompt, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+        return _FakeResponse("🛡️ Stay Safe: never click links in unexpected prize messages. Verify the sender first.")
+
+def install_fake_gemini(delay: float = 0.0):
+    import google.generativeai as genai
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = lambda name, **kwargs: FakeGeminiModel(name, delay)
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def load_messages(path: str, limit: Optional[int] = None) -> List[str]:
+    df = pd.read_csv(path, encoding='latin-1')
+    messages = df['v2'].astype(str).tolist()
+    return messages[:limit] if limit else messages
+
+def chunks(items: List, size: int) -> List[List]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def summarize(latencies: List[float], messages: int, elapsed: float, mode: str) -> Dict:
+    ms = np.array(latencies) * 1000.0
+    return {
+        'mode': mode,
+        'messages': messages,
+        'calls': len(latencies),
+        'seconds': round(elapsed, 4),
+        'throughput_per_s': round(messages / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': round(float(np.percentile(ms, 50)), 4),
+            'p95': round(float(np.percentile(ms, 95)), 4),
+            'p99': round(float(np.percentile(ms, 99)), 4),
+            'mean': round(float(ms.mean()), 4),
+            'max': round(float(ms.max()), 4)
+        },
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def run_stage(func: Callable, inputs: List, messages_per_call: Callable = lambda item: 1,
+              mode: str = 'single', quiet: bool = True) -> Dict:
+    """Call func on every input, timing each call; output printed by func is discarded"""
+    latencies = []
+    messages = 0
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        start = time.perf_counter()
+        for item in inputs:
+            call_start = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - call_start)
+            messages += messages_per_call(item)
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, messages, elapsed, mode)
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(args) -> Dict:
+    install_fake_gemini(args.gemini_delay)
+
+    # Repeated passes would otherwise be answered from the near-duplicate index instead of the pipeline
+    os.environ.setdefault('NEAR_DUPLICATE_INDEX', 'false')
+    # The fake Gemini has no quota; the client-side limiter would only measure its own sleeps (0 = unlimited)
+    os.environ.setdefault('GEMINI_RPM', '0')
+    os.environ.setdefault('GEMINI_TPM', '0')
+    rss_before_import = peak_rss_mb()
+    load_start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import enhanced_api
+    load_seconds = time.perf_counter() - load_start
+
+    from text_preprocessing import advanced_text_preprocessing
+
+    messages = load_messages(args.data, args.limit)
+    stages = [name.strip() for name in args.stages.split(',')] if args.stages else None
+    results = {}
+
+    def wanted(name: str) -> bool:
+        return stages is None or name in stages
+
+    def report(name: str, result: Dict):
+        results[name] = result
+        latency = result['latency_ms']
+        print(f"{name:<22} {result['throughput_per_s']:>10.1f} msg/s  p50 {latency['p50']:>8.3f} ms  "
+              f"p95 {latency['p95']:>8.3f} ms  p99 {latency['p99']:>8.3f} ms  rss {result['peak_rss_mb']} MB")
+
+    batches = chunks(messages, args.batch_size)
+    print(f"Replaying {len(messages)} messages ({args.repeat} pass(es), batch size {args.batch_size})")
+
+    for _ in range(args.repeat):
+        if wanted('preprocessing'):
+            report('preprocessing', run_stage(advanced_text_preprocessing, messages))
+
+        if wanted('rules'):
+            report('rules', run_stage(enhanced_api._rule_detector.predict, messages))
+
+        bundle = enhanced_api._model_manager.active
+        if bundle is not None:
+            tfidf, clf = bundle.vectorizer, bundle.classifier
+            processed = [advanced_text_preprocessing(text) for text in messages]
+            if wanted('ml'):
+                report('ml', run_stage(lambda text: clf.predict_proba(tfidf.transform([text])), processed))
+            if wanted('ml_batch'):
+                report('ml_batch', run_stage(lambda batch: clf.predict_proba(tfidf.transform(batch)),
+                                             chunks(processed, args.batch_size), len, mode='batch'))
+
+        if wanted('hybrid_full'):
+            # Both stages for every message, i.e. CASCADE_MODE=off
+            report('hybrid_full', run_stage(lambda text: enhanced_api.classify_message(text, mode='off'), messages))
+
+        if wanted('hybrid'):
+            report('hybrid', run_stage(enhanced_api.hybrid_spam_detection, messages))
+
+        if wanted('hybrid_batch'):
+            report('hybrid_batch', run_stage(enhanced_api.hybrid_spam_detection_batch, batches, len, mode='batch'))
+
+        if wanted('analyze') or wanted('analyze_batch'):
+            from fastapi.testclient import TestClient
+            client = TestClient(enhanced_api.app)
+            languages = [lang.strip() for lang in args.languages.split(',')] if args.languages else None
+
+            def analyze(text: str):
+                response = client.post('/analyze', json={'text': text, 'languages': languages})
+                response.raise_for_status()
+
+            def analyze_batch(batch: List[str]):
+                response = client.post('/analyze-batch', json={'texts': batch})
+                response.raise_for_status()
+
+            if wanted('analyze'):
+                report('analyze', run_stage(analyze, messages))
+            if wanted('analyze_batch'):
+                report('analyze_batch', run_stage(analyze_batch, batches, len, mode='batch'))
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'messages': len(messages),
+            'repeat': args.repeat,
+            'batch_size': args.batch_size,
+            'model': enhanced_api._model_manager.active.version if enhanced_api._model_manager.active else None,
+            'model_load_seconds': round(load_seconds, 4),
+            'rss_before_import_mb': rss_before_import,
+            'gemini': f'fake (delay {args.gemini_delay}s)'
+        },
+        'stages': results,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def compare(current: Dict, previous: Dict):
+    """Print the throughput and p95 change of every stage present in both runs"""
+    print(f"\nChange vs {previous['meta'].get('git_revision')} ({previous['meta'].get('timestamp')}):")
+    for name, stage in current['stages'].items():
+        old = previous.get('stages', {}).get(name)
+        if not old or not old.get('throughput_per_s'):
+            continue
+        throughput = (stage['throughput_per_s'] / old['throughput_per_s'] - 1) * 100
+        p95 = (stage['latency_ms']['p95'] / old['latency_ms']['p95'] - 1) * 100 if old['latency_ms']['p95'] else 0.0
+        print(f"{name:<22} throughput {throughput:+7.1f}%   p95 latency {p95:+7.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every detection stage on spam.csv")
+    parser.add_argument('--data', default='spam.csv', help="CSV with messages in column v2")
+    parser.add_argument('--limit', type=int, help="only use the first N messages")
+    parser.add_argument('--repeat', type=int, default=1, help="passes over the data; the last (warm) pass is reported")
+    parser.add_argument('--batch-size', type=int, default=256, help="messages per batch for the batch stages")
+    parser.add_argument('--stages', help="comma-separated subset of: preprocessing, rules, ml, ml_batch, "
+                                         "hybrid_full, hybrid, hybrid_batch, analyze, analyze_batch")
+    parser.add_argument('--languages', help="comma-separated languages to request from /analyze, e.g. hindi,tamil")
+    parser.add_argument('--gemini-delay', type=float, default=0.0, help="seconds the fake Gemini waits per call")
+    parser.add_argument('--json', dest='json_path', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json_path}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
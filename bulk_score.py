@@ -0,0 +1,293 @@
+# Back-scans large message archives with the hybrid detector.
+# Input is streamed (CSV, JSONL or mbox), scored in chunks on a process pool and
+# written incrementally; a checkpoint file next to the output allows resuming.
+#
+# Usage: python bulk_score.py archive.mbox results.csv --workers 8
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import csv
+import email
+import json
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from email import policy
+from typing import Iterator, List, Optional, Tuple
+
+# Each process would keep its own near-duplicate index, making results depend on the worker
+# count and record order (and differ after a resume). Set before enhanced_api is imported,
+# here at module level so forked and spawned workers get it too.
+os.environ.setdefault('NEAR_DUPLICATE_INDEX', 'false')
+
+# (record index, message id, text, input byte offset where the next record starts)
+Record = Tuple[int, str, str, int]
+
+_HTML_TAG = re.compile(r'<[^>]+>')
+OUTPUT_FIELDS = ['record', 'id', 'classification', 'confidence']
+
+def detect_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.mbox', '.mbx'):
+        return 'mbox'
+    return 'csv'
+
+class _DecodedLines:
+    """Decoded lines of a binary file, with the byte offset just past the last line read"""
+    def __init__(self, f, encoding: str):
+        self.f = f
+        self.encoding = encoding
+        self.offset = f.tell()
+
+    def seek(self, offset: int):
+        self.f.seek(offset)
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding, errors='replace')
+
+def read_csv(path: str, text_column: Optional[str], id_column: Optional[str], encoding: str,
+             start_index: int = 0, start_offset: int = 0) -> Iterator[Record]:
+    csv.field_size_limit(sys.maxsize)
+    with open(path, 'rb') as f:
+        lines = _DecodedLines(f, encoding)
+        reader = csv.DictReader(lines)
+        # Reads the header, which must happen before seeking past it
+        fieldnames = reader.fieldnames or []
+        if text_column is None:
+            # spam.csv keeps the message in v2
+            text_column = 'text' if 'text' in fieldnames else 'v2'
+        if start_offset:
+            # Header read, now jump to the first record not yet scored
+            lines.seek(start_offset)
+        for index, row in enumerate(reader, start_index):
+            record_id = row.get(id_column) if id_column else None
+            yield index, record_id or str(index), row.get(text_column) or '', lines.offset
+
+def read_jsonl(path: str, text_column: Optional[str], id_column: Optional[str], encoding: str,
+               start_index: int = 0, start_offset: int = 0) -> Iterator[Record]:
+    text_column = text_column or 'text'
+    with open(path, 'rb') as f:
+        lines = _DecodedLines(f, encoding)
+        lines.seek(start_offset)
+        index = start_index
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            record_id = row.get(id_column) if id_column else None
+            yield (index, str(record_id) if record_id is not None else str(index), str(row.get(text_column) or ''),
+                   lines.offset)
+            index += 1
+
+def _message_text(raw: bytes) -> Tuple[str, str]:
+    """(Message-ID, subject + body) of one raw mbox message"""
+    message = email.message_from_bytes(raw, policy=policy.default)
+    subject = str(message.get('Subject', '') or '')
+    body = ''
+    try:
+        part = message.get_body(preferencelist=('plain', 'html'))
+        if part is not None:
+            body = part.get_content()
+            if part.get_content_type() == 'text/html':
+                body = _HTML_TAG.sub(' ', body)
+    except Exception:
+        # Broken MIME or unknown charset: fall back to the raw payload
+        payload = message.get_payload(decode=True)
+        if isinstance(payload, bytes):
+            body = payload.decode('utf-8', errors='replace')
+    return str(message.get('Message-ID', '') or ''), f"{subject}\n{body}".strip()
+
+def read_mbox(path: str, text_column: Optional[str], id_column: Optional[str], encoding: str,
+              start_index: int = 0, start_offset: int = 0) -> Iterator[Record]:
+    """Split the mbox on 'From ' separator lines without indexing the whole file first"""
+    def parse(index: int, lines: List[bytes], end: int) -> Record:
+        message_id, text = _message_text(b''.join(lines))
+        return index, message_id or str(index), text, end
+
+    index = start_index
+    lines: List[bytes] = []
+    previous_blank = True
+    offset = start_offset
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        for line in f:
+            if line.startswith(b'From ') and previous_blank:
+                if lines:
+                    # The next message starts at this separator line
+                    yield parse(index, lines, offset)
+                    index += 1
+                lines = []
+            else:
+                lines.append(line)
+            previous_blank = not line.strip()
+            offset += len(line)
+        if lines:
+            yield parse(index, lines, offset)
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'mbox': read_mbox}
+
+def read_chunks(records: Iterator[Record], chunk_size: int) -> Iterator[List[Record]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _init_worker():
+    # Each worker loads the models once and reuses them for every chunk
+    import enhanced_api
+    if enhanced_api._model_manager.active is None:
+        print(f"Worker {os.getpid()}: no ML model could be loaded, scoring with rules only")
+
+def score_texts(texts: List[str]) -> List[Tuple[int, float]]:
+    from enhanced_api import hybrid_spam_detection_batch
+    return hybrid_spam_detection_batch(texts)
+
+class ResultWriter:
+    """Appends results as CSV or JSONL and keeps a checkpoint of how far it got"""
+    def __init__(self, path: str, output_format: str, resume_bytes: int):
+        self.path = path
+        self.output_format = output_format
+        exists = os.path.exists(path)
+        if exists and resume_bytes:
+            # Drop anything written after the last checkpoint
+            with open(path, 'r+b') as f:
+                f.truncate(resume_bytes)
+        self.file = open(path, 'a' if resume_bytes else 'w', newline='', encoding='utf-8')
+        self.csv_writer = csv.writer(self.file) if output_format == 'csv' else None
+        if self.csv_writer is not None and not resume_bytes:
+            self.csv_writer.writerow(OUTPUT_FIELDS)
+
+    def write(self, records: List[Record], scores: List[Tuple[int, float]]):
+        for (index, record_id, _, _), (prediction, confidence) in zip(records, scores):
+            label = 'spam' if prediction == 1 else 'not_spam'
+            if self.csv_writer is not None:
+                self.csv_writer.writerow([index, record_id, label, f"{confidence:.6f}"])
+            else:
+                self.file.write(json.dumps({'record': index, 'id': record_id, 'classification': label,
+                                            'confidence': round(float(confidence), 6)}) + '\n')
+
+    def flush(self) -> int:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+def load_checkpoint(path: str, input_path: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return {'records_done': 0, 'output_bytes': 0, 'input_offset': 0}
+    if checkpoint.get('input') != os.path.abspath(input_path):
+        raise SystemExit(f"Checkpoint {path} belongs to {checkpoint.get('input')}; remove it or pick another output")
+    return checkpoint
+
+def save_checkpoint(path: str, input_path: str, records_done: int, input_offset: int, output_bytes: int):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'input': os.path.abspath(input_path), 'records_done': records_done, 'input_offset': input_offset,
+                   'output_bytes': output_bytes, 'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+    os.replace(tmp_path, path)
+
+def run(args):
+    input_format = args.input_format or detect_format(args.input)
+    output_format = args.output_format or ('jsonl' if args.output.endswith(('.jsonl', '.ndjson')) else 'csv')
+    checkpoint_path = args.output + '.checkpoint'
+
+    checkpoint = {'records_done': 0, 'output_bytes': 0, 'input_offset': 0}
+    if args.resume:
+        checkpoint = load_checkpoint(checkpoint_path, args.input)
+    records_done = checkpoint['records_done']
+    if records_done:
+        print(f"Resuming after {records_done} records")
+
+    read = READERS[input_format]
+    if 'input_offset' in checkpoint:
+        # Continue reading where the last scored record ended
+        records = read(args.input, args.text_column, args.id_column, args.encoding,
+                       records_done, checkpoint['input_offset'])
+    else:
+        # Checkpoint from before offsets were saved: skip what was written by parsing it again
+        records = read(args.input, args.text_column, args.id_column, args.encoding)
+        records = (record for record in records if record[0] >= records_done)
+    writer = ResultWriter(args.output, output_format, checkpoint['output_bytes'])
+
+    start = time.time()
+    scored = 0
+    spam = 0
+    last_report = start
+
+    def finish(chunk: List[Record], scores: List[Tuple[int, float]]):
+        nonlocal records_done, scored, spam, last_report
+        writer.write(chunk, scores)
+        records_done = chunk[-1][0] + 1
+        input_offset = chunk[-1][3]
+        scored += len(chunk)
+        spam += sum(1 for prediction, _ in scores if prediction == 1)
+        save_checkpoint(checkpoint_path, args.input, records_done, input_offset, writer.flush())
+        now = time.time()
+        if now - last_report >= args.progress_seconds:
+            last_report = now
+            print(f"{records_done} records done ({scored / (now - start):.0f} msg/s, {spam} spam)")
+
+    try:
+        if args.workers == 0:
+            _init_worker()
+            for chunk in read_chunks(records, args.chunk_size):
+                finish(chunk, score_texts([text for _, _, text, _ in chunk]))
+        else:
+            # Results are written in input order; at most max_in_flight chunks are queued
+            # so memory stays flat however large the input is
+            max_in_flight = args.max_in_flight or args.workers * 2
+            pending: "deque[Tuple[List[Record], Future]]" = deque()
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool:
+                for chunk in read_chunks(records, args.chunk_size):
+                    if len(pending) >= max_in_flight:
+                        done_chunk, future = pending.popleft()
+                        finish(done_chunk, future.result())
+                    pending.append((chunk, pool.submit(score_texts, [text for _, _, text, _ in chunk])))
+                while pending:
+                    done_chunk, future = pending.popleft()
+                    finish(done_chunk, future.result())
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start
+    rate = scored / elapsed if elapsed else 0.0
+    print(f"Scored {scored} messages in {elapsed:.1f}s ({rate:.0f} msg/s), {spam} spam. Results in {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a CSV, JSONL or mbox archive with the hybrid spam detector")
+    parser.add_argument('input', help="input file (.csv, .jsonl or .mbox)")
+    parser.add_argument('output', help="output file (.csv or .jsonl)")
+    parser.add_argument('--input-format', choices=sorted(READERS), help="override detection from the extension")
+    parser.add_argument('--output-format', choices=['csv', 'jsonl'], help="override detection from the extension")
+    parser.add_argument('--text-column', help="CSV column / JSON field with the message (default: text, or v2)")
+    parser.add_argument('--id-column', help="CSV column / JSON field with a message id (default: record number)")
+    parser.add_argument('--encoding', default='utf-8', help="input encoding for CSV/JSONL (spam.csv is latin-1)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="scoring processes (default: CPU count, 0 = score in this process)")
+    parser.add_argument('--chunk-size', type=int, default=500, help="messages per chunk sent to a worker")
+    parser.add_argument('--max-in-flight', type=int, help="chunks queued at once (default: 2 x workers)")
+    parser.add_argument('--resume', action='store_true', help="continue from the checkpoint next to the output")
+    parser.add_argument('--progress-seconds', type=float, default=10.0, help="seconds between progress lines")
+    run(parser.parse_args())
@@ -26,6 +26,237 @@ def get_app_config():
         'data_file': 'spam.csv'
     }
 
+def get_llm_config():
+    """
+    Get Gemini model settings (each can be overridden with an environment variable)
+    """
+    candidates = [
+        "models/gemini-2.0-flash",  # This one works based on our testing
+        "models/gemini-2.0-flash-001",
+        "models/gemini-1.5-flash-latest",
+        "models/gemini-1.5-flash-002",
+        "models/gemini-1.5-flash",
+        "gemini-1.5-flash",
+        "gemini-1.5-pro",
+        "gemini-pro"
+    ]
+    # Pin a model by putting it first in the list
+    preferred = os.getenv('GEMINI_MODEL')
+    if preferred:
+        candidates = [preferred] + [name for name in candidates if name != preferred]
+    
+    processes = max(1, int(os.getenv('GEMINI_LIMIT_PROCESSES', '1')))
+    
+    return {
+        'model_candidates': candidates,
+        # How long a resolved model is reused before it is probed again
+        'model_ttl_seconds': float(os.getenv('GEMINI_MODEL_TTL', '3600')),
+        # Timeout for the one-off probe made while resolving a model
+        'probe_timeout': float(os.getenv('GEMINI_PROBE_TIMEOUT', '10')),
+        # Wait before retrying when no candidate model could be resolved
+        'resolve_retry_seconds': float(os.getenv('GEMINI_RESOLVE_RETRY', '60')),
+        # Threads available for blocking Gemini calls (shared by all requests)
+        'max_workers': int(os.getenv('GEMINI_MAX_WORKERS', '16')),
+        # Translations of one ad that may run at the same time
+        'translation_concurrency': int(os.getenv('GEMINI_TRANSLATION_CONCURRENCY', '4')),
+        # Translate all requested languages in one JSON-mode call, falling back per language
+        'batch_translation': os.getenv('GEMINI_BATCH_TRANSLATION', 'true').lower() in ('1', 'true', 'yes'),
+        # Timeout for a single generation call, in seconds
+        'call_timeout': float(os.getenv('GEMINI_CALL_TIMEOUT', '30')),
+        # Client-side limits for the whole server (0 = unlimited); start_server.py sets
+        # GEMINI_LIMIT_PROCESSES so each worker process keeps to its share
+        'rpm_limit': float(os.getenv('GEMINI_RPM', '15')) / processes,
+        'tpm_limit': float(os.getenv('GEMINI_TPM', '1000000')) / processes,
+        # Longest a call waits for the limiter; beyond that it is refused and the ad skipped
+        'limiter_max_wait': float(os.getenv('GEMINI_LIMITER_MAX_WAIT', '5')),
+        # Consecutive 5xx errors that open the circuit breaker (a 429 opens it at once)
+        'breaker_failure_threshold': int(os.getenv('GEMINI_BREAKER_FAILURES', '3')),
+        # First open period of the breaker, doubled after each failed trial call up to the max
+        'breaker_backoff': float(os.getenv('GEMINI_BREAKER_BACKOFF', '30')),
+        'breaker_max_backoff': float(os.getenv('GEMINI_BREAKER_MAX_BACKOFF', '600')),
+        # Output tokens reserved per call until the response reports its real usage
+        'estimated_output_tokens': int(os.getenv('GEMINI_ESTIMATED_OUTPUT_TOKENS', '400'))
+    }
+
+def get_cache_config():
+    """
+    Get settings for the generated ad / translation cache
+    """
+    return {
+        'max_entries': int(os.getenv('AD_CACHE_MAX_ENTRIES', '2048')),
+        'ttl_seconds': float(os.getenv('AD_CACHE_TTL', str(7 * 24 * 3600))),
+        # SQLite file that keeps cached ads across restarts; unset keeps the cache in memory only
+        'db_path': os.getenv('AD_CACHE_DB') or None,
+        # Rows kept in that file; the oldest are deleted past this
+        'db_max_entries': int(os.getenv('AD_CACHE_DB_MAX_ENTRIES', '100000'))
+    }
+
+def get_ad_job_config():
+    """
+    Get settings for background ad generation jobs (/analyze with async_ad)
+    """
+    return {
+        # Use job mode for /analyze requests that don't set async_ad themselves
+        'default_async': os.getenv('AD_JOBS_DEFAULT', 'false').lower() in ('1', 'true', 'yes'),
+        # Concurrent ad jobs per worker process
+        'workers': int(os.getenv('AD_JOB_WORKERS', '4')),
+        # Jobs waiting for a worker before new ones are rejected
+        'max_queue': int(os.getenv('AD_JOB_QUEUE_SIZE', '100')),
+        # SQLite file with job status and results, shared by all worker processes
+        'db_path': os.getenv('AD_JOBS_DB', 'ad_jobs.sqlite'),
+        # Seconds finished jobs can still be fetched
+        'result_ttl': float(os.getenv('AD_JOB_RESULT_TTL', '3600'))
+    }
+
+def get_logging_config():
+    """
+    Get request logging settings
+    """
+    return {
+        # Print full message bodies received by /analyze (off by default: they may contain personal data)
+        'log_message_bodies': os.getenv('LOG_MESSAGE_BODIES', 'false').lower() in ('1', 'true', 'yes')
+    }
+
+def get_metrics_config():
+    """
+    Get settings for /metrics across worker processes
+    """
+    return {
+        # Directory where every worker saves its metrics so any of them can answer a scrape for all
+        # (start_server.py sets one up for multiple workers); unset reports only the answering process
+        'directory': os.getenv('METRICS_DIR') or None,
+        # Seconds between a worker's snapshots (the other workers' numbers in a scrape are at most this old)
+        'flush_interval': float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+    }
+
+def get_preprocessing_config():
+    """
+    Get settings for corpus preprocessing in the training scripts
+    """
+    return {
+        # SQLite file caching preprocessed text between training runs; empty disables the cache
+        'cache_path': os.getenv('PREPROCESSING_CACHE', 'preprocessing_cache.sqlite') or None,
+        # Worker processes (0 = one per CPU, 1 = no pool)
+        'workers': int(os.getenv('PREPROCESSING_WORKERS', '0'))
+    }
+
+def get_model_config():
+    """
+    Get classifier model loading and hot reload settings
+    """
+    return {
+        # Directory with versioned model artifacts and the CURRENT file (default: model_artifacts next to the API)
+        'artifact_root': os.getenv('MODEL_ARTIFACT_DIR') or None,
+        # Seconds between checks of the CURRENT file for a new version (0 disables the watcher)
+        'watch_interval': float(os.getenv('MODEL_WATCH_INTERVAL', '10')),
+        # Labelled CSV (spam.csv layout) a sample of which every new model is checked on before it is
+        # activated; relative to the API directory. Without it a small built-in set is used
+        'canary_data': os.getenv('MODEL_CANARY_DATA', 'spam.csv'),
+        'canary_size': int(os.getenv('MODEL_CANARY_SIZE', '1000')),
+        # Share of the canary messages a new model must classify correctly ...
+        'canary_min_accuracy': float(os.getenv('MODEL_CANARY_MIN_ACCURACY', '0.9')),
+        # ... and how far below the active model's share it may be
+        'canary_max_regression': float(os.getenv('MODEL_CANARY_MAX_REGRESSION', '0.02')),
+        # Token for the /admin endpoints (X-Admin-Token header); unset allows local clients only
+        'admin_token': os.getenv('ADMIN_TOKEN') or None
+    }
+
+def get_detection_config():
+    """
+    Get hybrid spam detection settings
+    """
+    return {
+        # Early exit between the rule and ML stages: 'exact' (results identical to 'off'),
+        # 'label' (also stops when only the label is certain) or 'off' (always run both)
+        'cascade_mode': os.getenv('CASCADE_MODE', 'exact').lower(),
+        # Most texts accepted by one /analyze-batch request (more are rejected with 422)
+        'batch_max_items': int(os.getenv('BATCH_MAX_ITEMS', '1000'))
+    }
+
+def get_near_duplicate_config():
+    """
+    Get settings for the index that reuses verdicts for near-duplicates of recent messages
+    """
+    return {
+        'enabled': os.getenv('NEAR_DUPLICATE_INDEX', 'true').lower() in ('1', 'true', 'yes'),
+        # Messages remembered per worker process (least recently used are dropped first)
+        'max_entries': int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', '10000')),
+        'ttl_seconds': float(os.getenv('NEAR_DUPLICATE_TTL', '3600')),
+        # Differing SimHash bits (of 64) still counted as the same message
+        'max_distance': int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '5')),
+        # Shorter messages (fewer distinct 4-character shingles) are always classified in full
+        'min_shingles': int(os.getenv('NEAR_DUPLICATE_MIN_SHINGLES', '20'))
+    }
+
+def get_long_text_config():
+    """
+    Get windowed scoring settings for long messages (email bodies)
+    """
+    return {
+        # Longer texts are scored in segments of this many characters (0 scores every text whole);
+        # the models were trained on SMS-sized messages
+        'segment_chars': int(os.getenv('LONG_TEXT_SEGMENT_CHARS', str(get_app_config()['max_message_length']))),
+        # Characters each segment repeats from the end of the previous one
+        'overlap_chars': int(os.getenv('LONG_TEXT_OVERLAP_CHARS', '100')),
+        # Segments scored at most; the rest of the text is not examined
+        'max_segments': int(os.getenv('LONG_TEXT_MAX_SEGMENTS', '16')),
+        # A segment at least this confidently spam ends the scan
+        'stop_confidence': float(os.getenv('LONG_TEXT_STOP_CONFIDENCE', '0.9'))
+    }
+
+def get_online_learning_config():
+    """
+    Get settings for the feedback-trained online model
+    """
+    return {
+        # When on, the online model replaces the batch-trained model in hybrid detection once it is trained
+        'enabled': os.getenv('ONLINE_LEARNING', 'false').lower() in ('1', 'true', 'yes'),
+        # SQLite log of /feedback reports, shared by all workers
+        'feedback_db': os.getenv('ONLINE_FEEDBACK_DB', 'feedback.sqlite'),
+        'snapshot_path': os.getenv('ONLINE_MODEL_SNAPSHOT', 'online_model.pkl'),
+        # Size of the hashed feature space (fixed memory, no vocabulary)
+        'hash_features': int(os.getenv('ONLINE_HASH_FEATURES', str(2 ** 18))),
+        # Feedback messages per partial_fit call
+        'batch_size': int(os.getenv('ONLINE_BATCH_SIZE', '64')),
+        # Seconds between checks for new feedback, and between snapshots
+        'poll_interval': float(os.getenv('ONLINE_POLL_INTERVAL', '2')),
+        'snapshot_interval': float(os.getenv('ONLINE_SNAPSHOT_INTERVAL', '300')),
+        # Messages the online model must have learned before it replaces the batch-trained model
+        'min_samples': int(os.getenv('ONLINE_MIN_SAMPLES', '1000')),
+        # Shared key /feedback callers send as X-Feedback-Token; without it only local clients may report
+        'feedback_token': os.getenv('FEEDBACK_TOKEN') or None
+    }
+
+def get_ad_library_config():
+    """
+    Get settings for the library of pre-generated ads (built with python ad_library.py build)
+    """
+    return {
+        'path': os.getenv('AD_LIBRARY_PATH', 'ad_library'),
+        # Cosine similarity to a template's centroid needed to serve its stored ad instead of calling Gemini
+        'min_similarity': float(os.getenv('AD_LIBRARY_MIN_SIMILARITY', '0.45')),
+        # Similarity to one of a template's known messages that also serves its ad
+        'min_example_similarity': float(os.getenv('AD_LIBRARY_MIN_EXAMPLE_SIMILARITY', '0.6'))
+    }
+
+def get_server_config():
+    """
+    Get API server settings (start_server.py command-line flags override these)
+    """
+    return {
+        'host': os.getenv('SERVER_HOST', '127.0.0.1'),
+        'port': int(os.getenv('SERVER_PORT', '8007')),
+        # Worker processes; 1 keeps the single-process server
+        'workers': int(os.getenv('SERVER_WORKERS', '1')),
+        # Pending connection queue of the listening socket
+        'backlog': int(os.getenv('SERVER_BACKLOG', '2048')),
+        # Requests a worker serves before it is recycled (0 = never), plus random jitter
+        'max_requests': int(os.getenv('SERVER_MAX_REQUESTS', '0')),
+        'max_requests_jitter': int(os.getenv('SERVER_MAX_REQUESTS_JITTER', '0')),
+        # Seconds a stopping worker gets to finish in-flight requests
+        'graceful_timeout': float(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))
+    }
+
 # Example usage:
 # To set your API key as an environment variable:
 # export GEMINI_API_KEY="your_api_key_here"
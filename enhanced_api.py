@@ -1,15 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import google.generativeai as genai
-from config import get_gemini_api_key
+from pydantic import BaseModel, Field
+from config import (get_gemini_api_key, get_llm_config, get_cache_config, get_logging_config, get_model_config,
+                    get_online_learning_config, get_detection_config, get_ad_job_config, get_ad_library_config,
+                    get_near_duplicate_config, get_long_text_config, get_metrics_config)
+import json
 import pickle
-import re
-import string
-from nltk.corpus import stopwords
-import nltk
-from nltk.stem.porter import PorterStemmer
-from typing import Tuple
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
+import functools
+import hmac
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
 
@@ -18,8 +21,43 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import the improved rule-based detector
 from improved_rule_based_detector import ImprovedRuleBasedSpamDetector
+from text_preprocessing import advanced_text_preprocessing
+from gemini_registry import GeminiModelRegistry, ModelQuotaExceeded
+from llm_limiter import GeminiLimiter, LLMUnavailable, estimate_tokens
+from batch_translation import JSON_GENERATION_CONFIG, batch_translation_prompt, parse_batch_translations
+from ad_library import load_ad_library
+from near_duplicates import DECIDED_BY as NEAR_DUPLICATE, NearDuplicateIndex
+from long_text import WindowedScorer
+from ad_cache import AdCache, ad_cache_key
+from ad_stream import AdSectionParser, sse_event
+from single_flight import SingleFlight
+from ad_jobs import FINISHED_STATES, JOB_QUEUED, AdJobQueue, JobQueueFull, JobStore
+from model_artifacts import DEFAULT_ARTIFACT_ROOT
+from model_manager import CanaryAccuracyError, ModelBundle, ModelManager, ModelValidationError, load_canary
+from online_learning import FeedbackLog, OnlineLearner
+from detection_cascade import (CASCADE_MODES, STAGE_ML, STAGE_RULES, CascadeResult, StageCosts, combine_predictions,
+                               decided_by_ml, decided_by_rules)
+import metrics
+from metrics import timed
 
-app = FastAPI(title="Enhanced Cyber Awareness Ad API")
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # Started per process (after any fork), so every worker follows new model versions
+    _model_manager.start_watching(_model_config['watch_interval'])
+    if _online_learner is not None:
+        _online_learner.start()
+    _ad_jobs.start()
+    if _metrics_writer is not None:
+        _metrics_writer.start()
+    yield
+    await _ad_jobs.stop()
+    if _metrics_writer is not None:
+        _metrics_writer.stop()
+    _model_manager.stop_watching()
+    if _online_learner is not None:
+        _online_learner.stop()
+
+app = FastAPI(title="Enhanced Cyber Awareness Ad API", lifespan=_lifespan)
 
 # Ensure UTF-8 encoding
 import sys
@@ -35,6 +73,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+# With several workers each one saves its metrics to a shared directory, so a scrape sees them all
+_metrics_config = get_metrics_config()
+_metrics_writer: Optional[metrics.SnapshotWriter] = None
+if _metrics_config['directory']:
+    os.makedirs(_metrics_config['directory'], exist_ok=True)
+    _metrics_writer = metrics.SnapshotWriter(metrics.REGISTRY, _metrics_config['directory'],
+                                             _metrics_config['flush_interval'])
+
+_log_message_bodies = get_logging_config()['log_message_bodies']
 
 class GenerateRequest(BaseModel):
     text: str
@@ -47,106 +96,321 @@ class AnalyzeRequest(BaseModel):
     text: str
     languages: list[str] | None = None
 
+    # Return right after classification and generate the ad as a background job
+    # (default: AD_JOBS_DEFAULT)
+    async_ad: bool | None = None
+
+class AnalyzeBatchRequest(BaseModel):
+    texts: list[str] = Field(max_length=get_detection_config()['batch_max_items'])
+
+class FeedbackRequest(BaseModel):
+    text: str
+    # The correct classification: 'spam' or 'not_spam'
+    label: str
+    source: str | None = None
+
+class ModelReloadRequest(BaseModel):
+    version: str | None = None
+    # Also point the CURRENT file at the version so the other workers follow
+    publish: bool = True
+
+# Rate limits and circuit breaker in front of every Gemini call of this process
+_llm_config = get_llm_config()
+_llm_limiter = GeminiLimiter(
+    _llm_config['rpm_limit'],
+    _llm_config['tpm_limit'],
+    max_wait=_llm_config['limiter_max_wait'],
+    failure_threshold=_llm_config['breaker_failure_threshold'],
+    base_backoff=_llm_config['breaker_backoff'],
+    max_backoff=_llm_config['breaker_max_backoff']
+)
+
+# Resolved Gemini model, shared by every request in this process
+_gemini_registry = GeminiModelRegistry(
+    _llm_config['model_candidates'],
+    ttl_seconds=_llm_config['model_ttl_seconds'],
+    probe_timeout=_llm_config['probe_timeout'],
+    resolve_retry_seconds=_llm_config['resolve_retry_seconds'],
+    limiter=_llm_limiter
+)
+
+def _llm_unavailable(e: LLMUnavailable) -> HTTPException:
+    """503 with Retry-After for a call held back by the limiter or circuit breaker"""
+    return HTTPException(status_code=503, detail=f"{e}. Ad generation resumes automatically.",
+                         headers={'Retry-After': str(max(1, int(e.retry_after + 0.5)))})
+
 def get_model():
     api_key = get_gemini_api_key()
     if not api_key:
         raise HTTPException(status_code=500, detail="API key not configured")
-    genai.configure(api_key=api_key)
-    
-    # Try different model names, prioritizing the one that works
-    # Based on our testing, models/gemini-2.0-flash is working
-    for name in [
-        "models/gemini-2.0-flash",  # This one works based on our testing
-        "models/gemini-2.0-flash-001",
-        "models/gemini-1.5-flash-latest",
-        "models/gemini-1.5-flash-002", 
-        "models/gemini-1.5-flash",
-        "gemini-1.5-flash",
-        "gemini-1.5-pro",
-        "gemini-pro"
-    ]:
-        try:
-            model = genai.GenerativeModel(name)
-            # Test the model with a simple prompt
-            model.generate_content("Hello", request_options={"timeout": 10})
-            print(f"Successfully loaded model: {name}")
-            return model
-        except Exception as e:
-            print(f"Failed to load model {name}: {e}")
-            # If we get a quota error, don't try other models
-            if "429" in str(e):
-                raise HTTPException(status_code=429, detail="API quota exceeded. Please try again later or configure your own API key with higher quotas.")
-            continue
-    # If all models fail, return None to indicate no model is available
-    print("All models failed to load, returning None")
-    return None
+    try:
+        with timed('model_resolve'):
+            return _gemini_registry.get(api_key)
+    except LLMUnavailable as e:
+        raise _llm_unavailable(e)
+    except ModelQuotaExceeded:
+        metrics.quota_exceeded.inc(source='model_resolve')
+        raise HTTPException(status_code=429, detail="API quota exceeded. Please try again later or configure your own API key with higher quotas.")
 
-# Load improved classifier and vectorizer
-try:
-    _tfidf = pickle.load(open('robust_vectorizer.pkl', 'rb'))
-    _clf = pickle.load(open('robust_model.pkl', 'rb'))
-    print("Robust model loaded successfully!")
-except Exception as e:
-    print(f"Error loading robust model: {e}")
-    # Fallback to original model
+# Gemini SDK calls block, so they run on a bounded pool instead of the event loop
+_llm_executor = ThreadPoolExecutor(max_workers=_llm_config['max_workers'], thread_name_prefix="gemini")
+
+def _llm_acquire(prompt: str, purpose: str, outputs: int = 1) -> int:
+    """Reserve limiter capacity for one call; returns the estimated tokens (503 if the call is held back)"""
+    tokens = estimate_tokens(prompt) + _llm_config['estimated_output_tokens'] * outputs
+    try:
+        _llm_limiter.acquire(tokens)
+    except LLMUnavailable as e:
+        metrics.llm_calls.inc(purpose=purpose, outcome='held_back')
+        raise _llm_unavailable(e)
+    return tokens
+
+def _reported_tokens(resp) -> Optional[int]:
+    usage = getattr(resp, 'usage_metadata', None)
+    total = getattr(usage, 'total_token_count', None)
+    return total if isinstance(total, int) and total > 0 else None
+
+def _llm_failed(e: Exception, purpose: str):
+    if "429" in str(e):
+        metrics.quota_exceeded.inc(source='generation')
+        metrics.llm_calls.inc(purpose=purpose, outcome='quota_exceeded')
+    else:
+        metrics.llm_calls.inc(purpose=purpose, outcome='error')
+    _llm_limiter.record_failure(e)
+    _gemini_registry.report_failure(e)
+
+def _llm_generate(model, prompt: str, purpose: str, generation_config: Optional[dict] = None, outputs: int = 1) -> str:
+    """
+    Run one Gemini call, reporting failures so the cached model gets re-resolved.
+    outputs is the number of answers the prompt asks for, for the token estimate.
+    """
+    tokens = _llm_acquire(prompt, purpose, outputs)
     try:
-        _tfidf = pickle.load(open('improved_vectorizer.pkl', 'rb'))
-        _clf = pickle.load(open('improved_model.pkl', 'rb'))
-        print("Fallback to improved model")
-    except Exception as e2:
-        print(f"Error loading improved model: {e2}")
-        # Final fallback to original model
+        with timed(f'llm_{purpose}'):
+            resp = model.generate_content(prompt, generation_config=generation_config,
+                                          request_options={"timeout": _llm_config['call_timeout']})
+    except Exception as e:
+        _llm_failed(e, purpose)
+        raise
+    _llm_limiter.record_success(tokens, _reported_tokens(resp))
+    metrics.llm_calls.inc(purpose=purpose, outcome='success')
+    return resp.text
+
+async def _run_blocking(func, *args):
+    """Run a blocking call on the Gemini executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_llm_executor, functools.partial(func, *args))
+
+async def get_model_async():
+    return await _run_blocking(get_model)
+
+async def _llm_generate_async(model, prompt: str, purpose: str, generation_config: Optional[dict] = None,
+                              outputs: int = 1) -> str:
+    # The SDK timeout stops the worker thread; wait_for also bounds time spent queued for a thread
+    try:
+        return await asyncio.wait_for(_run_blocking(_llm_generate, model, prompt, purpose, generation_config, outputs),
+                                      timeout=_llm_config['call_timeout'] + 5)
+    except asyncio.TimeoutError:
+        metrics.llm_calls.inc(purpose=purpose, outcome='timeout')
+        raise
+
+def _llm_stream(model, prompt: str, purpose: str, emit: Callable[[str], None]) -> str:
+    """Run one streaming Gemini call, passing each text chunk to emit as it arrives; returns the full text"""
+    parts = []
+    tokens = _llm_acquire(prompt, purpose)
+    try:
+        with timed(f'llm_{purpose}'):
+            resp = model.generate_content(prompt, stream=True, request_options={"timeout": _llm_config['call_timeout']})
+            for chunk in resp:
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    emit(text)
+    except Exception as e:
+        _llm_failed(e, purpose)
+        raise
+    # A finished stream carries the usage of the whole response
+    _llm_limiter.record_success(tokens, _reported_tokens(resp))
+    metrics.llm_calls.inc(purpose=purpose, outcome='success')
+    return ''.join(parts)
+
+async def _llm_stream_async(model, prompt: str, purpose: str) -> AsyncIterator[str]:
+    """Text chunks of a streaming Gemini call, relayed from the executor thread to the event loop"""
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    future = loop.run_in_executor(
+        _llm_executor,
+        functools.partial(_llm_stream, model, prompt, purpose, lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text)))
+    # Scheduled after every chunk the thread emitted, so None marks the end of the stream
+    future.add_done_callback(lambda _: chunks.put_nowait(None))
+    while True:
+        # Bound the wait for each chunk (including time queued for a thread), not the whole ad
         try:
-            _tfidf = pickle.load(open('vectorizer.pkl', 'rb'))
-            _clf = pickle.load(open('model.pkl', 'rb'))
-            print("Fallback to original model")
-        except Exception as e3:
-            print(f"Error loading original model: {e3}")
-            _tfidf = None
-            _clf = None
+            text = await asyncio.wait_for(chunks.get(), timeout=_llm_config['call_timeout'] + 5)
+        except asyncio.TimeoutError:
+            metrics.llm_calls.inc(purpose=purpose, outcome='timeout')
+            raise
+        if text is None:
+            break
+        yield text
+    await future  # re-raises a failed call
 
-# Initialize improved rule-based detector
-_rule_detector = ImprovedRuleBasedSpamDetector()
-_ps = PorterStemmer()
+# Identical work already running for another request is awaited instead of repeated
+_ad_flights = SingleFlight('ad')
+_translation_flights = SingleFlight('translation')
+_analyze_flights = SingleFlight('analyze')
 
-def advanced_text_preprocessing(text: str) -> str:
-    """Advanced text preprocessing for better feature extraction"""
-    # Convert to lowercase
-    text = text.lower()
-    
-    # Remove URLs
-    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
-    
-    # Remove email addresses
-    text = re.sub(r'\S+@\S+', '', text)
-    
-    # Remove phone numbers
-    text = re.sub(r'\d{3,}', '', text)
-    
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # Tokenize
-    tokens = nltk.word_tokenize(text)
+async def _translate_batch(model, ad_text: str, languages: List[str]) -> Dict[str, str]:
+    """Valid translations from one JSON-mode call for all languages; {} if the call fails"""
+    try:
+        response = await _llm_generate_async(model, batch_translation_prompt(languages, ad_text), 'translation_batch',
+                                             JSON_GENERATION_CONFIG, outputs=len(languages))
+    except Exception as e:
+        print(f"Batch translation failed, translating languages one by one: {e}")
+        return {}
+    translations = parse_batch_translations(response, languages, ad_text)
+    missing = [lang for lang in languages if lang not in translations]
+    if missing:
+        print(f"Batch translation incomplete, translating one by one: {missing}")
+    return translations
+
+def _start_batch(model, kind: str, ad_text: str, languages: List[str]) -> Optional[asyncio.Future]:
+    """Start a batch translation for the languages not already in flight, when batching applies"""
+    if not _llm_config['batch_translation']:
+        return None
+    languages = [lang for lang in languages if not _translation_flights.in_flight(ad_cache_key(kind, ad_text, lang))]
+    if len(languages) < 2:
+        return None
+    return asyncio.ensure_future(_translate_batch(model, ad_text, languages))
+
+async def _translate_one(model, kind: str, ad_text: str, lang: str, prompt: str, semaphore: asyncio.Semaphore,
+                         batch: Optional[asyncio.Future] = None) -> str:
+    """
+    Translate and cache one language, joining an identical translation already in flight.
+    With a batch, its translation is used unless it is missing or malformed.
+    """
+    async def translate() -> str:
+        translated = (await batch).get(lang) if batch is not None else None
+        if translated is None:
+            async with semaphore:
+                translated = await _llm_generate_async(model, prompt, 'translation')
+        await _cache_set(ad_cache_key(kind, ad_text, lang), translated)
+        return translated
+    return await _translation_flights.do(ad_cache_key(kind, ad_text, lang), translate)
+
+async def _translate_all(model, kind: str, ad_text: str, prompts: Dict[str, str]) -> Dict[str, str]:
+    """
+    Translate into every language of prompts, keeping the request order: one batch call
+    for all of them when enabled, then concurrent (capped) single calls for the rest
+    """
+    semaphore = asyncio.Semaphore(_llm_config['translation_concurrency'])
+    batch = _start_batch(model, kind, ad_text, list(prompts))
     
-    # Remove punctuation and non-alphabetic tokens
-    tokens = [token for token in tokens if token.isalpha() and len(token) > 1]
+    async def translate_one(lang: str, prompt: str) -> Tuple[str, str]:
+        return lang, await _translate_one(model, kind, ad_text, lang, prompt, semaphore, batch)
     
-    # Remove stopwords
+    pairs = await asyncio.gather(*(translate_one(lang, prompt) for lang, prompt in prompts.items()))
+    return dict(pairs)
+
+# Load improved classifier and vectorizer
+# Model files are looked up next to this module so the API also works when started from elsewhere
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _model_path(name: str) -> str:
+    return os.path.join(_BASE_DIR, name)
+
+# Fallback chain of pickled models: (vectorizer file, model file, name, message when loaded)
+_PICKLED_MODELS = [
+    ('robust_vectorizer.pkl', 'robust_model.pkl', 'robust', "Robust model loaded successfully!"),
+    ('improved_vectorizer.pkl', 'improved_model.pkl', 'improved', "Fallback to improved model"),
+    ('vectorizer.pkl', 'model.pkl', 'original', "Fallback to original model"),
+]
+
+_model_config = get_model_config()
+def _load_canary() -> Optional[List[Tuple[str, int]]]:
+    """Canary sample from MODEL_CANARY_DATA, or None for the built-in set"""
     try:
-        stop_words = set(stopwords.words('english'))
-        tokens = [token for token in tokens if token not in stop_words]
-    except:
-        # Fallback if stopwords not available
-        pass
-    
-    # Stemming
-    tokens = [_ps.stem(token) for token in tokens]
+        return load_canary(_model_path(_model_config['canary_data']), _model_config['canary_size'])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Warning: could not read canary data {_model_config['canary_data']} ({e}); "
+              f"checking models on the built-in canary messages")
+        return None
+
+_model_manager = ModelManager(
+    _model_config['artifact_root'] or _model_path(DEFAULT_ARTIFACT_ROOT),
+    advanced_text_preprocessing,
+    canary_min_accuracy=_model_config['canary_min_accuracy'],
+    canary=_load_canary(),
+    canary_max_regression=_model_config['canary_max_regression']
+)
+
+def _load_initial_model() -> Optional[ModelBundle]:
+    """Current artifact version if there is one (no pickle, pages shared between workers), else the pickles"""
+    version = _model_manager.current_version()
+    if version is not None:
+        try:
+            bundle = _model_manager.load_version(version)
+            print(f"Model artifacts loaded from {bundle.source}")
+            return bundle
+        except ModelValidationError as e:
+            print(f"Error loading model artifacts: {e}")
     
-    return " ".join(tokens)
+    for vectorizer_file, model_file, name, loaded_message in _PICKLED_MODELS:
+        try:
+            tfidf = pickle.load(open(_model_path(vectorizer_file), 'rb'))
+            clf = pickle.load(open(_model_path(model_file), 'rb'))
+            print(loaded_message)
+            return ModelBundle(model_file, tfidf, clf, source=_model_path(model_file))
+        except Exception as e:
+            print(f"Error loading {name} model: {e}")
+    return None
+
+_initial_model = _load_initial_model()
+if _initial_model is not None:
+    try:
+        _model_manager.validate(_initial_model)
+        _model_manager.activate(_initial_model)
+    except CanaryAccuracyError as e:
+        # The model works, and nothing better is available: serve it, but make the failure hard to miss
+        print("=" * 70)
+        print(f"WARNING: {e}")
+        print("Serving it anyway because it is the only model; ship a better one or lower MODEL_CANARY_MIN_ACCURACY")
+        print("=" * 70)
+        _model_manager.activate(_initial_model)
+    except ModelValidationError as e:
+        # Serve rules-only rather than a model that can't score (a reload can still activate one)
+        print(f"Warning: {e}; using rule-based detection only")
+
+# Feedback-trained online model (ONLINE_LEARNING=true); feedback is logged either way
+_online_config = get_online_learning_config()
+_feedback_log = FeedbackLog(_model_path(_online_config['feedback_db']))
+_online_learner: Optional[OnlineLearner] = None
+if _online_config['enabled']:
+    _online_learner = OnlineLearner(
+        _feedback_log,
+        _model_path(_online_config['snapshot_path']),
+        n_features=_online_config['hash_features'],
+        batch_size=_online_config['batch_size'],
+        poll_interval=_online_config['poll_interval'],
+        snapshot_interval=_online_config['snapshot_interval'],
+        min_samples=_online_config['min_samples'],
+        # Every online update must pass the same canary check as a batch-trained model: the canary
+        # sample, and no more than canary_max_regression below the batch-trained model
+        validate=_model_manager.validate
+    )
+    _online_learner.load_snapshot()
 
-def _generate_ad(model, text: str) -> str:
-    prompt = f"""
+def _active_bundle() -> Optional[ModelBundle]:
+    """Model used for scoring: the online model once it is published (enough samples, canary passed), else the batch-trained one"""
+    if _online_learner is not None and _online_learner.bundle is not None:
+        return _online_learner.bundle
+    return _model_manager.active
+
+# Initialize improved rule-based detector
+_rule_detector = ImprovedRuleBasedSpamDetector()
+
+def _ad_prompt(text: str) -> str:
+    return f"""
     Create a highly creative, engaging, and visually appealing cyber awareness advertisement derived from this spam message: "{text}".
     
     Make it fun, memorable, and shareable on social media. Use modern marketing language and creative storytelling.
@@ -160,93 +424,543 @@ def _generate_ad(model, text: str) -> str:
     Key Takeaway: <one-sentence main rule with emoji>
     Call to Action: <one short instruction with emoji>
     """
-    resp = model.generate_content(prompt)
-    return resp.text
 
-def hybrid_spam_detection(text: str) -> Tuple[int, float]:
+async def _generate_ad(model, text: str) -> str:
+    return await _llm_generate_async(model, _ad_prompt(text), 'ad')
+
+# Generated ads and translations, keyed by content so repeat campaigns skip Gemini
+_cache_config = get_cache_config()
+_ad_cache = AdCache(
+    max_entries=_cache_config['max_entries'],
+    ttl_seconds=_cache_config['ttl_seconds'],
+    db_path=_cache_config['db_path'],
+    db_max_entries=_cache_config['db_max_entries']
+)
+
+async def _cache_get(key: str) -> Optional[str]:
+    """Cache lookup; when the cache is persistent, a memory miss reads SQLite on a thread"""
+    if not _ad_cache.persistent:
+        return _ad_cache.get(key)
+    value = _ad_cache.get_cached(key)
+    if value is None:
+        loop = asyncio.get_running_loop()
+        value = await loop.run_in_executor(None, _ad_cache.get, key)
+    return value
+
+async def _cache_set(key: str, value: str):
+    """Cache a value; writes to the SQLite file run on a thread"""
+    if not _ad_cache.persistent:
+        _ad_cache.set(key, value)
+        return
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _ad_cache.set, key, value)
+
+def _ad_translation_prompt(lang: str, ad_text: str) -> str:
+    return f"""
+                            Translate the following ad into {lang}. Preserve labels and bullets. Output PLAIN TEXT only (no markdown symbols).
+                            {ad_text}
+                            """
+
+def _markdown_translation_prompt(lang: str, ad_text: str) -> str:
+    return f"""
+            Translate the following content into {lang}. Preserve Markdown structure and headings:
+            **Headline:**
+            **Ad Content:**
+            **Key Takeaway:**
+            **Call to Action:**
+            ---
+            {ad_text}
+            """
+
+# Pre-generated ads for known spam templates (python ad_library.py build)
+_ad_library_config = get_ad_library_config()
+_ad_library = load_ad_library(_model_path(_ad_library_config['path']), _ad_library_config['min_similarity'],
+                              _ad_library_config['min_example_similarity'])
+
+async def _stored_ad(text: str) -> Optional[str]:
     """
-    Improved hybrid spam detection combining ML model and rule-based approach
-    Returns: (prediction, confidence) where prediction is 1 for spam, 0 for ham
+    Ad for a message without calling Gemini: cached for this message, generated
+    for a recent near-duplicate, or stored for its spam template
     """
-    # Get ML model prediction if available
-    ml_prediction = None
-    ml_confidence = 0.0
+    ad_text = await _cache_get(ad_cache_key('ad', text))
+    if ad_text is None and _near_duplicates is not None:
+        ad_text = _near_duplicates.find_ad(text)
+    if ad_text is not None or _ad_library is None:
+        return ad_text
+    match = _ad_library.lookup(text)
+    metrics.ad_library_lookups.inc(outcome='hit' if match is not None else 'miss')
+    return match.ad if match is not None else None
+
+async def _store_ad(text: str, ad_text: str):
+    """Cache a generated ad for the message and for its near-duplicates"""
+    await _cache_set(ad_cache_key('ad', text), ad_text)
+    if _near_duplicates is not None:
+        _near_duplicates.set_ad(text, ad_text)
+
+async def _stored_translation(kind: str, ad_text: str, lang: str) -> Optional[str]:
+    translated = await _cache_get(ad_cache_key(kind, ad_text, lang))
+    if translated is None and kind == 'ad_translation' and _ad_library is not None:
+        translated = _ad_library.translation(ad_text, lang)
+    return translated
+
+async def _cached_ad(text: str) -> Optional[str]:
+    """Ad for a message, from the cache, the ad library or Gemini. Returns None if no model is available."""
+    key = ad_cache_key('ad', text)
+    ad_text = await _stored_ad(text)
+    if ad_text is not None:
+        return ad_text
     
-    if _tfidf is not None and _clf is not None:
+    async def generate() -> Optional[str]:
+        model = await get_model_async()
+        if model is None:
+            return None
+        generated = await _generate_ad(model, text)
+        await _store_ad(text, generated)
+        return generated
+    return await _ad_flights.do(key, generate)
+
+async def _cached_translations(kind: str, ad_text: str, languages: List[str],
+                               build_prompt: Callable[[str, str], str]) -> Optional[Dict[str, str]]:
+    """
+    Translations of ad_text, only calling Gemini for languages that aren't cached.
+    Returns None if some are missing and no model is available.
+    """
+    translations = {}
+    prompts = {}
+    for lang in languages:
+        cached = await _stored_translation(kind, ad_text, lang)
+        if cached is None:
+            prompts[lang] = build_prompt(lang, ad_text)
+        else:
+            translations[lang] = cached
+    if prompts:
+        model = await get_model_async()
+        if model is None:
+            return None
+        translations.update(await _translate_all(model, kind, ad_text, prompts))
+    return {lang: translations[lang] for lang in languages}
+
+_AD_UNAVAILABLE = "Ad generation service is temporarily unavailable. This may be due to API quota limitations or model access issues."
+_TRANSLATION_UNAVAILABLE = "Translation service is temporarily unavailable. This may be due to API quota limitations or model access issues."
+
+async def _stream_translations(kind: str, ad_text: str, languages: List[str],
+                               build_prompt: Callable[[str, str], str]) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """
+    (language, translation) pairs as they become available: cached ones first,
+    then each Gemini translation as soon as it finishes. A failed language
+    yields (language, None) without stopping the others.
+    """
+    prompts = {}
+    for lang in languages:
+        cached = await _stored_translation(kind, ad_text, lang)
+        if cached is None:
+            prompts[lang] = build_prompt(lang, ad_text)
+        else:
+            yield lang, cached
+    if not prompts:
+        return
+    model = await get_model_async()
+    if model is None:
+        for lang in prompts:
+            yield lang, None
+        return
+    
+    semaphore = asyncio.Semaphore(_llm_config['translation_concurrency'])
+    batch = _start_batch(model, kind, ad_text, list(prompts))
+    
+    async def translate_one(lang: str, prompt: str) -> Tuple[str, Optional[str]]:
         try:
-            # Preprocess the text
-            transformed = advanced_text_preprocessing(text)
-            
-            # Transform and predict
-            vec = _tfidf.transform([transformed])
-            ml_prediction = _clf.predict(vec)[0]
-            prob = _clf.predict_proba(vec)[0]
-            ml_confidence = max(prob)
+            return lang, await _translate_one(model, kind, ad_text, lang, prompt, semaphore, batch)
         except Exception as e:
-            print(f"ML model prediction error: {e}")
+            print(f"Translation to {lang} failed: {e}")
+            return lang, None
     
-    # Get improved rule-based prediction
-    rule_prediction, rule_confidence = _rule_detector.predict(text)
+    for finished in asyncio.as_completed([translate_one(lang, prompt) for lang, prompt in prompts.items()]):
+        yield await finished
+
+async def _ad_events(text: str, languages: Optional[List[str]]) -> AsyncIterator[str]:
+    """
+    Server-sent events for the ad of a spam message: ad_delta (raw text as
+    Gemini writes it), ad_section (each finished headline / bullet / takeaway /
+    call to action line), ad (the complete text), then one translation event
+    per language as it completes. Failures are sent as error events.
+    """
+    key = ad_cache_key('ad', text)
+    ad_text = await _stored_ad(text)
+    sections = AdSectionParser()
+    try:
+        if ad_text is None and _ad_flights.in_flight(key):
+            # Another request is already generating this ad: wait for it rather than stream a second one
+            ad_text = await _cached_ad(text)
+            if ad_text is None:
+                yield sse_event('error', {"stage": "ad", "detail": _AD_UNAVAILABLE})
+                return
+        if ad_text is None:
+            model = await get_model_async()
+            if model is None:
+                yield sse_event('error', {"stage": "ad", "detail": _AD_UNAVAILABLE})
+                return
+            parts = []
+            with timed('ad_generation'):
+                async for delta in _llm_stream_async(model, _ad_prompt(text), 'ad'):
+                    parts.append(delta)
+                    yield sse_event('ad_delta', {"text": delta})
+                    for section in sections.feed(delta):
+                        yield sse_event('ad_section', section)
+            ad_text = ''.join(parts)
+            await _store_ad(text, ad_text)
+        else:
+            # Cached or from the ad library: the whole ad is available at once
+            for section in sections.feed(ad_text):
+                yield sse_event('ad_section', section)
+        for section in sections.close():
+            yield sse_event('ad_section', section)
+        yield sse_event('ad', {"ad": ad_text})
+    except HTTPException as he:
+        yield sse_event('error', {"stage": "ad", "status": he.status_code, "detail": he.detail})
+        return
+    except Exception as e:
+        print(f"Ad generation failed: {e}")
+        yield sse_event('error', {"stage": "ad", "detail": _AD_UNAVAILABLE})
+        return
     
-    # Improved combination logic
-    if ml_prediction is not None:
-        # If both models agree, use higher confidence
-        if ml_prediction == rule_prediction:
-            combined_confidence = max(ml_confidence, rule_confidence)
-            final_prediction = ml_prediction
+    if languages:
+        try:
+            with timed('translation'):
+                async for lang, translated in _stream_translations('ad_translation', ad_text, languages,
+                                                                   _ad_translation_prompt):
+                    if translated is None:
+                        yield sse_event('error', {"stage": "translation", "language": lang,
+                                                  "detail": _TRANSLATION_UNAVAILABLE})
+                    else:
+                        yield sse_event('translation', {"language": lang, "text": translated})
+        except HTTPException as he:
+            yield sse_event('error', {"stage": "translation", "status": he.status_code, "detail": he.detail})
+
+async def _ad_result(text: str, languages: Optional[List[str]]) -> Dict[str, object]:
+    """Ad and translations for a spam message, as added to the /analyze response"""
+    result: Dict[str, object] = {}
+    try:
+        with timed('ad_generation'):
+            ad_text = await _cached_ad(text)
+        if ad_text is not None:
+            result["ad"] = ad_text
+            if languages:
+                with timed('translation'):
+                    translations = await _cached_translations('ad_translation', ad_text, languages, _ad_translation_prompt)
+                if translations is not None:
+                    result["translations"] = translations
+                else:
+                    result["ad_generation_error"] = _TRANSLATION_UNAVAILABLE
         else:
-            # If they disagree, be more aggressive in trusting the improved rule-based detector
-            # The improved rule-based detector is more reliable for known spam patterns
-            
-            # Check if this is a known spam pattern that the rule detector recognizes with confidence
-            if rule_confidence > 0.4:  # Moderate confidence from improved rules
-                # If rule-based has moderate to high confidence, trust it more
-                final_prediction = rule_prediction
-                # Boost confidence since we trust the improved rules
-                combined_confidence = min(1.0, rule_confidence + 0.15)
-            elif ml_confidence > 0.95:  # Very high confidence from ML (only trust if extremely sure)
-                # If ML is very confident, trust it
-                final_prediction = ml_prediction
-                combined_confidence = ml_confidence
-            else:
-                # Default to rule-based when in doubt, as it's more reliable for spam detection
-                final_prediction = rule_prediction
-                combined_confidence = rule_confidence
+            result["ad_generation_error"] = _AD_UNAVAILABLE
+    except HTTPException as he:
+        # Quota exhausted or Gemini held back by the limiter: the classification stands, the ad is skipped
+        result["ad_generation_error"] = he.detail
+        retry_after = (he.headers or {}).get('Retry-After')
+        if retry_after is not None:
+            result["ad_retry_after"] = int(retry_after)
+    except Exception as e:
+        # If ad generation fails, continue without it but provide a clear message
+        print(f"Ad generation failed: {e}")
+        result["ad_generation_error"] = "Unable to generate cyber awareness ad at this time. This may be due to API quota limitations or model access issues."
+    return result
+
+async def _run_ad_job(payload: Dict[str, object]) -> Dict[str, object]:
+    return await _ad_result(payload['text'], payload.get('languages'))
+
+# Background ad jobs (/analyze with async_ad); workers start with the app in each process
+_ad_job_config = get_ad_job_config()
+_ad_jobs = AdJobQueue(
+    JobStore(_model_path(_ad_job_config['db_path']), ttl_seconds=_ad_job_config['result_ttl']),
+    _run_ad_job,
+    workers=_ad_job_config['workers'],
+    max_queue=_ad_job_config['max_queue']
+)
+
+def _event_stream(events: AsyncIterator[str]) -> StreamingResponse:
+    # no-cache and X-Accel-Buffering stop proxies from holding events back
+    return StreamingResponse(events, media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Detection stages are ordered by their measured cost in this process
+_cascade_mode = get_detection_config()['cascade_mode']
+if _cascade_mode not in CASCADE_MODES:
+    print(f"Warning: unknown CASCADE_MODE '{_cascade_mode}', using 'exact'")
+    _cascade_mode = 'exact'
+_stage_costs = StageCosts((STAGE_RULES, STAGE_ML))
+
+def _ml_predict(text: str, bundle: Optional[ModelBundle]) -> Tuple[Optional[int], float]:
+    """ML (prediction, confidence) for one message, or (None, 0.0) without a usable model"""
+    if bundle is None:
+        return None, 0.0
+    try:
+        # Preprocess the text
+        with timed('preprocess'):
+            transformed = advanced_text_preprocessing(text)
+        
+        if bundle.scorer is not None:
+            # Label and probability from one sparse dot product
+            with timed('ml_predict'):
+                return bundle.scorer.predict(transformed)
+        # Transform and predict
+        with timed('vectorize'):
+            vec = bundle.vectorizer.transform([transformed])
+        with timed('ml_predict'):
+            ml_prediction = bundle.classifier.predict(vec)[0]
+            prob = bundle.classifier.predict_proba(vec)[0]
+            return ml_prediction, max(prob)
+    except Exception as e:
+        print(f"ML model prediction error: {e}")
+        return None, 0.0
+
+def _ml_predict_batch(texts: List[str], bundle: ModelBundle) -> List[Tuple[Optional[int], float]]:
+    """ML (prediction, confidence) for each message, vectorized and scored together"""
+    try:
+        # Preprocess and vectorize the whole batch at once
+        with timed('batch_preprocess'):
+            transformed = [advanced_text_preprocessing(text) for text in texts]
+        if bundle.scorer is not None:
+            with timed('batch_ml_predict'):
+                return bundle.scorer.predict_many(transformed)
+        with timed('batch_vectorize'):
+            vecs = bundle.vectorizer.transform(transformed)
+        
+        # One predict_proba call; the label is the class with the highest probability
+        with timed('batch_ml_predict'):
+            probs = bundle.classifier.predict_proba(vecs)
+            best = probs.argmax(axis=1)
+            return list(zip(bundle.classifier.classes_[best], probs.max(axis=1)))
+    except Exception as e:
+        # Fall back to scoring one message at a time so a single bad text
+        # only loses the ML signal for itself
+        print(f"ML model batch prediction error: {e}")
+        return [_ml_predict(text, bundle) for text in texts]
+
+def _stage_decision(stage: str, result: Tuple, mode: str) -> Optional[Tuple[int, float]]:
+    if stage == STAGE_RULES:
+        return decided_by_rules(result[0], result[1], mode)
+    return decided_by_ml(result[0], result[1], mode, _rule_detector.spam_threshold)
+
+def _detection_stages(bundle: Optional[ModelBundle], mode: str) -> List[str]:
+    if bundle is None:
+        return [STAGE_RULES]
+    if mode == 'off':
+        return [STAGE_RULES, STAGE_ML]
+    return _stage_costs.order()
+
+# Verdicts of recent messages, reused for near-duplicates (campaign variants)
+_near_duplicate_config = get_near_duplicate_config()
+_near_duplicates: Optional[NearDuplicateIndex] = None
+if _near_duplicate_config['enabled']:
+    _near_duplicates = NearDuplicateIndex(
+        max_entries=_near_duplicate_config['max_entries'],
+        ttl_seconds=_near_duplicate_config['ttl_seconds'],
+        max_distance=_near_duplicate_config['max_distance'],
+        min_shingles=_near_duplicate_config['min_shingles']
+    )
+
+# Long texts (email bodies) are scored in segments, with a cap on the work per message
+_long_text_config = get_long_text_config()
+_windowed_scorer = WindowedScorer(
+    segment_chars=_long_text_config['segment_chars'],
+    overlap_chars=_long_text_config['overlap_chars'],
+    max_segments=_long_text_config['max_segments'],
+    stop_confidence=_long_text_config['stop_confidence']
+)
+
+def _verdict_version(bundle: Optional[ModelBundle], mode: str) -> str:
+    """What a verdict depends on besides the text: the model version and the cascade mode"""
+    return f"{bundle.version if bundle is not None else 'rules-only'}:{mode}"
+
+def classify_message(text: str, bundle: Optional[ModelBundle] = None, mode: Optional[str] = None) -> CascadeResult:
+    """
+    Hybrid detection as a cascade: stages run cheapest first and the rest are
+    skipped once the result can't change (see detection_cascade.py). Long texts are
+    scored in segments (see long_text.py). A near-duplicate of a recently classified
+    message reuses its verdict without running any stage.
+    Pass bundle to pin the model version and mode to override CASCADE_MODE.
+    """
+    bundle = bundle or _active_bundle()
+    mode = mode or _cascade_mode
+    segments = _windowed_scorer.segments(text)
+    if _near_duplicates is None:
+        return _classify(text, segments, bundle, mode)
+    version = _verdict_version(bundle, mode)
+    with timed('near_duplicate'):
+        # A long text's verdict only depends on the part the segment cap lets us score
+        fingerprint = _near_duplicates.fingerprint(text if segments is None else text[:segments[-1][1]])
+        duplicate = _near_duplicates.lookup(fingerprint, version)
+    if duplicate is not None:
+        metrics.cascade_decisions.inc(decided_by=NEAR_DUPLICATE)
+        return CascadeResult(duplicate.prediction, duplicate.confidence, (NEAR_DUPLICATE,), NEAR_DUPLICATE,
+                             duplicate.similarity)
+    result = _classify(text, segments, bundle, mode)
+    _near_duplicates.add(fingerprint, version, result.prediction, result.confidence)
+    return result
+
+def _classify(text: str, segments: Optional[List[Tuple[int, int]]], bundle: Optional[ModelBundle],
+              mode: str) -> CascadeResult:
+    if segments is None:
+        return _run_cascade(text, bundle, mode)
+    with timed('windowed'):
+        decisive, results, report = _windowed_scorer.score(
+            text, segments, lambda segment: _run_cascade(segment, bundle, mode))
+    if report.stopped_early:
+        metrics.windowed_messages.inc(outcome='stopped_early')
     else:
-        # Fallback to rule-based only
-        final_prediction = rule_prediction
-        combined_confidence = rule_confidence
+        metrics.windowed_messages.inc(outcome='capped' if report.capped else 'complete')
+    stages = tuple(dict.fromkeys(stage for result in results for stage in result.stages))
+    return CascadeResult(decisive.prediction, decisive.confidence, stages, decisive.decided_by, window=report)
+
+def _run_cascade(text: str, bundle: Optional[ModelBundle], mode: str) -> CascadeResult:
+    stages = _detection_stages(bundle, mode)
+    results = {}
+    for position, stage in enumerate(stages):
+        with _stage_costs.measure(stage):
+            if stage == STAGE_RULES:
+                with timed('rules'):
+                    results[stage] = _rule_detector.predict(text)
+            else:
+                results[stage] = _ml_predict(text, bundle)
+        if position < len(stages) - 1:
+            decided = _stage_decision(stage, results[stage], mode)
+            if decided is not None:
+                metrics.cascade_decisions.inc(decided_by=stage)
+                return CascadeResult(decided[0], decided[1], tuple(stages[:position + 1]), stage)
     
-    return int(final_prediction), float(combined_confidence)
+    ml_prediction, ml_confidence = results.get(STAGE_ML, (None, 0.0))
+    rule_prediction, rule_confidence = results[STAGE_RULES]
+    prediction, confidence = combine_predictions(ml_prediction, ml_confidence, rule_prediction, rule_confidence)
+    metrics.cascade_decisions.inc(decided_by='combined')
+    return CascadeResult(prediction, confidence, tuple(stages), 'combined')
+
+def classify_messages(texts: List[str], bundle: Optional[ModelBundle] = None,
+                      mode: Optional[str] = None) -> List[CascadeResult]:
+    """
+    Batch version of classify_message: each stage scores every message still
+    undecided in one pass (the ML stage with the linear scorer's batch call, or one
+    vectorize + predict_proba for other models).
+    """
+    bundle = bundle or _active_bundle()
+    mode = mode or _cascade_mode
+    stages = _detection_stages(bundle, mode)
+    stage_results: Dict[str, list] = {stage: [None] * len(texts) for stage in stages}
+    final: List[Optional[CascadeResult]] = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        # Long texts are scored segment by segment, on their own
+        if _windowed_scorer.is_long(text):
+            final[i] = classify_message(text, bundle, mode)
+        else:
+            pending.append(i)
+    
+    fingerprints: List[Optional[int]] = [None] * len(texts)
+    if _near_duplicates is not None:
+        version = _verdict_version(bundle, mode)
+        with timed('batch_near_duplicate'):
+            undecided = []
+            for i in pending:
+                fingerprints[i] = _near_duplicates.fingerprint(texts[i])
+                duplicate = _near_duplicates.lookup(fingerprints[i], version)
+                if duplicate is None:
+                    undecided.append(i)
+                    continue
+                metrics.cascade_decisions.inc(decided_by=NEAR_DUPLICATE)
+                final[i] = CascadeResult(duplicate.prediction, duplicate.confidence, (NEAR_DUPLICATE,),
+                                         NEAR_DUPLICATE, duplicate.similarity)
+            pending = undecided
+    classified = list(pending)
+    
+    for position, stage in enumerate(stages):
+        if not pending:
+            break
+        batch = [texts[i] for i in pending]
+        with _stage_costs.measure(stage, len(batch)):
+            if stage == STAGE_RULES:
+                with timed('batch_rules'):
+                    outputs = [_rule_detector.predict(text) for text in batch]
+            else:
+                outputs = _ml_predict_batch(batch, bundle)
+        
+        undecided = []
+        for i, output in zip(pending, outputs):
+            stage_results[stage][i] = output
+            decided = _stage_decision(stage, output, mode) if position < len(stages) - 1 else None
+            if decided is not None:
+                metrics.cascade_decisions.inc(decided_by=stage)
+                final[i] = CascadeResult(decided[0], decided[1], tuple(stages[:position + 1]), stage)
+            else:
+                undecided.append(i)
+        pending = undecided
+    
+    for i in pending:
+        ml_prediction, ml_confidence = stage_results[STAGE_ML][i] if STAGE_ML in stage_results else (None, 0.0)
+        rule_prediction, rule_confidence = stage_results[STAGE_RULES][i]
+        prediction, confidence = combine_predictions(ml_prediction, ml_confidence, rule_prediction, rule_confidence)
+        metrics.cascade_decisions.inc(decided_by='combined')
+        final[i] = CascadeResult(prediction, confidence, tuple(stages), 'combined')
+    
+    if _near_duplicates is not None:
+        for i in classified:
+            _near_duplicates.add(fingerprints[i], version, final[i].prediction, final[i].confidence)
+    return final
+
+def _detection_fields(detection: CascadeResult) -> dict:
+    """
+    Response fields for the stages that ran, with the similarity when a near-duplicate's
+    verdict was reused and how much was examined when a long text was scored in segments
+    """
+    fields = {"stages": list(detection.stages)}
+    if detection.similarity is not None:
+        fields["near_duplicate_similarity"] = round(detection.similarity, 4)
+    if detection.window is not None:
+        fields["examined"] = detection.window._asdict()
+    return fields
+
+def hybrid_spam_detection(text: str, bundle: Optional[ModelBundle] = None) -> Tuple[int, float]:
+    """
+    Improved hybrid spam detection combining ML model and rule-based approach
+    Returns: (prediction, confidence) where prediction is 1 for spam, 0 for ham
+    Pass bundle to pin the model version (default: the active model)
+    """
+    result = classify_message(text, bundle)
+    return result.prediction, result.confidence
+
+def hybrid_spam_detection_batch(texts: List[str], bundle: Optional[ModelBundle] = None) -> List[Tuple[int, float]]:
+    """
+    Batch version of hybrid_spam_detection (see classify_messages).
+    Returns one (prediction, confidence) per text, in order.
+    """
+    return [(result.prediction, result.confidence) for result in classify_messages(texts, bundle)]
 
 @app.post("/generate-ad")
 async def generate_ad(req: GenerateRequest):
     try:
-        model = get_model()
-        ad = _generate_ad(model, req.text)
+        ad = await _cached_ad(req.text)
+        if ad is None:
+            raise HTTPException(status_code=503, detail="Ad generation service is temporarily unavailable.")
         return {"ad": ad}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-ad-stream")
+async def generate_ad_stream(req: GenerateRequest):
+    """/generate-ad as server-sent events: the ad is streamed while Gemini writes it"""
+    async def events():
+        async for event in _ad_events(req.text, None):
+            yield event
+        yield sse_event('done', {})
+    return _event_stream(events())
+
 @app.post("/translate")
 async def translate(req: TranslateRequest):
     try:
-        model = get_model()
-        translations = {}
-        for lang in req.languages:
-            prompt = f"""
-            Translate the following content into {lang}. Preserve Markdown structure and headings:
-            **Headline:**
-            **Ad Content:**
-            **Key Takeaway:**
-            **Call to Action:**
-            ---
-            {req.ad_text}
-            """
-            resp = model.generate_content(prompt)
-            translations[lang] = resp.text
+        translations = await _cached_translations('translate', req.ad_text, req.languages, _markdown_translation_prompt)
+        if translations is None:
+            raise HTTPException(status_code=503, detail="Translation service is temporarily unavailable.")
         return {"translations": translations}
     except HTTPException:
         raise
@@ -254,64 +968,225 @@ async def translate(req: TranslateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/analyze")
-async def analyze(req: AnalyzeRequest):
+async def analyze(req: AnalyzeRequest, response: Response):
     try:
-        # Log the received text for debugging
-        print(f"DEBUG: Received text: '{req.text}'")
-        print(f"DEBUG: Text length: {len(req.text)}")
+        # Message bodies may contain personal data, so they are only logged when enabled
+        if _log_message_bodies:
+            print(f"DEBUG: Received text: '{req.text}'")
+            print(f"DEBUG: Text length: {len(req.text)}")
         
-        # Use hybrid detection
-        pred, confidence = hybrid_spam_detection(req.text)
-        label = 'spam' if pred == 1 else 'not_spam'
+        # Use hybrid detection, pinned to one model version for the whole request
+        bundle = _active_bundle()
+        with timed('classify'):
+            detection = classify_message(req.text, bundle)
+        label = 'spam' if detection.prediction == 1 else 'not_spam'
+        metrics.classifications.inc(endpoint='analyze', classification=label)
 
         result: dict = {
             "classification": label,
-            "confidence": float(confidence)
+            "confidence": float(detection.confidence),
+            "model_version": bundle.version if bundle else None,
+            **_detection_fields(detection)
         }
         
         if label == 'spam':
-            try:
-                model = get_model()
-                if model is not None:
-                    ad_text = _generate_ad(model, req.text)
-                    result["ad"] = ad_text
-                    if req.languages:
-                        translations = {}
-                        for lang in req.languages:
-                            tprompt = f"""
-                            Translate the following ad into {lang}. Preserve labels and bullets. Output PLAIN TEXT only (no markdown symbols).
-                            {ad_text}
-                            """
-                            tmodel = model
-                            tresp = tmodel.generate_content(tprompt)
-                            translations[lang] = tresp.text
-                        result["translations"] = translations
-                else:
-                    result["ad_generation_error"] = "Ad generation service is temporarily unavailable. This may be due to API quota limitations or model access issues."
-            except HTTPException as he:
-                # Re-raise HTTP exceptions (like quota errors)
-                raise he
-            except Exception as e:
-                # If ad generation fails, continue without it but provide a clear message
-                print(f"Ad generation failed: {e}")
-                result["ad_generation_error"] = "Unable to generate cyber awareness ad at this time. This may be due to API quota limitations or model access issues."
-                pass
+            use_job = req.async_ad if req.async_ad is not None else _ad_job_config['default_async']
+            # Identical requests arriving together (re-clicks, one campaign hitting many users) share one result
+            flight_key = f"{ad_cache_key('analyze', req.text)}:{json.dumps(req.languages or [])}"
+            if use_job and _ad_jobs.running:
+                # Answer now; the ad and translations are generated in the background
+                try:
+                    job_id = await _ad_jobs.submit({"text": req.text, "languages": req.languages}, key=flight_key)
+                    result["job"] = {"id": job_id, "status": JOB_QUEUED, "poll": f"/jobs/{job_id}",
+                                     "events": f"/jobs/{job_id}/events"}
+                except JobQueueFull as full:
+                    response.headers['Retry-After'] = str(int(full.retry_after + 0.5))
+                    result["ad_generation_error"] = "Ad generation is busy. Please retry in a moment."
+            else:
+                result.update(await _analyze_flights.do(flight_key, lambda: _ad_result(req.text, req.languages)))
         return result
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0.0):
+    """
+    Status and result of a background ad job. With wait=N (seconds, at most 30)
+    the request is held until the job finishes or N seconds pass (long polling).
+    """
+    job = await _ad_jobs.wait(job_id, min(max(wait, 0.0), 30.0))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events for a background ad job: status now, then the finished job, then done"""
+    job = await _ad_jobs.wait(job_id, 0.0)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    
+    async def events():
+        current = job
+        yield sse_event('status', {"job_id": job_id, "status": current['status']})
+        while current['status'] not in FINISHED_STATES:
+            previous = current['status']
+            current = await _ad_jobs.wait(job_id, 15.0)
+            if current is None:
+                yield sse_event('error', {"detail": "Unknown or expired job"})
+                yield sse_event('done', {})
+                return
+            if current['status'] == previous:
+                # Comment line so proxies keep the idle connection open
+                yield ": keepalive\n\n"
+            elif current['status'] not in FINISHED_STATES:
+                yield sse_event('status', {"job_id": job_id, "status": current['status']})
+        yield sse_event('job', current)
+        yield sse_event('done', {})
+    return _event_stream(events())
+
+@app.post("/analyze-stream")
+async def analyze_stream(req: AnalyzeRequest):
+    """
+    /analyze as server-sent events: a classification event as soon as the
+    message is classified, then (for spam) the ad and translations as they
+    are generated, and finally a done event
+    """
+    bundle = _active_bundle()
+    try:
+        with timed('classify'):
+            detection = classify_message(req.text, bundle)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    label = 'spam' if detection.prediction == 1 else 'not_spam'
+    metrics.classifications.inc(endpoint='analyze-stream', classification=label)
+    
+    async def events():
+        yield sse_event('classification', {
+            "classification": label,
+            "confidence": float(detection.confidence),
+            "model_version": bundle.version if bundle else None,
+            **_detection_fields(detection)
+        })
+        if label == 'spam':
+            async for event in _ad_events(req.text, req.languages):
+                yield event
+        yield sse_event('done', {})
+    return _event_stream(events())
+
+@app.post("/analyze-batch")
+async def analyze_batch(req: AnalyzeBatchRequest):
+    """Classify a list of messages in one pass (no ad generation)"""
+    try:
+        results = []
+        bundle = _active_bundle()
+        # CPU-bound for large batches: keep the event loop free for other requests
+        loop = asyncio.get_running_loop()
+        detections = await loop.run_in_executor(None, classify_messages, req.texts, bundle)
+        for detection in detections:
+            label = 'spam' if detection.prediction == 1 else 'not_spam'
+            metrics.classifications.inc(endpoint='analyze-batch', classification=label)
+            results.append({
+                "classification": label,
+                "confidence": float(detection.confidence),
+                **_detection_fields(detection)
+            })
+        return {"results": results, "model_version": bundle.version if bundle else None}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/feedback")
+async def feedback(req: FeedbackRequest, request: Request, x_feedback_token: Optional[str] = Header(default=None)):
+    """Record the correct label for a message; the online model learns it in its next micro-batch"""
+    _check_token(request, x_feedback_token, _online_config['feedback_token'], 'FEEDBACK_TOKEN', 'feedback')
+    if req.label not in ('spam', 'not_spam'):
+        raise HTTPException(status_code=422, detail="label must be 'spam' or 'not_spam'")
+    # Only the preprocessed (stemmed) text is stored, never the original message
+    transformed = advanced_text_preprocessing(req.text)
+    if not transformed:
+        raise HTTPException(status_code=422, detail="Message has no words the model can learn from")
+    loop = asyncio.get_running_loop()
+    feedback_id = await loop.run_in_executor(
+        None, _feedback_log.append, transformed, 1 if req.label == 'spam' else 0, req.source)
+    metrics.feedback_reports.inc(label=req.label)
+    return {"accepted": True, "feedback_id": feedback_id, "online_learning": _online_learner is not None}
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
+    bundle = _active_bundle()
     return {
         "status": "healthy",
-        "model_loaded": _tfidf is not None and _clf is not None,
+        "model_loaded": bundle is not None,
+        "model_version": bundle.version if bundle else None,
+        "online_learning": _online_learner.status() if _online_learner is not None else None,
+        "ad_jobs": _ad_jobs.status(),
+        "in_flight": {
+            "analyze": _analyze_flights.status()["in_flight"],
+            "ad": _ad_flights.status()["in_flight"],
+            "translation": _translation_flights.status()["in_flight"]
+        },
+        "detection": {
+            "cascade_mode": _cascade_mode,
+            "stage_order": _detection_stages(bundle, _cascade_mode),
+            "stage_cost_ms": _stage_costs.status(),
+            "long_text": _windowed_scorer.status()
+        },
         "rule_detector_loaded": True,
-        "improved_rule_detector": True
+        "improved_rule_detector": True,
+        "llm": _gemini_registry.status(),
+        "llm_limiter": _llm_limiter.status(),
+        "ad_cache": _ad_cache.stats(),
+        "ad_library": _ad_library.status() if _ad_library is not None else None,
+        "near_duplicates": _near_duplicates.status() if _near_duplicates is not None else None
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics of every worker (with METRICS_DIR), else of this worker process"""
+    return Response(content=metrics.render_metrics(_metrics_config['directory']), media_type=metrics.CONTENT_TYPE)
+
+def _check_token(request: Request, token: Optional[str], expected: Optional[str], setting: str, kind: str):
+    """Calls need the expected token when it is set, otherwise they must come from this machine"""
+    if expected:
+        if not token or not hmac.compare_digest(token, expected):
+            raise HTTPException(status_code=403, detail=f"Invalid {kind} token")
+    elif request.client is None or request.client.host not in ('127.0.0.1', '::1'):
+        raise HTTPException(status_code=403, detail=f"Set {setting} to use {kind} endpoints from other hosts")
+
+def _check_admin(request: Request, token: Optional[str]):
+    """Admin calls need ADMIN_TOKEN when it is set, otherwise they must come from this machine"""
+    _check_token(request, token, _model_config['admin_token'], 'ADMIN_TOKEN', 'admin')
+
+@app.get("/admin/model")
+async def model_status(request: Request, x_admin_token: Optional[str] = Header(default=None)):
+    _check_admin(request, x_admin_token)
+    return _model_manager.status()
+
+@app.post("/admin/model/reload")
+async def reload_model(request: Request, req: ModelReloadRequest | None = None,
+                       x_admin_token: Optional[str] = Header(default=None)):
+    """Load, canary-check and activate a model version (default: the one named in CURRENT)"""
+    _check_admin(request, x_admin_token)
+    req = req or ModelReloadRequest()
+    loop = asyncio.get_running_loop()
+    try:
+        # Loading runs off the event loop; requests keep using the active model meanwhile
+        return await loop.run_in_executor(None, functools.partial(_model_manager.reload, req.version, req.publish))
+    except ModelValidationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/model/rollback")
+async def rollback_model(request: Request, publish: bool = True, x_admin_token: Optional[str] = Header(default=None)):
+    """Switch back to the previously active model"""
+    _check_admin(request, x_admin_token)
+    try:
+        return _model_manager.rollback(publish=publish)
+    except ModelValidationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 # Test endpoint
 @app.post("/test-detection")
 async def test_detection(req: GenerateRequest):
@@ -320,17 +1195,21 @@ async def test_detection(req: GenerateRequest):
         # Get ML model prediction if available
         ml_prediction = None
         ml_confidence = 0.0
+        bundle = _active_bundle()
         
-        if _tfidf is not None and _clf is not None:
+        if bundle is not None:
             try:
                 # Preprocess the text
                 transformed = advanced_text_preprocessing(req.text)
                 
-                # Transform and predict
-                vec = _tfidf.transform([transformed])
-                ml_prediction = _clf.predict(vec)[0]
-                prob = _clf.predict_proba(vec)[0]
-                ml_confidence = max(prob)
+                if bundle.scorer is not None:
+                    ml_prediction, ml_confidence = bundle.scorer.predict(transformed)
+                else:
+                    # Transform and predict
+                    vec = bundle.vectorizer.transform([transformed])
+                    ml_prediction = bundle.classifier.predict(vec)[0]
+                    prob = bundle.classifier.predict_proba(vec)[0]
+                    ml_confidence = max(prob)
             except Exception as e:
                 print(f"ML model prediction error: {e}")
         
@@ -338,10 +1217,11 @@ async def test_detection(req: GenerateRequest):
         rule_prediction, rule_confidence = _rule_detector.predict(req.text)
         
         # Get hybrid prediction
-        hybrid_prediction, hybrid_confidence = hybrid_spam_detection(req.text)
+        detection = classify_message(req.text, bundle)
         
         return {
             "text": req.text,
+            "model_version": bundle.version if bundle else None,
             "ml_model": {
                 "prediction": int(ml_prediction) if ml_prediction is not None else None,
                 "confidence": float(ml_confidence) if ml_prediction is not None else 0.0
@@ -351,8 +1231,10 @@ async def test_detection(req: GenerateRequest):
                 "confidence": float(rule_confidence)
             },
             "hybrid": {
-                "prediction": int(hybrid_prediction),
-                "confidence": float(hybrid_confidence)
+                "prediction": int(detection.prediction),
+                "confidence": float(detection.confidence),
+                **_detection_fields(detection),
+                "decided_by": detection.decided_by
             }
         }
     except Exception as e:
@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import google.generativeai as genai
+
+from llm_limiter import GeminiLimiter, LLMUnavailable, estimate_tokens
+
+class ModelQuotaExceeded(Exception):
+    """Raised when Gemini rejects model resolution with a 429 (quota exhausted)"""
+    pass
+
+class GeminiModelRegistry:
+    """
+    Process-level cache of the working Gemini model.
+    The candidate list is probed once, the first model that answers is reused
+    until its TTL expires or a real generation call fails, and then it is
+    resolved again. Probes go through the limiter when one is given.
+    """
+    def __init__(self, candidates: List[str], ttl_seconds: float = 3600,
+                 probe_timeout: float = 10, resolve_retry_seconds: float = 60,
+                 limiter: Optional[GeminiLimiter] = None):
+        self.candidates = list(candidates)
+        self.ttl_seconds = ttl_seconds
+        self.probe_timeout = probe_timeout
+        self.resolve_retry_seconds = resolve_retry_seconds
+        self.limiter = limiter
+        
+        self._lock = threading.Lock()
+        self._api_key: Optional[str] = None
+        self._model = None
+        self._model_name: Optional[str] = None
+        self._resolved_at = 0.0
+        self._healthy = False
+        self._last_attempt = 0.0
+        self._last_error: Optional[str] = None
+        self._resolutions = 0
+        self._failures = 0
+
+    def get(self, api_key: str):
+        """
+        Return the cached model, resolving it first if needed. Returns None if no model is available.
+        Raises LLMUnavailable instead of probing while the limiter's circuit breaker is open.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if api_key != self._api_key:
+                genai.configure(api_key=api_key)
+                self._api_key = api_key
+                self._model = None
+                self._healthy = False
+                self._last_attempt = 0.0
+            
+            if self._model is not None and self._healthy and now - self._resolved_at < self.ttl_seconds:
+                return self._model
+            
+            # Don't walk the whole candidate list on every request while Gemini is unavailable
+            if self._model is None and self._last_attempt and now - self._last_attempt < self.resolve_retry_seconds:
+                return None
+            
+            if self.limiter is not None:
+                self.limiter.check()
+            return self._resolve()
+
+    def _resolve(self):
+        self._last_attempt = time.monotonic()
+        self._resolutions += 1
+        for name in self.candidates:
+            try:
+                model = genai.GenerativeModel(name)
+                # Test the model with a simple prompt
+                self._probe(model)
+                print(f"Successfully loaded model: {name}")
+                self._model = model
+                self._model_name = name
+                self._resolved_at = time.monotonic()
+                self._healthy = True
+                self._last_error = None
+                return model
+            except LLMUnavailable:
+                # Limiter or circuit breaker: no other candidate can be probed either
+                raise
+            except Exception as e:
+                print(f"Failed to load model {name}: {e}")
+                self._last_error = str(e)
+                # If we get a quota error, don't try other models
+                if "429" in str(e):
+                    self._model = None
+                    self._healthy = False
+                    raise ModelQuotaExceeded(str(e))
+                continue
+        # If all models fail, return None to indicate no model is available
+        print("All models failed to load, returning None")
+        self._model = None
+        self._model_name = None
+        self._healthy = False
+        return None
+
+    def _probe(self, model):
+        if self.limiter is None:
+            model.generate_content("Hello", request_options={"timeout": self.probe_timeout})
+            return
+        tokens = estimate_tokens("Hello") + 10
+        self.limiter.acquire(tokens)
+        try:
+            model.generate_content("Hello", request_options={"timeout": self.probe_timeout})
+        except Exception as e:
+            self.limiter.record_failure(e)
+            raise
+        self.limiter.record_success(tokens)
+
+    def report_failure(self, error: Exception):
+        """Mark the cached model unhealthy after a failed call so the next request re-resolves it"""
+        with self._lock:
+            self._failures += 1
+            self._healthy = False
+            self._last_error = str(error)
+            # A failed call is fresh evidence, so allow an immediate re-resolve
+            self._last_attempt = 0.0
+
+    def status(self) -> Dict[str, Any]:
+        """Snapshot of the registry state for /health"""
+        with self._lock:
+            return {
+                "model": self._model_name,
+                "healthy": self._healthy,
+                "age_seconds": round(time.monotonic() - self._resolved_at, 1) if self._model is not None else None,
+                "resolutions": self._resolutions,
+                "call_failures": self._failures,
+                "last_error": self._last_error
+            }
@@ -1,6 +1,71 @@
 import re
 import pickle
-from typing import Tuple, Dict, Any
+from collections import Counter
+from typing import Tuple, Dict, Any, Iterable, List
+
+from text_scripts import detect_scripts, partition_by_script, pattern_scripts
+
+# A piece of an ordered pattern made only of literals and \d, so it has a fixed width
+_FIXED_WIDTH_PIECE = re.compile(r'^(?:\\d|\\.|[^\\.^$*+?{}\[\]|()])*$')
+
+class CompiledTermMatcher:
+    """
+    Finds which of a fixed set of terms occur (as substrings) in a text.
+    Each distinct term is tested once with a C-level substring search, no matter
+    how many keyword lists it appears in.
+    """
+    def __init__(self, terms: Iterable[str]):
+        self._terms = tuple(sorted(set(terms)))
+
+    def find(self, text: str) -> set:
+        """Return the set of terms that occur in text"""
+        return {term for term in self._terms if term in text}
+
+class OrderedPatternMatcher:
+    """
+    Equivalent of re.search(pattern, text, flags) for patterns of the form
+    'a.*b.*c' without the backtracking blow-up of nested '.*' on long texts.
+    Each piece is located with its own search, taking the earliest match after
+    the previous piece within the same line. Patterns that don't fit this form
+    fall back to the plain compiled regex.
+    """
+    def __init__(self, pattern: str, flags: int = 0):
+        self._regex = re.compile(pattern, flags)
+        self._pieces = None
+        pieces = re.split(r'(?<!\\)\.\*', pattern)
+        if len(pieces) < 2 or not all(pieces):
+            return
+        # Leading/trailing \d+ next to '.*' can be shortened to one digit
+        # without changing whether (or where earliest) the pattern matches
+        pieces = [re.sub(r'\\d\+$', r'\\d', re.sub(r'^\\d\+', r'\\d', piece)) for piece in pieces]
+        # Every piece but the last must be fixed width so the leftmost match is also the earliest-ending one
+        if not all(_FIXED_WIDTH_PIECE.match(piece) for piece in pieces[:-1]):
+            return
+        self._pieces = [re.compile(piece, flags) for piece in pieces]
+
+    def search(self, text: str) -> bool:
+        """Return True if the pattern matches anywhere in text"""
+        if self._pieces is None:
+            return self._regex.search(text) is not None
+        first, rest = self._pieces[0], self._pieces[1:]
+        pos = 0
+        while True:
+            m = first.search(text, pos)
+            if m is None:
+                return False
+            # '.' does not match newlines, so the whole match lies on this line
+            line_end = text.find('\n', m.start())
+            if line_end == -1:
+                line_end = len(text)
+            end = m.end()
+            for piece in rest:
+                m = piece.search(text, end, line_end)
+                if m is None:
+                    break
+                end = m.end()
+            else:
+                return True
+            pos = line_end + 1
 
 class ImprovedRuleBasedSpamDetector:
     def __init__(self):
@@ -57,51 +122,82 @@ class ImprovedRuleBasedSpamDetector:
             r'बधाई.*लाख.*जीत.*क्लिक.*विवरण',
             r'जीत.*लाख.*राशि.*क्लिक.*विवरण'
         ]
+        
+        # Term families counted alongside the spam keywords
+        self.urgency_indicators = ['urgent', 'immediate', 'asap', 'hurry', 'limited time', 'act now']
+        self.money_terms = ['free', 'cash', 'money', 'income', 'earn', 'prize', 'won', 'win', 'लाख', 'राशि', 'पैसा']
+        self.action_requests = ['click', 'call', 'text', 'reply', 'send', 'verify', 'apply', 'क्लिक', 'संपर्क']
+        
+        # Scores above this are spam; the confidence of a ham prediction is therefore at most this
+        self.spam_threshold = 0.25
+        
+        self._compile_rules()
+
+    def _compile_rules(self):
+        """
+        Compile the keyword lists and regex patterns once so extract_features is a single pass.
+        Terms and patterns are grouped by the scripts they are written in, and a
+        group only runs on text containing all of its scripts.
+        """
+        # One matcher per script for every keyword and term family; counts per family
+        # are derived from the set of matched terms (keeping duplicate list entries)
+        self._term_families = {
+            'spam_keyword_count': Counter(self.spam_keywords),
+            'urgency_count': Counter(self.urgency_indicators),
+            'money_count': Counter(self.money_terms),
+            'action_count': Counter(self.action_requests),
+        }
+        # Which families (and how often) each term counts towards
+        self._term_counts: Dict[str, List[Tuple[str, int]]] = {}
+        for name, family in self._term_families.items():
+            for term, count in family.items():
+                self._term_counts.setdefault(term, []).append((name, count))
+        self._term_matchers = [
+            (scripts, CompiledTermMatcher(terms))
+            for scripts, terms in partition_by_script((detect_scripts(term), term) for term in self._term_counts)
+        ]
+        
+        self._suspicious_regexes = [re.compile(pattern) for pattern in self.suspicious_patterns]
+        self._high_confidence_matchers = partition_by_script(
+            (pattern_scripts(pattern), OrderedPatternMatcher(pattern, re.IGNORECASE))
+            for pattern in self.high_confidence_patterns
+        )
 
     def extract_features(self, text: str) -> Dict[str, Any]:
         """Extract features from text for spam detection"""
         text_lower = text.lower()
+        scripts = detect_scripts(text_lower)
         
-        # Count spam keywords (more flexible matching)
-        spam_keyword_count = 0
-        for keyword in self.spam_keywords:
-            # Use more flexible matching for Hindi text
-            if keyword in text_lower:
-                spam_keyword_count += 1
-            # Also check for partial matches for Hindi words
-            elif any(keyword in word for word in text_lower.split()):
-                spam_keyword_count += 1
+        # Keywords and term families of the text's scripts; a keyword counts once per list entry
+        found_terms = set()
+        for required, matcher in self._term_matchers:
+            if required <= scripts:
+                found_terms |= matcher.find(text_lower)
+        family_counts = dict.fromkeys(self._term_families, 0)
+        for term in found_terms:
+            for name, count in self._term_counts[term]:
+                family_counts[name] += count
         
         # Count suspicious patterns
         suspicious_pattern_count = 0
-        for pattern in self.suspicious_patterns:
-            suspicious_pattern_count += len(re.findall(pattern, text_lower))
+        for regex in self._suspicious_regexes:
+            suspicious_pattern_count += len(regex.findall(text_lower))
         
-        # Check for high confidence patterns
+        # Check for high confidence patterns of the text's scripts
         high_confidence_matches = 0
-        for pattern in self.high_confidence_patterns:
-            if re.search(pattern, text_lower, re.IGNORECASE):
-                high_confidence_matches += 1
-        
-        # Check for urgency indicators
-        urgency_indicators = ['urgent', 'immediate', 'asap', 'hurry', 'limited time', 'act now']
-        urgency_count = sum(1 for word in urgency_indicators if word in text_lower)
-        
-        # Check for money-related terms
-        money_terms = ['free', 'cash', 'money', 'income', 'earn', 'prize', 'won', 'win', 'लाख', 'राशि', 'पैसा']
-        money_count = sum(1 for word in money_terms if word in text_lower)
-        
-        # Check for action requests
-        action_requests = ['click', 'call', 'text', 'reply', 'send', 'verify', 'apply', 'क्लिक', 'संपर्क']
-        action_count = sum(1 for word in action_requests if word in text_lower)
+        for required, matchers in self._high_confidence_matchers:
+            if required <= scripts:
+                for matcher in matchers:
+                    if matcher.search(text_lower):
+                        high_confidence_matches += 1
         
         return {
-            'spam_keyword_count': spam_keyword_count,
+            'spam_keyword_count': family_counts['spam_keyword_count'],
             'suspicious_pattern_count': suspicious_pattern_count,
             'high_confidence_matches': high_confidence_matches,
-            'urgency_count': urgency_count,
-            'money_count': money_count,
-            'action_count': action_count,
+            'urgency_count': family_counts['urgency_count'],
+            'money_count': family_counts['money_count'],
+            'action_count': family_counts['action_count'],
             'text_length': len(text),
             'word_count': len(text.split())
         }
@@ -144,7 +240,7 @@ class ImprovedRuleBasedSpamDetector:
         spam_score = min(1.0, spam_score)
         
         # Make prediction based on threshold
-        prediction = 1 if spam_score > 0.25 else 0  # Lower threshold for better sensitivity
+        prediction = 1 if spam_score > self.spam_threshold else 0  # Lower threshold for better sensitivity
         confidence = spam_score
         
         return prediction, confidence
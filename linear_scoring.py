@@ -0,0 +1,179 @@
+import math
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+from model_artifacts import ArtifactLinearClassifier, ArtifactVectorizer
+
+def _sigmoid(logit: float) -> float:
+    # Numerically stable
+    if logit >= 0:
+        return 1.0 / (1.0 + math.exp(-logit))
+    z = math.exp(logit)
+    return z / (1.0 + z)
+
+class LinearTextScorer:
+    """
+    Scores preprocessed text with a TF-IDF + binary logistic regression model
+    without building a sparse matrix: each vocabulary term maps to its idf and
+    idf * coef, so the logit is one pass over the document's terms and the
+    sigmoid is applied once for both label and probability.
+    Used for pickled sklearn vectorizers, whose vocabulary is a dict already.
+    """
+    def __init__(self, analyzer, weights: Dict[str, Tuple[float, float]], intercept: float, classes: List,
+                 norm: Optional[str], sublinear_tf: bool, binary: bool):
+        self.analyzer = analyzer
+        self.weights = weights
+        self.intercept = intercept
+        self.classes = classes
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        self.binary = binary
+
+    def decision(self, text: str) -> float:
+        weights = self.weights
+        dot = 0.0
+        norm_total = 0.0
+        for term, count in Counter(self.analyzer(text)).items():
+            entry = weights.get(term)
+            if entry is None:
+                continue
+            idf, weight = entry
+            tf = 1.0 if self.binary else (1.0 + math.log(count) if self.sublinear_tf else float(count))
+            dot += tf * weight
+            value = tf * idf
+            norm_total += value * value if self.norm == 'l2' else abs(value)
+        if dot and self.norm is not None:
+            dot /= math.sqrt(norm_total) if self.norm == 'l2' else norm_total
+        return dot + self.intercept
+
+    def _label(self, logit: float) -> Tuple[object, float]:
+        prob = _sigmoid(logit)
+        if logit > 0:
+            return self.classes[1], prob
+        return self.classes[0], 1.0 - prob
+
+    def predict(self, text: str) -> Tuple[object, float]:
+        """(label, probability of that label), like predict() plus max(predict_proba())"""
+        return self._label(self.decision(text))
+
+    def predict_many(self, texts: List[str]) -> List[Tuple[object, float]]:
+        return [self.predict(text) for text in texts]
+
+class ArtifactTextScorer(LinearTextScorer):
+    """
+    The same kernel for an ArtifactVectorizer. Terms are looked up in its sorted,
+    memory-mapped vocabulary (shared by every worker) instead of a per-process
+    dict; only the idf * coef array is built per process. A batch is scored with
+    one vocabulary lookup for all of its terms.
+    """
+    def __init__(self, vectorizer: ArtifactVectorizer, idf: np.ndarray, term_weights: np.ndarray, intercept: float,
+                 classes: List):
+        super().__init__(vectorizer.build_analyzer(), {}, intercept, classes, vectorizer.norm,
+                         vectorizer.sublinear_tf, vectorizer.binary)
+        self.lookup = vectorizer.lookup
+        self.idf = idf
+        self.term_weights = term_weights
+
+    def decisions(self, texts: List[str]) -> np.ndarray:
+        """Logit of each text"""
+        terms: List[str] = []
+        lengths = []
+        for text in texts:
+            analyzed = self.analyzer(text)
+            terms.extend(analyzed)
+            lengths.append(len(analyzed))
+        columns = self.lookup(terms)
+        documents = np.repeat(np.arange(len(texts)), lengths)
+        known = columns >= 0
+        # Term counts per (document, column)
+        size = len(self.idf)
+        keys, counts = np.unique(documents[known] * size + columns[known], return_counts=True)
+        documents, columns = keys // size, keys % size
+        tf = counts.astype(np.float64)
+        if self.binary:
+            tf[:] = 1.0
+        elif self.sublinear_tf:
+            tf = 1.0 + np.log(tf)
+        # (bincount returns integers when there are no terms at all)
+        dot = np.bincount(documents, weights=tf * self.term_weights[columns], minlength=len(texts)).astype(np.float64)
+        if self.norm is not None:
+            values = tf * self.idf[columns]
+            totals = np.bincount(documents, weights=values * values if self.norm == 'l2' else np.abs(values),
+                                 minlength=len(texts))
+            if self.norm == 'l2':
+                totals = np.sqrt(totals)
+            # A text without known terms has a zero dot product and a zero norm
+            dot = np.divide(dot, totals, out=dot, where=totals > 0)
+        return dot + self.intercept
+
+    def decision(self, text: str) -> float:
+        # One text: a plain loop beats the array set-up of decisions()
+        counts = Counter(self.analyzer(text))
+        dot = 0.0
+        norm_total = 0.0
+        for column, count in zip(self.lookup(list(counts)).tolist(), counts.values()):
+            if column < 0:
+                continue
+            tf = 1.0 if self.binary else (1.0 + math.log(count) if self.sublinear_tf else float(count))
+            dot += tf * float(self.term_weights[column])
+            value = tf * float(self.idf[column])
+            norm_total += value * value if self.norm == 'l2' else abs(value)
+        if dot and self.norm is not None:
+            dot /= math.sqrt(norm_total) if self.norm == 'l2' else norm_total
+        return dot + self.intercept
+
+    def predict_many(self, texts: List[str]) -> List[Tuple[object, float]]:
+        return [self._label(float(logit)) for logit in self.decisions(texts)]
+
+def build_linear_scorer(vectorizer, classifier, check_texts: Optional[List[str]] = None) -> Optional[LinearTextScorer]:
+    """
+    Kernel for a TF-IDF vectorizer and a binary logistic regression, or None when
+    the pair is anything else (callers then use sklearn). The kernel is checked
+    against the model's own predict_proba before it is returned.
+    """
+    if not isinstance(classifier, (LogisticRegression, ArtifactLinearClassifier)):
+        return None
+    classes = list(getattr(classifier, 'classes_', []))
+    if len(classes) != 2 or np.asarray(classifier.coef_).shape[0] != 1:
+        return None
+    if not all(hasattr(vectorizer, name) for name in ('norm', 'sublinear_tf', 'binary', 'build_analyzer')):
+        return None
+    if vectorizer.norm not in (None, 'l1', 'l2'):
+        return None
+
+    coef = np.asarray(classifier.coef_, dtype=np.float64)[0]
+    idf = getattr(vectorizer, 'idf_', None)
+    idf = np.ones(len(coef)) if idf is None else np.asarray(idf, dtype=np.float64)
+    intercept = float(np.asarray(classifier.intercept_)[0])
+    if isinstance(vectorizer, ArtifactVectorizer):
+        vocabulary = vectorizer.vocabulary
+        if not len(vocabulary):
+            return None
+        scorer = ArtifactTextScorer(vectorizer, idf, idf * coef, intercept, classes)
+    else:
+        terms = getattr(vectorizer, 'vocabulary_', None)
+        if not terms:
+            return None
+        weights = {term: (float(idf[column]), float(idf[column] * coef[column])) for term, column in terms.items()}
+        scorer = LinearTextScorer(vectorizer.build_analyzer(), weights, intercept,
+                                  classes, vectorizer.norm, vectorizer.sublinear_tf, vectorizer.binary)
+        vocabulary = sorted(terms, key=terms.get)
+
+    # Documents made of real vocabulary terms, so the check exercises the weights
+    if check_texts is None:
+        check_texts = ["", "zzzz unknown words"] + [" ".join(vocabulary[i::17][:40]) for i in range(17)]
+    try:
+        probs = np.asarray(classifier.predict_proba(vectorizer.transform(check_texts)))
+        labels = np.asarray(classes)[probs.argmax(axis=1)]
+    except Exception as e:
+        print(f"Linear scorer check failed, using sklearn scoring: {e}")
+        return None
+    for text, label, prob, (fast_label, fast_prob) in zip(check_texts, labels, probs.max(axis=1),
+                                                          scorer.predict_many(check_texts)):
+        if abs(fast_prob - prob) > 1e-9 or (fast_label != label and abs(prob - 0.5) > 1e-9):
+            print("Linear scorer disagrees with the model, using sklearn scoring")
+            return None
+    return scorer
@@ -0,0 +1,208 @@
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+_BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+# "Please retry in 27.5s" / "retry_delay { seconds: 27 }" in Gemini quota errors
+_RETRY_HINT = re.compile(r'retry in ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE)
+_OVERLOAD_MARKERS = ('429', '500', '502', '503', '504', 'resource has been exhausted', 'quota',
+                     'service unavailable', 'internal error', 'deadline exceeded')
+
+class LLMUnavailable(Exception):
+    """Raised instead of calling Gemini while the rate limiter or circuit breaker holds calls back"""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Gemini calls are paused ({reason}); retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt size in tokens (about 4 characters per token)"""
+    return max(1, math.ceil(len(text) / 4))
+
+def is_quota_error(error: Exception) -> bool:
+    return getattr(error, 'code', None) == 429 or '429' in str(error)
+
+def is_overload_error(error: Exception) -> bool:
+    """429 and 5xx-type errors: signs that Gemini wants fewer calls, unlike a bad request"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and (code == 429 or code >= 500):
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in _OVERLOAD_MARKERS)
+
+def retry_delay_hint(error: Exception) -> Optional[float]:
+    match = _RETRY_HINT.search(str(error))
+    if match is None:
+        return None
+    return float(match.group(1) or match.group(2))
+
+class TokenBucket:
+    """Bucket refilled continuously at per_minute; holds at most one minute's worth (0 = unlimited)"""
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.per_minute, self.level + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available"""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        # A single call larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.per_minute)
+        return max(0.0, (amount - self.level) * 60.0 / self.per_minute)
+
+    def take(self, amount: float):
+        # May go negative: a reservation that later callers wait out
+        if self.per_minute > 0:
+            self.level -= min(amount, self.per_minute)
+
+class GeminiLimiter:
+    """
+    Client-side guard in front of every Gemini generate_content call:
+    - token buckets for requests and tokens per minute; a call that would
+      wait longer than max_wait is refused instead of queued
+    - a circuit breaker that opens at once on a 429 (or after failure_threshold
+      consecutive 5xx errors), stays open for an exponential backoff (at least
+      the retry delay Gemini suggests), then lets one trial call through
+    - token accounting: calls reserve an estimate, corrected by the usage
+      the response reports
+    Shared by the threads of one process.
+    """
+    def __init__(self, rpm: float, tpm: float, max_wait: float = 5.0, failure_threshold: int = 3,
+                 base_backoff: float = 30.0, max_backoff: float = 600.0):
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self._state = BREAKER_CLOSED
+        self._open_until = 0.0
+        self._backoff = 0.0
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+        self._last_error: Optional[str] = None
+        self._opened = 0
+        self._refused = 0
+        self._estimated_tokens = 0
+        self._reported_tokens = 0
+        metrics.llm_breaker_state.set(_BREAKER_STATE_VALUES[BREAKER_CLOSED])
+
+    def _set_state(self, state: str):
+        self._state = state
+        metrics.llm_breaker_state.set(_BREAKER_STATE_VALUES[state])
+
+    def _check_breaker(self, now: float, claim_trial: bool):
+        if self._state == BREAKER_OPEN:
+            if now < self._open_until:
+                raise LLMUnavailable('circuit open', self._open_until - now)
+            self._set_state(BREAKER_HALF_OPEN)
+        if self._state == BREAKER_HALF_OPEN:
+            # One trial call decides whether the breaker closes again
+            if self._trial_in_flight:
+                raise LLMUnavailable('circuit half-open, trial call running', 1.0)
+            if claim_trial:
+                self._trial_in_flight = True
+
+    def check(self):
+        """Raise LLMUnavailable while the breaker is open (no call is made or reserved)"""
+        with self._lock:
+            try:
+                self._check_breaker(time.monotonic(), claim_trial=False)
+            except LLMUnavailable:
+                self._refused += 1
+                raise
+
+    def acquire(self, estimated_tokens: int):
+        """
+        Reserve one request and estimated_tokens, sleeping if the buckets need
+        up to max_wait to refill. Raises LLMUnavailable instead of waiting longer
+        or while the breaker is open. Follow with record_success or record_failure.
+        """
+        with self._lock:
+            now = time.monotonic()
+            try:
+                self._check_breaker(now, claim_trial=True)
+            except LLMUnavailable:
+                self._refused += 1
+                raise
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(estimated_tokens, now))
+            if wait > self.max_wait:
+                self._trial_in_flight = False
+                self._refused += 1
+                raise LLMUnavailable('rate limit', wait)
+            self._requests.take(1)
+            self._tokens.take(estimated_tokens)
+            self._estimated_tokens += estimated_tokens
+        metrics.llm_tokens.inc(estimated_tokens, kind='estimated')
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_success(self, estimated_tokens: int, reported_tokens: Optional[int] = None):
+        with self._lock:
+            if reported_tokens is not None:
+                # Charge (or refund) the difference between the estimate and the real usage
+                self._tokens.take(reported_tokens - estimated_tokens)
+                self._reported_tokens += reported_tokens
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            if self._state != BREAKER_CLOSED:
+                print("Gemini circuit breaker closed")
+                self._set_state(BREAKER_CLOSED)
+                self._backoff = 0.0
+        if reported_tokens is not None:
+            metrics.llm_tokens.inc(reported_tokens, kind='reported')
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if not is_overload_error(error):
+                # A bad request still shows Gemini is answering
+                if trial and self._state == BREAKER_HALF_OPEN:
+                    self._set_state(BREAKER_CLOSED)
+                    self._backoff = 0.0
+                return
+            self._last_error = str(error)[:300]
+            self._consecutive_failures += 1
+            if is_quota_error(error) or trial or self._consecutive_failures >= self.failure_threshold:
+                self._open(time.monotonic(), error)
+
+    def _open(self, now: float, error: Exception):
+        # Back off longer each time a trial call fails; reset once a call succeeds
+        self._backoff = min(self.max_backoff, self._backoff * 2 if self._backoff else self.base_backoff)
+        delay = max(self._backoff, retry_delay_hint(error) or 0.0)
+        self._open_until = now + delay
+        self._opened += 1
+        self._set_state(BREAKER_OPEN)
+        print(f"Gemini circuit breaker open for {delay:.0f}s: {str(error)[:120]}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "breaker": self._state,
+                "retry_after": round(max(0.0, self._open_until - now), 1) if self._state == BREAKER_OPEN else 0.0,
+                "times_opened": self._opened,
+                "refused_calls": self._refused,
+                "rpm_limit": self._requests.per_minute,
+                "tpm_limit": self._tokens.per_minute,
+                "estimated_tokens": self._estimated_tokens,
+                "reported_tokens": self._reported_tokens,
+                "last_error": self._last_error
+            }
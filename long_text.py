@@ -0,0 +1,104 @@
+# Bounded-cost classification of long message bodies.
+#
+# The Gmail extension sends whole email bodies, and every detection stage
+# (tokenizing, TF-IDF, the rule scans) costs time linear in the text, so a
+# newsletter of tens of KB is the slowest request we serve. A text longer than
+# one segment is split into fixed-size segments, scored from the top one at a
+# time, and scoring stops at the first confidently spam segment or after
+# max_segments. The verdict is spam if any scored segment is spam, so stopping
+# early only leaves the spam confidence lower than a full scan might give.
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+class WindowReport(NamedTuple):
+    # Segments scored and how many the cap allowed
+    segments: int
+    max_segments: int
+    # Characters from the start of the text that were scored, of the whole text
+    examined_chars: int
+    total_chars: int
+    # A segment was confidently spam, so the rest was skipped
+    stopped_early: bool
+    # The text goes on past the last segment the cap allows
+    capped: bool
+
+def iter_segments(text: str, segment_chars: int, overlap_chars: int) -> Iterator[Tuple[int, int]]:
+    """
+    (start, end) of consecutive segments of at most segment_chars covering text.
+    Segments end at whitespace in their second half when there is any, so words
+    stay whole, and start up to overlap_chars before the previous end so a
+    phrase across the boundary is seen whole by one of them.
+    """
+    overlap_chars = min(overlap_chars, segment_chars // 4)
+    start = 0
+    length = len(text)
+    while start < length:
+        end = start + segment_chars
+        if end >= length:
+            yield start, length
+            return
+        cut = max(text.rfind(' ', start + segment_chars // 2, end), text.rfind('\n', start + segment_chars // 2, end))
+        if cut > start:
+            end = cut
+        yield start, end
+        if overlap_chars:
+            space = text.find(' ', end - overlap_chars, end)
+            start = space + 1 if space != -1 else end
+        else:
+            start = end
+
+class WindowedScorer:
+    """
+    Scores texts longer than segment_chars segment by segment (see above).
+    score is called with each segment's text and returns a result with
+    prediction (1 = spam) and confidence.
+    """
+    def __init__(self, segment_chars: int = 1000, overlap_chars: int = 100, max_segments: int = 16,
+                 stop_confidence: float = 0.9):
+        self.segment_chars = segment_chars
+        self.overlap_chars = overlap_chars
+        self.max_segments = max_segments
+        self.stop_confidence = stop_confidence
+
+    def is_long(self, text: str) -> bool:
+        return 0 < self.segment_chars < len(text)
+
+    def segments(self, text: str) -> Optional[List[Tuple[int, int]]]:
+        """Segments the cap allows, or None if the text is scored whole"""
+        if not self.is_long(text):
+            return None
+        return list(islice(iter_segments(text, self.segment_chars, self.overlap_chars), max(1, self.max_segments)))
+
+    def score(self, text: str, segments: List[Tuple[int, int]],
+              score: Callable[[str], T]) -> Tuple[T, List[T], WindowReport]:
+        """
+        Score segments in order until one is confidently spam. Returns the result
+        that decides the verdict (the most confident spam segment, or else the
+        least confident ham one), every segment result, and the report.
+        """
+        results = []
+        for start, end in segments:
+            result = score(text[start:end])
+            results.append(result)
+            if result.prediction == 1 and result.confidence >= self.stop_confidence:
+                break
+        stopped_early = len(results) < len(segments)
+        spam = [result for result in results if result.prediction == 1]
+        if spam:
+            decisive = max(spam, key=lambda result: result.confidence)
+        else:
+            decisive = min(results, key=lambda result: result.confidence)
+        examined_chars = segments[len(results) - 1][1]
+        report = WindowReport(len(results), self.max_segments, examined_chars, len(text), stopped_early,
+                              segments[-1][1] < len(text))
+        return decisive, results, report
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "segment_chars": self.segment_chars,
+            "overlap_chars": self.overlap_chars,
+            "max_segments": self.max_segments,
+            "stop_confidence": self.stop_confidence
+        }
@@ -0,0 +1,420 @@
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond scoring up to slow Gemini calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Totals of exited workers, next to the per-pid snapshots of the running ones
+RETIRED_FILE = 'retired.json'
+# Snapshot ids remembered in the retired file, so a scrape that read a worker's file
+# just before it was retired doesn't count it twice
+RETIRED_IDS_KEPT = 1000
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+def _encode(metrics: Dict[str, dict]) -> Dict[str, list]:
+    return {name: [[list(key), value] for key, value in values.items()] for name, values in metrics.items()}
+
+def _decode(metrics: Dict[str, list]) -> Dict[str, dict]:
+    return {name: {tuple(key): value for key, value in values} for name, values in metrics.items()}
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path: str, data: dict):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def merge(snapshots: List[Dict[Tuple[str, ...], float]]) -> Dict[Tuple[str, ...], float]:
+        """Totals over the snapshots of several processes"""
+        merged: Dict[Tuple[str, ...], float] = {}
+        for values in snapshots:
+            for key, value in values.items():
+                merged[key] = merged.get(key, 0.0) + value
+        return merged
+
+    def render(self, values: Dict[Tuple[str, ...], float], extra: Sequence[str] = ()) -> List[str]:
+        """Lines for values, whose keys hold the label values followed by those of the extra label names"""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        names = self.labelnames + tuple(extra)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(names, key)} {_format_value(value)}')
+        return lines
+
+class Gauge(Counter):
+    """Value that can go up and down, with optional labels"""
+    metric_type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = float(value)
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            return sum(entry[0]) if entry else 0
+
+    def snapshot(self) -> Dict[Tuple[str, ...], list]:
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def merge(snapshots: List[Dict[Tuple[str, ...], list]]) -> Dict[Tuple[str, ...], list]:
+        """Bucket counts and sums added up over the snapshots of several processes"""
+        merged: Dict[Tuple[str, ...], list] = {}
+        for values in snapshots:
+            for key, (counts, total) in values.items():
+                entry = merged.get(key)
+                if entry is None:
+                    merged[key] = [list(counts), total]
+                else:
+                    entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                    entry[1] += total
+        return merged
+
+    def render(self, values: Dict[Tuple[str, ...], list], extra: Sequence[str] = ()) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + tuple(extra)
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(names + ('le',), key + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(names, key)} {repr(total)}')
+            lines.append(f'{self.name}_count{_format_labels(names, key)} {cumulative}')
+        return lines
+
+class MetricsRegistry:
+    """Holds the metrics of this process and renders them in the Prometheus text format"""
+    def __init__(self):
+        self._metrics: List = []
+        self._snapshot_id: Optional[str] = None
+        self._snapshot_pid: Optional[int] = None
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def reset_totals(self):
+        """Clear counters and histograms, e.g. in a forked worker so the parent's counts aren't repeated"""
+        for metric in self._metrics:
+            if not isinstance(metric, Gauge):
+                metric.reset()
+
+    def _process_snapshot_id(self) -> str:
+        # Unlike the pid, never reused, so a new worker's snapshot can't pass for a retired one
+        pid = os.getpid()
+        if self._snapshot_pid != pid:
+            self._snapshot_id = f'{pid}-{uuid.uuid4().hex}'
+            self._snapshot_pid = pid
+        return self._snapshot_id
+
+    def write_snapshot(self, directory: str):
+        """Save this process's metrics as <directory>/<pid>.json, for whichever worker answers the scrape"""
+        pid = os.getpid()
+        _write_json(os.path.join(directory, f'{pid}.json'), {
+            'pid': pid,
+            'id': self._process_snapshot_id(),
+            'metrics': _encode({metric.name: metric.snapshot() for metric in self._metrics})
+        })
+
+    def _read_snapshots(self, directory: str) -> List[dict]:
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json') or name == RETIRED_FILE:
+                continue
+            data = _read_json(os.path.join(directory, name))
+            if data is None:
+                continue
+            snapshots.append({'pid': data['pid'], 'id': data.get('id'), 'metrics': _decode(data['metrics'])})
+        return snapshots
+
+    def _read_retired(self, directory: str) -> dict:
+        data = _read_json(os.path.join(directory, RETIRED_FILE))
+        if data is None:
+            return {'ids': [], 'metrics': {}}
+        return {'ids': data['ids'], 'metrics': _decode(data['metrics'])}
+
+    def retire_snapshot(self, directory: str, pid: int) -> bool:
+        """
+        Add the counters and histograms of an exited worker's snapshot to the retired
+        totals and remove its file, so snapshots don't pile up and a new process with
+        the same pid can't overwrite them. Only one process (the supervisor) may call it.
+        """
+        path = os.path.join(directory, f'{pid}.json')
+        data = _read_json(path)
+        if data is None:
+            return False
+        retired = self._read_retired(directory)
+        if data.get('id') not in retired['ids']:
+            snapshot = _decode(data['metrics'])
+            totals = retired['metrics']
+            for metric in self._metrics:
+                if not isinstance(metric, Gauge) and metric.name in snapshot:
+                    totals[metric.name] = metric.merge([totals.get(metric.name, {}), snapshot[metric.name]])
+            # Written before the worker's file is removed, so a scrape never misses its counts
+            _write_json(os.path.join(directory, RETIRED_FILE),
+                        {'ids': (retired['ids'] + [data.get('id')])[-RETIRED_IDS_KEPT:], 'metrics': _encode(totals)})
+        for stale in (path, f'{path}.tmp'):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def render(self, directory: Optional[str] = None) -> str:
+        """
+        Prometheus text of this process, labelled with its pid; with a directory,
+        of every worker that wrote a snapshot there instead. Counters and histograms
+        are then summed over all workers, including exited ones (retired by the
+        supervisor) so totals never drop, and gauges are reported per running worker.
+        """
+        lines = []
+        if directory is None:
+            worker = (str(os.getpid()),)
+            for metric in self._metrics:
+                values = {key + worker: value for key, value in metric.snapshot().items()}
+                lines.extend(metric.render(values, ('worker',)))
+            return '\n'.join(lines) + '\n'
+
+        self.write_snapshot(directory)
+        snapshots = self._read_snapshots(directory)
+        # Read after the workers' files: one retired meanwhile is in these totals and skipped here
+        retired = self._read_retired(directory)
+        retired_ids = set(retired['ids'])
+        snapshots = [snapshot for snapshot in snapshots if snapshot['id'] is None or snapshot['id'] not in retired_ids]
+        live = [snapshot for snapshot in snapshots if _process_alive(snapshot['pid'])]
+        for metric in self._metrics:
+            if isinstance(metric, Gauge):
+                values = {key + (str(snapshot['pid']),): value
+                          for snapshot in live for key, value in snapshot['metrics'].get(metric.name, {}).items()}
+                lines.extend(metric.render(values, ('worker',)))
+            else:
+                lines.extend(metric.render(metric.merge([retired['metrics'].get(metric.name, {})] +
+                                                        [snapshot['metrics'].get(metric.name, {})
+                                                         for snapshot in snapshots])))
+        return '\n'.join(lines) + '\n'
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def clear_snapshots(directory: str):
+    """Remove the snapshots of an earlier server run"""
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.json.tmp')):
+            os.remove(os.path.join(directory, name))
+
+class SnapshotWriter:
+    """Thread writing this process's metrics snapshot every interval seconds (and once more on stop)"""
+    def __init__(self, registry: MetricsRegistry, directory: str, interval: float = 1.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.registry.write_snapshot(self.directory)
+            except OSError as e:
+                print(f"Could not write metrics snapshot: {e}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.registry.write_snapshot(self.directory)
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metrics of the spam API
+stage_seconds = REGISTRY.histogram(
+    'spam_api_stage_seconds', 'Time spent in each processing stage', ['stage'])
+http_requests = REGISTRY.counter(
+    'spam_api_http_requests_total', 'HTTP requests by route and status code', ['route', 'status'])
+http_request_seconds = REGISTRY.histogram(
+    'spam_api_http_request_seconds', 'HTTP request latency by route', ['route'])
+classifications = REGISTRY.counter(
+    'spam_api_classifications_total', 'Classified messages by endpoint and result', ['endpoint', 'classification'])
+llm_calls = REGISTRY.counter(
+    'spam_api_llm_calls_total', 'Gemini generation calls by purpose and outcome', ['purpose', 'outcome'])
+quota_exceeded = REGISTRY.counter(
+    'spam_api_quota_exceeded_total', 'Gemini quota (429) errors', ['source'])
+llm_tokens = REGISTRY.counter(
+    'spam_api_llm_tokens_total', 'Gemini tokens reserved before calls (estimated) and reported by responses (reported)',
+    ['kind'])
+llm_breaker_state = REGISTRY.gauge(
+    'spam_api_llm_breaker_state', 'Gemini circuit breaker state (0 closed, 1 half-open, 2 open)')
+cascade_decisions = REGISTRY.counter(
+    'spam_api_cascade_decisions_total', 'Classified messages by the stage that settled them (combined = all stages ran)',
+    ['decided_by'])
+ad_jobs = REGISTRY.counter(
+    'spam_api_ad_jobs_total',
+    'Background ad jobs by outcome (done, failed, rejected when the queue is full, coalesced into an identical job)',
+    ['outcome'])
+ad_job_queue_depth = REGISTRY.gauge(
+    'spam_api_ad_job_queue_depth', 'Ad jobs waiting for a worker')
+ad_job_workers = REGISTRY.gauge(
+    'spam_api_ad_job_workers', 'Ad job workers by state (busy, idle)', ['state'])
+ad_job_wait_seconds = REGISTRY.histogram(
+    'spam_api_ad_job_wait_seconds', 'Time ad jobs spent queued before a worker picked them up')
+ad_job_run_seconds = REGISTRY.histogram(
+    'spam_api_ad_job_run_seconds', 'Time a worker spent on an ad job')
+ad_library_lookups = REGISTRY.counter(
+    'spam_api_ad_library_lookups_total', 'Ad library lookups by outcome (hit = stored ad served, miss = Gemini)',
+    ['outcome'])
+windowed_messages = REGISTRY.counter(
+    'spam_api_windowed_messages_total',
+    'Long messages scored in segments, by how the scan ended (stopped_early, capped, complete)', ['outcome'])
+coalesced_calls = REGISTRY.counter(
+    'spam_api_coalesced_total', 'Calls that waited for an identical in-flight computation instead of repeating it', ['kind'])
+feedback_reports = REGISTRY.counter(
+    'spam_api_feedback_total', 'Feedback reports received by label', ['label'])
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of the wrapped block in spam_api_stage_seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+def render_metrics(directory: Optional[str] = None) -> str:
+    return REGISTRY.render(directory)
+
+class MetricsMiddleware:
+    """ASGI middleware counting HTTP requests and their latency per route template"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            http_requests.inc(route=path, status=status[0])
+            http_request_seconds.observe(time.perf_counter() - start, route=path)
@@ -0,0 +1,230 @@
+# Compact, pickle-free model artifacts for the serving path: the sorted TF-IDF
+# vocabulary plus idf_/coef_/intercept_ as .npy arrays opened with mmap_mode='r',
+# so loading is near instant and uvicorn workers share the pages.
+#
+# Usage: python model_artifacts.py robust_vectorizer.pkl robust_model.pkl
+import argparse
+import json
+import os
+import pickle
+import re
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from sklearn.linear_model import LogisticRegression
+
+ARTIFACT_FORMAT_VERSION = 1
+DEFAULT_ARTIFACT_ROOT = 'model_artifacts'
+CURRENT_FILE = 'CURRENT'
+
+class ArtifactVectorizer:
+    """TfidfVectorizer.transform for word n-grams, backed by memory-mapped arrays"""
+    def __init__(self, manifest: dict, vocabulary: np.ndarray, idf: Optional[np.ndarray]):
+        params = manifest['vectorizer']
+        self.vocabulary = vocabulary
+        self.idf_ = idf
+        self.lowercase = params['lowercase']
+        self.ngram_range = tuple(params['ngram_range'])
+        self.norm = params['norm']
+        self.sublinear_tf = params['sublinear_tf']
+        self.binary = params['binary']
+        self._token_pattern = re.compile(params['token_pattern'])
+        stop_words = params['stop_words']
+        if stop_words == 'english':
+            self._stop_words = ENGLISH_STOP_WORDS
+        else:
+            self._stop_words = frozenset(stop_words) if stop_words else None
+
+    def build_analyzer(self):
+        return self.analyze
+
+    def analyze(self, doc: str) -> List[str]:
+        """Same terms as the sklearn word analyzer (lowercase, token_pattern, stop words, n-grams)"""
+        if self.lowercase:
+            doc = doc.lower()
+        tokens = self._token_pattern.findall(doc)
+        if self._stop_words is not None:
+            tokens = [w for w in tokens if w not in self._stop_words]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            for i in range(len(tokens) - n + 1):
+                terms.append(" ".join(tokens[i: i + n]))
+        return terms
+
+    def lookup(self, terms: List[str]) -> np.ndarray:
+        """Column index of each term, or -1 for terms outside the vocabulary"""
+        if not terms:
+            return np.empty(0, dtype=np.intp)
+        queries = np.array(terms)
+        positions = np.searchsorted(self.vocabulary, queries)
+        positions[positions == len(self.vocabulary)] = 0
+        found = self.vocabulary[positions] == queries
+        return np.where(found, positions, -1)
+
+    def transform(self, raw_documents: Iterable[str]) -> sp.csr_matrix:
+        indptr = [0]
+        indices = []
+        counts = []
+        for doc in raw_documents:
+            columns = self.lookup(self.analyze(doc))
+            columns, doc_counts = np.unique(columns[columns >= 0], return_counts=True)
+            indices.append(columns)
+            counts.append(doc_counts)
+            indptr.append(indptr[-1] + len(columns))
+
+        data = np.concatenate(counts).astype(np.float64) if counts else np.empty(0)
+        indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.intp)
+        if self.binary:
+            data[:] = 1.0
+        if self.sublinear_tf:
+            data = np.log(data) + 1.0
+        if self.idf_ is not None:
+            data = data * self.idf_[indices]
+
+        indptr = np.asarray(indptr)
+        if self.norm is not None and len(data):
+            row_ids = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+            if self.norm == 'l2':
+                norms = np.sqrt(np.bincount(row_ids, weights=data * data, minlength=len(indptr) - 1))
+            else:
+                norms = np.bincount(row_ids, weights=np.abs(data), minlength=len(indptr) - 1)
+            norms[norms == 0.0] = 1.0
+            data = data / norms[row_ids]
+
+        return sp.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, len(self.vocabulary)))
+
+class ArtifactLinearClassifier:
+    """predict/predict_proba of a binary LogisticRegression from memory-mapped coefficients"""
+    def __init__(self, coef: np.ndarray, intercept: np.ndarray, classes: np.ndarray):
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.classes_ = classes
+
+    def decision_function(self, X) -> np.ndarray:
+        return np.asarray(X @ self.coef_[0]).ravel() + self.intercept_[0]
+
+    def predict_proba(self, X) -> np.ndarray:
+        prob = 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+        return np.column_stack([1.0 - prob, prob])
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+def export_vectorizer(vectorizer, out_dir: str) -> dict:
+    """Write a word-level TfidfVectorizer's vocabulary and idf into out_dir; returns its manifest section"""
+    params = vectorizer.get_params()
+    if params['analyzer'] != 'word' or params['tokenizer'] is not None or params['preprocessor'] is not None \
+            or params['strip_accents'] is not None:
+        raise ValueError("Only the default word analyzer is supported")
+    stop_words = params['stop_words']
+    if stop_words is not None and stop_words != 'english':
+        stop_words = sorted(stop_words)
+
+    os.makedirs(out_dir, exist_ok=True)
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    columns = np.array([vectorizer.vocabulary_[term] for term in terms])
+    order = np.argsort(np.array(terms))
+    if not np.array_equal(columns[order], np.arange(len(terms))):
+        # Columns follow vocabulary order in sklearn; anything else would need a remap
+        raise ValueError("Vectorizer columns are not in sorted vocabulary order")
+
+    np.save(os.path.join(out_dir, 'vocabulary.npy'), np.array(terms)[order])
+    if params['use_idf']:
+        np.save(os.path.join(out_dir, 'idf.npy'), np.asarray(vectorizer.idf_, dtype=np.float64))
+    return {
+        'lowercase': params['lowercase'],
+        'token_pattern': params['token_pattern'],
+        'stop_words': stop_words,
+        'ngram_range': list(params['ngram_range']),
+        'norm': params['norm'],
+        'use_idf': params['use_idf'],
+        'sublinear_tf': params['sublinear_tf'],
+        'binary': params['binary']
+    }
+
+def export_artifacts(vectorizer, classifier, out_dir: str) -> str:
+    """Write vectorizer + classifier as an artifact directory. Only word-level TF-IDF and binary logistic regression are supported."""
+    if not isinstance(classifier, LogisticRegression) or len(classifier.classes_) != 2:
+        raise ValueError("Only binary LogisticRegression models can be exported as artifacts")
+    vectorizer_manifest = export_vectorizer(vectorizer, out_dir)
+    np.save(os.path.join(out_dir, 'coef.npy'), np.asarray(classifier.coef_, dtype=np.float64))
+    np.save(os.path.join(out_dir, 'intercept.npy'), np.asarray(classifier.intercept_, dtype=np.float64))
+    np.save(os.path.join(out_dir, 'classes.npy'), np.asarray(classifier.classes_))
+
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'vectorizer': vectorizer_manifest,
+        'classifier': {'type': 'logistic_regression', 'n_features': len(vectorizer.vocabulary_)}
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return out_dir
+
+def _load_array(path: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(path, name), mmap_mode='r', allow_pickle=False)
+
+def load_vectorizer(path: str, manifest: dict) -> ArtifactVectorizer:
+    """Open the vectorizer arrays written by export_vectorizer"""
+    idf = _load_array(path, 'idf.npy') if manifest['vectorizer']['use_idf'] else None
+    return ArtifactVectorizer(manifest, _load_array(path, 'vocabulary.npy'), idf)
+
+def load_artifacts(path: str) -> Tuple[ArtifactVectorizer, ArtifactLinearClassifier]:
+    """Open an artifact directory without unpickling anything"""
+    with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format: {manifest.get('format_version')}")
+
+    vectorizer = load_vectorizer(path, manifest)
+    classifier = ArtifactLinearClassifier(_load_array(path, 'coef.npy'), _load_array(path, 'intercept.npy'),
+                                          np.array(_load_array(path, 'classes.npy')))
+    return vectorizer, classifier
+
+def current_artifact_dir(root: str = DEFAULT_ARTIFACT_ROOT) -> Optional[str]:
+    """Directory of the active artifact version under root, or None if there isn't one"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding='utf-8') as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(root, version)
+    return path if version and os.path.isfile(os.path.join(path, 'manifest.json')) else None
+
+def set_current_version(root: str, version: str):
+    """Point root/CURRENT at a version (written atomically)"""
+    tmp_path = os.path.join(root, CURRENT_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+def export_version(vectorizer, classifier, root: str = DEFAULT_ARTIFACT_ROOT,
+                   version: Optional[str] = None, activate: bool = True) -> str:
+    """Export into root/<version> and optionally make it the current version"""
+    version = version or time.strftime('v%Y%m%d-%H%M%S')
+    export_artifacts(vectorizer, classifier, os.path.join(root, version))
+    if activate:
+        set_current_version(root, version)
+    return version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export pickled vectorizer/model as memory-mappable artifacts")
+    parser.add_argument('vectorizer', help="pickled TfidfVectorizer, e.g. robust_vectorizer.pkl")
+    parser.add_argument('model', help="pickled LogisticRegression, e.g. robust_model.pkl")
+    parser.add_argument('--root', default=DEFAULT_ARTIFACT_ROOT, help="artifact root directory")
+    parser.add_argument('--version', help="version name (default: timestamp)")
+    parser.add_argument('--no-activate', action='store_true', help="don't make this the current version")
+    args = parser.parse_args()
+
+    with open(args.vectorizer, 'rb') as f:
+        tfidf = pickle.load(f)
+    with open(args.model, 'rb') as f:
+        clf = pickle.load(f)
+    version = export_version(tfidf, clf, args.root, args.version, activate=not args.no_activate)
+    print(f"Exported artifacts to {os.path.join(args.root, version)}")
@@ -0,0 +1,226 @@
+import csv
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from linear_scoring import build_linear_scorer
+from model_artifacts import CURRENT_FILE, load_artifacts, set_current_version
+
+# Fallback canary set when no labelled data file is available
+CANARY_MESSAGES: List[Tuple[str, int]] = [
+    ("Congratulations! You've won a $1000 gift card. Click here to claim your prize now!", 1),
+    ("URGENT! Your account has been suspended. Verify your details at http://secure-bank-login.com", 1),
+    ("FREE entry in 2 a wkly comp to win FA Cup final tkts. Text FA to 87121 to receive entry", 1),
+    ("Make money fast! Double your investment in 24 hours. Limited time offer, call now", 1),
+    ("Hi, how are you doing today? Let's meet for coffee tomorrow.", 0),
+    ("Can you send me the notes from yesterday's lecture when you get a chance?", 0),
+    ("I'll be home late tonight, don't wait up for dinner", 0),
+    ("Ok lar... Joking wif u oni...", 0),
+]
+
+def load_canary(path: str, size: int = 1000, seed: int = 0) -> List[Tuple[str, int]]:
+    """
+    A fixed random sample of size distinct labelled messages from a CSV in the
+    spam.csv layout (v1 = ham/spam, v2 = text). The same file, size and seed
+    always give the same sample, so every worker checks models on the same set.
+    """
+    labels = {'ham': 0, 'spam': 1}
+    with open(path, newline='', encoding='latin-1') as f:
+        rows = {row['v2']: labels[row['v1']] for row in csv.DictReader(f) if row.get('v1') in labels and row.get('v2')}
+    messages = sorted(rows.items())
+    random.Random(seed).shuffle(messages)
+    return messages[:size]
+
+class ModelBundle:
+    """A vectorizer and classifier that are always swapped together"""
+    def __init__(self, version: str, vectorizer, classifier, source: str):
+        self.version = version
+        self.vectorizer = vectorizer
+        self.classifier = classifier
+        self.source = source
+        self.loaded_at = time.time()
+        # Share of the canary set classified correctly, once validated
+        self.canary_accuracy: Optional[float] = None
+        # Direct sparse scoring for TF-IDF + logistic regression; None means score with sklearn
+        self.scorer = build_linear_scorer(vectorizer, classifier)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "classifier": type(self.classifier).__name__,
+            "scoring": "linear_kernel" if self.scorer is not None else "sklearn",
+            "canary_accuracy": self.canary_accuracy,
+            "loaded_at": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.loaded_at))
+        }
+
+class ModelValidationError(Exception):
+    """Raised when a candidate model fails to load or fails the canary check"""
+    pass
+
+class CanaryAccuracyError(ModelValidationError):
+    """Raised when a model scores the canary set, but too few of its answers are right"""
+    pass
+
+class ModelManager:
+    """
+    Holds the active ModelBundle and replaces it without downtime.
+    A new version is loaded and checked on the canary messages before the
+    single reference swap, so a request sees either the old or the new model.
+    It must get at least canary_min_accuracy of them right, and may not do more
+    than canary_max_regression worse than the active model. The previous bundle
+    is kept for rollback.
+    """
+    def __init__(self, artifact_root: str, preprocess: Callable[[str], str],
+                 canary_min_accuracy: float = 0.9, canary: Optional[List[Tuple[str, int]]] = None,
+                 canary_max_regression: float = 0.02):
+        self.artifact_root = artifact_root
+        self.preprocess = preprocess
+        self.canary_min_accuracy = canary_min_accuracy
+        self.canary_max_regression = canary_max_regression
+        self.canary = canary if canary is not None else CANARY_MESSAGES
+        # Preprocessed canary texts, computed on first use
+        self._canary_texts: Optional[List[str]] = None
+
+        self.active: Optional[ModelBundle] = None
+        self.previous: Optional[ModelBundle] = None
+        self._reload_lock = threading.Lock()
+        self._watch_thread: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        self._watched_version: Optional[str] = None
+        self._last_error: Optional[str] = None
+        self._reloads = 0
+
+    def _canary_inputs(self) -> List[str]:
+        if self._canary_texts is None:
+            self._canary_texts = [self.preprocess(text) for text, _ in self.canary]
+        return self._canary_texts
+
+    def validate(self, bundle: ModelBundle) -> float:
+        """
+        Score the canary messages; returns the accuracy or raises ModelValidationError
+        (CanaryAccuracyError when the model works but is not accurate enough)
+        """
+        labels = np.array([label for _, label in self.canary])
+        try:
+            # Preprocessing can fail too (e.g. missing NLTK data), which makes the model unusable
+            texts = self._canary_inputs()
+            probs = np.asarray(bundle.classifier.predict_proba(bundle.vectorizer.transform(texts)))
+            predictions = np.asarray(bundle.classifier.classes_)[probs.argmax(axis=1)]
+        except Exception as e:
+            raise ModelValidationError(f"Model {bundle.version} failed to score the canary set: {e}")
+        if probs.shape != (len(texts), 2) or not np.all(np.isfinite(probs)):
+            raise ModelValidationError(f"Model {bundle.version} returned invalid probabilities")
+        accuracy = float((predictions == labels).mean())
+        bundle.canary_accuracy = accuracy
+        required = self.canary_min_accuracy
+        active = self.active
+        if active is not None and active is not bundle and active.canary_accuracy is not None:
+            required = max(required, active.canary_accuracy - self.canary_max_regression)
+        if accuracy < required:
+            raise CanaryAccuracyError(
+                f"Model {bundle.version} got {accuracy:.1%} of {len(labels)} canary messages right "
+                f"(needs {required:.1%})")
+        return accuracy
+
+    def current_version(self) -> Optional[str]:
+        """Version named by the CURRENT file of the artifact root"""
+        try:
+            with open(os.path.join(self.artifact_root, CURRENT_FILE), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def load_version(self, version: str) -> ModelBundle:
+        path = os.path.join(self.artifact_root, version)
+        try:
+            vectorizer, classifier = load_artifacts(path)
+        except Exception as e:
+            raise ModelValidationError(f"Could not load model {version} from {path}: {e}")
+        return ModelBundle(version, vectorizer, classifier, source=path)
+
+    def activate(self, bundle: ModelBundle):
+        """Make bundle the active model (a single reference assignment)"""
+        self.previous = self.active
+        self.active = bundle
+        print(f"Activated model {bundle.version}")
+
+    def reload(self, version: Optional[str] = None, publish: bool = False) -> Dict[str, Any]:
+        """
+        Load, validate and activate an artifact version (default: the one in CURRENT).
+        With publish=True the CURRENT file is updated too, so other workers follow.
+        """
+        with self._reload_lock:
+            version = version or self.current_version()
+            if version is None:
+                raise ModelValidationError(f"No version given and no {CURRENT_FILE} file in {self.artifact_root}")
+            if self.active is not None and self.active.version == version:
+                return {"changed": False, "model": self.active.describe()}
+            try:
+                bundle = self.load_version(version)
+                accuracy = self.validate(bundle)
+            except ModelValidationError as e:
+                self._last_error = str(e)
+                print(f"Model reload rejected: {e}")
+                raise
+            self.activate(bundle)
+            self._reloads += 1
+            self._last_error = None
+            if publish:
+                set_current_version(self.artifact_root, version)
+                self._watched_version = version
+            return {"changed": True, "model": bundle.describe(), "canary_accuracy": accuracy}
+
+    def rollback(self, publish: bool = False) -> Dict[str, Any]:
+        """Swap back to the previously active model"""
+        with self._reload_lock:
+            if self.previous is None:
+                raise ModelValidationError("No previous model to roll back to")
+            bundle = self.previous
+            self.activate(bundle)
+            self._reloads += 1
+            # The watcher only reacts to changes of CURRENT, so it won't undo this on its own
+            if publish and bundle.source == os.path.join(self.artifact_root, bundle.version):
+                set_current_version(self.artifact_root, bundle.version)
+                self._watched_version = bundle.version
+            return {"changed": True, "model": bundle.describe()}
+
+    def _watch(self, interval: float):
+        while not self._watch_stop.wait(interval):
+            version = self.current_version()
+            if version is None or version == self._watched_version:
+                continue
+            self._watched_version = version
+            try:
+                self.reload(version)
+            except ModelValidationError:
+                pass  # already logged; keep serving the active model
+            except Exception as e:
+                print(f"Model watcher error: {e}")
+
+    def start_watching(self, interval: float):
+        """Poll the CURRENT file and reload when it names a new version (one thread per process)"""
+        if interval <= 0 or (self._watch_thread is not None and self._watch_thread.is_alive()):
+            return
+        if self._watched_version is None:
+            self._watched_version = self.current_version()
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=self._watch, args=(interval,), name="model-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._watch_stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "active": self.active.describe() if self.active else None,
+            "previous": self.previous.describe() if self.previous else None,
+            "artifact_root": self.artifact_root,
+            "current_file_version": self.current_version(),
+            "reloads": self._reloads,
+            "last_error": self._last_error
+        }
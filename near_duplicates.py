@@ -0,0 +1,169 @@
+# Near-duplicate index of recently classified messages.
+#
+# Campaigns send the same body with another name, amount or link, which the
+# exact-text caches miss. Each message gets a 64-bit SimHash of its character
+# shingles; variants differ in only a few bits. The fingerprint is split into
+# max_distance + 1 bands, so any two fingerprints within max_distance bits
+# share at least one band exactly, and only the entries in the same band
+# buckets are compared.
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import numpy as np
+
+from ad_library import normalize_message
+
+DECIDED_BY = 'near_duplicate'
+FINGERPRINT_BITS = 64
+
+def shingles(text: str, size: int = 4) -> Set[str]:
+    """Character shingles of the normalized text (numbers and links already reduced to placeholders)"""
+    text = normalize_message(text)
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def simhash(features: Set[str]) -> int:
+    """
+    64-bit SimHash: each bit is set when most feature hashes have it set.
+    Uses the built-in str hash, so fingerprints are only comparable within one process.
+    """
+    hashes = np.fromiter((hash(feature) for feature in features), dtype=np.int64, count=len(features))
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    majority = bits.sum(axis=0) * 2 > len(features)
+    return int(np.packbits(majority, bitorder='little').view('<u8')[0])
+
+class NearDuplicate(NamedTuple):
+    prediction: int
+    confidence: float
+    # 1 - differing fingerprint bits / 64
+    similarity: float
+    ad: Optional[str]
+
+class _Entry:
+    __slots__ = ('version', 'prediction', 'confidence', 'ad', 'expires')
+
+    def __init__(self, version: str, prediction: int, confidence: float, expires: float):
+        self.version = version
+        self.prediction = prediction
+        self.confidence = confidence
+        self.ad = None
+        self.expires = expires
+
+class NearDuplicateIndex:
+    """
+    Verdicts (and ads) of recently classified messages, found again for messages
+    whose fingerprint is at most max_distance bits away. At most max_entries are
+    kept (least recently used go first) and each expires after ttl_seconds.
+    Verdicts are stored with a version (model and cascade mode) and only reused
+    for the same version. Thread-safe.
+    """
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600, max_distance: int = 5,
+                 min_shingles: int = 20):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.min_shingles = min_shingles
+
+        bands = max_distance + 1
+        widths = [FINGERPRINT_BITS // bands + (1 if band < FINGERPRINT_BITS % bands else 0) for band in range(bands)]
+        offsets = np.cumsum([0] + widths[:-1])
+        self._bands = [(int(offset), (1 << width) - 1) for offset, width in zip(offsets, widths)]
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in self._bands]
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def fingerprint(self, text: str) -> Optional[int]:
+        """SimHash of the message, or None if it is too short for a reliable match"""
+        features = shingles(text)
+        if len(features) < self.min_shingles:
+            return None
+        return simhash(features)
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> offset) & mask for offset, mask in self._bands]
+
+    def _remove(self, fingerprint: int):
+        del self._entries[fingerprint]
+        for buckets, key in zip(self._buckets, self._band_keys(fingerprint)):
+            bucket = buckets[key]
+            bucket.discard(fingerprint)
+            if not bucket:
+                del buckets[key]
+
+    def _nearest(self, fingerprint: int, version: Optional[str], with_ad: bool) -> Optional[NearDuplicate]:
+        now = time.monotonic()
+        best = None
+        best_distance = self.max_distance + 1
+        candidates = set()
+        for buckets, key in zip(self._buckets, self._band_keys(fingerprint)):
+            candidates.update(buckets.get(key, ()))
+        for candidate in candidates:
+            entry = self._entries[candidate]
+            if entry.expires <= now:
+                self._remove(candidate)
+                continue
+            if (version is not None and entry.version != version) or (with_ad and entry.ad is None):
+                continue
+            distance = (candidate ^ fingerprint).bit_count()
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        entry = self._entries[best]
+        return NearDuplicate(entry.prediction, entry.confidence, 1.0 - best_distance / FINGERPRINT_BITS, entry.ad)
+
+    def lookup(self, fingerprint: Optional[int], version: str) -> Optional[NearDuplicate]:
+        """Verdict of the closest indexed message classified with the same version"""
+        if fingerprint is None:
+            return None
+        with self._lock:
+            match = self._nearest(fingerprint, version, with_ad=False)
+            if match is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return match
+
+    def find_ad(self, text: str) -> Optional[str]:
+        """Ad stored for the closest indexed message that has one (ads don't depend on the model version)"""
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            match = self._nearest(fingerprint, None, with_ad=True)
+        return match.ad if match is not None else None
+
+    def add(self, fingerprint: Optional[int], version: str, prediction: int, confidence: float):
+        if fingerprint is None:
+            return
+        with self._lock:
+            if fingerprint in self._entries:
+                self._remove(fingerprint)
+            self._entries[fingerprint] = _Entry(version, prediction, confidence, time.monotonic() + self.ttl_seconds)
+            for buckets, key in zip(self._buckets, self._band_keys(fingerprint)):
+                buckets.setdefault(key, set()).add(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def set_ad(self, text: str, ad: str):
+        """Attach a generated ad to the message's entry, if it is indexed"""
+        fingerprint = self.fingerprint(text)
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                entry.ad = ad
+
+    def status(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "max_distance": self.max_distance,
+                "hits": self._hits,
+                "misses": self._misses
+            }
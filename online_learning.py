@@ -0,0 +1,256 @@
+# Incremental learning from user feedback: hashed features (no vocabulary to
+# refit, fixed memory) and an SGD logistic regression updated with partial_fit.
+#
+# Feedback is appended to a SQLite log that every worker process reads, so all
+# workers apply the same updates in the same order. Snapshots store the model
+# plus the last applied log row; a restarted worker loads one and catches up.
+#
+# Usage: python online_learning.py bootstrap --data spam.csv
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from model_artifacts import ArtifactLinearClassifier
+from model_manager import ModelBundle, ModelValidationError
+from sqlite_store import ProcessLocalConnection
+
+CLASSES = np.array([0, 1])
+SNAPSHOT_FORMAT_VERSION = 1
+
+def make_vectorizer(n_features: int) -> HashingVectorizer:
+    # Same n-gram range as the TF-IDF model; l2 norm keeps updates comparable across message lengths
+    return HashingVectorizer(n_features=n_features, ngram_range=(1, 3), alternate_sign=False, norm='l2')
+
+def make_classifier() -> SGDClassifier:
+    # No shuffling, so the same feedback log gives the same model in every worker
+    return SGDClassifier(loss='log_loss', alpha=1e-5, shuffle=False, random_state=0)
+
+class FeedbackLog:
+    """Append-only SQLite table of labelled, preprocessed messages shared by all workers"""
+    def __init__(self, path: str):
+        self.path = path
+        self._db = ProcessLocalConnection(path, [
+            "CREATE TABLE IF NOT EXISTS feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "text TEXT NOT NULL, label INTEGER NOT NULL, source TEXT, created_at REAL NOT NULL)"
+        ])
+        self._lock = threading.Lock()
+
+    def append(self, text: str, label: int, source: Optional[str] = None) -> int:
+        with self._lock:
+            db = self._db.get()
+            cursor = db.execute("INSERT INTO feedback (text, label, source, created_at) VALUES (?, ?, ?, ?)",
+                                (text, label, source, time.time()))
+            db.commit()
+            return cursor.lastrowid
+
+    def read_after(self, last_id: int, limit: int) -> List[Tuple[int, str, int]]:
+        with self._lock:
+            return self._db.get().execute(
+                "SELECT id, text, label FROM feedback WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit)
+            ).fetchall()
+
+class OnlineLearner:
+    """
+    Online spam model: a HashingVectorizer plus an SGDClassifier trained with partial_fit.
+    A background thread applies new feedback in micro-batches and publishes an
+    immutable ModelBundle after each batch, so requests never see a half-applied update.
+    Nothing is published before min_samples messages have been learned, and with
+    validate (e.g. ModelManager.validate) a bundle that fails it is not published:
+    the previous one stays in use.
+    """
+    def __init__(self, feedback_log: FeedbackLog, snapshot_path: str, n_features: int = 2 ** 18,
+                 batch_size: int = 64, poll_interval: float = 2.0, snapshot_interval: float = 300.0,
+                 min_samples: int = 0, validate: Optional[Callable[[ModelBundle], float]] = None):
+        self.feedback_log = feedback_log
+        self.snapshot_path = snapshot_path
+        self.n_features = n_features
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.snapshot_interval = snapshot_interval
+        self.min_samples = min_samples
+        self.validate = validate
+
+        self.vectorizer = make_vectorizer(n_features)
+        self.classifier = make_classifier()
+        self.last_feedback_id = 0
+        self.samples_seen = 0
+        self.bundle: Optional[ModelBundle] = None
+
+        self._update_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_snapshot = time.monotonic()
+        self._dirty = False
+        self._last_update_ms: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._rejected = 0
+
+    def load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except OSError:
+            return False
+        if snapshot.get('format_version') != SNAPSHOT_FORMAT_VERSION or snapshot.get('n_features') != self.n_features:
+            print(f"Ignoring online model snapshot {self.snapshot_path}: different format or feature count")
+            return False
+        self.classifier = snapshot['classifier']
+        self.last_feedback_id = snapshot['last_feedback_id']
+        self.samples_seen = snapshot['samples_seen']
+        self._publish()
+        print(f"Online model snapshot loaded ({self.samples_seen} samples, feedback up to #{self.last_feedback_id})")
+        return True
+
+    def save_snapshot(self):
+        with self._update_lock:
+            snapshot = {
+                'format_version': SNAPSHOT_FORMAT_VERSION,
+                'n_features': self.n_features,
+                'classifier': self.classifier,
+                'last_feedback_id': self.last_feedback_id,
+                'samples_seen': self.samples_seen,
+                'saved_at': time.time()
+            }
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+            self._dirty = False
+            self._last_snapshot = time.monotonic()
+
+    def partial_fit(self, texts: List[str], labels: List[int]):
+        """Update the model with preprocessed texts and publish the result"""
+        start = time.perf_counter()
+        with self._update_lock:
+            self.classifier.partial_fit(self.vectorizer.transform(texts), np.asarray(labels), classes=CLASSES)
+            self.samples_seen += len(texts)
+            self._dirty = True
+            self._publish()
+        self._last_update_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def _publish(self):
+        if self.samples_seen < self.min_samples:
+            return
+        # Copies, so later partial_fit calls don't change a bundle a request is using
+        classifier = ArtifactLinearClassifier(np.array(self.classifier.coef_, dtype=np.float64),
+                                              np.array(self.classifier.intercept_, dtype=np.float64),
+                                              np.array(self.classifier.classes_))
+        bundle = ModelBundle(f"online-{self.samples_seen}", self.vectorizer, classifier, source='online')
+        if self.validate is not None:
+            try:
+                self.validate(bundle)
+            except ModelValidationError as e:
+                self._rejected += 1
+                self._last_error = str(e)
+                print(f"Online model not published: {e}")
+                return
+        self.bundle = bundle
+
+    def apply_pending(self) -> int:
+        """Apply feedback logged since the last update; returns the number of messages learned"""
+        applied = 0
+        while True:
+            rows = self.feedback_log.read_after(self.last_feedback_id, self.batch_size)
+            if not rows:
+                return applied
+            self.partial_fit([text for _, text, _ in rows], [label for _, _, label in rows])
+            self.last_feedback_id = rows[-1][0]
+            applied += len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.apply_pending()
+                if self._dirty and time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+                    self.save_snapshot()
+            except Exception as e:
+                self._last_error = str(e)
+                print(f"Online learning error: {e}")
+
+    def start(self):
+        """Start the background updater (one thread per process)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="online-learner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 5)
+        if self._dirty:
+            self.save_snapshot()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.bundle is not None,
+            "model_version": self.bundle.version if self.bundle else None,
+            "canary_accuracy": self.bundle.canary_accuracy if self.bundle else None,
+            "samples_seen": self.samples_seen,
+            "min_samples": self.min_samples,
+            "rejected_updates": self._rejected,
+            "last_feedback_id": self.last_feedback_id,
+            "hash_features": self.n_features,
+            "last_update_ms": self._last_update_ms,
+            "last_error": self._last_error
+        }
+
+def bootstrap(data_path: str, learner: OnlineLearner, epochs: int = 5, encoding: str = 'latin1'):
+    """Train the online model from a labelled CSV (spam.csv layout), then apply any logged feedback"""
+    import pandas as pd
+    from config import get_preprocessing_config
+    from text_preprocessing import preprocess_corpus
+
+    df = pd.read_csv(data_path, encoding=encoding)
+    df = df.rename(columns={'v1': 'target', 'v2': 'text'})[['target', 'text']].drop_duplicates()
+    labels = df['target'].map({'ham': 0, 'spam': 1}).to_numpy()
+    texts = preprocess_corpus(df['text'], **get_preprocessing_config())
+
+    learner.classifier = make_classifier()
+    learner.samples_seen = 0
+    learner.last_feedback_id = 0
+    rng = np.random.RandomState(0)
+    for epoch in range(epochs):
+        order = rng.permutation(len(texts))
+        for start in range(0, len(order), 1000):
+            batch = order[start:start + 1000]
+            learner.partial_fit([texts[i] for i in batch], labels[batch].tolist())
+        print(f"Epoch {epoch + 1}/{epochs} done")
+    applied = learner.apply_pending()
+    learner.save_snapshot()
+    print(f"Online model bootstrapped from {len(texts)} messages and {applied} feedback entries; "
+          f"snapshot written to {learner.snapshot_path}")
+
+if __name__ == "__main__":
+    from config import get_online_learning_config
+
+    parser = argparse.ArgumentParser(description="Manage the online (feedback-trained) spam model")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    boot = subcommands.add_parser('bootstrap', help="train the initial online model from a labelled CSV")
+    boot.add_argument('--data', default='spam.csv')
+    boot.add_argument('--epochs', type=int, default=5)
+    subcommands.add_parser('status', help="show the snapshot and feedback log state")
+    args = parser.parse_args()
+
+    config = get_online_learning_config()
+    # Relative paths are next to this file, as for the API, so the CLI works from any directory
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    learner = OnlineLearner(FeedbackLog(os.path.join(base_dir, config['feedback_db'])),
+                            os.path.join(base_dir, config['snapshot_path']),
+                            n_features=config['hash_features'], batch_size=config['batch_size'])
+    if args.command == 'bootstrap':
+        bootstrap(args.data, learner, args.epochs)
+    else:
+        learner.load_snapshot()
+        print(learner.status())
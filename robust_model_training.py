@@ -1,7 +1,6 @@
 import pandas as pd
 import numpy as np
 import nltk
-import re
 from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
@@ -9,10 +8,9 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, confusion_matrix, precision_score, recall_score, f1_score
 from sklearn.pipeline import Pipeline
 import pickle
-import string
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
+from text_preprocessing import advanced_text_preprocessing, preprocess_corpus
+from config import get_preprocessing_config
+from model_artifacts import export_version
 
 # Download required NLTK data
 nltk.download('punkt')
@@ -27,44 +25,9 @@ df.rename(columns={'v1': 'target', 'v2': 'text'}, inplace=True)
 df['target'] = df['target'].map({'ham': 0, 'spam': 1})
 df = df.drop_duplicates()
 
-# Initialize stemmer
-ps = PorterStemmer()
-
-def advanced_text_preprocessing(text):
-    """Advanced text preprocessing for better feature extraction"""
-    # Convert to lowercase
-    text = text.lower()
-    
-    # Remove URLs
-    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
-    
-    # Remove email addresses
-    text = re.sub(r'\S+@\S+', '', text)
-    
-    # Remove phone numbers
-    text = re.sub(r'\d{3,}', '', text)
-    
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # Tokenize
-    tokens = word_tokenize(text)
-    
-    # Remove punctuation and non-alphabetic tokens
-    tokens = [token for token in tokens if token.isalpha() and len(token) > 1]
-    
-    # Remove stopwords
-    stop_words = set(stopwords.words('english'))
-    tokens = [token for token in tokens if token not in stop_words]
-    
-    # Stemming
-    tokens = [ps.stem(token) for token in tokens]
-    
-    return " ".join(tokens)
-
 # Apply advanced preprocessing
 print("Preprocessing text data...")
-df['transformed_text'] = df['text'].apply(advanced_text_preprocessing)
+df['transformed_text'] = preprocess_corpus(df['text'], **get_preprocessing_config())
 
 # Remove empty texts after preprocessing
 df = df[df['transformed_text'].str.len() > 0]
@@ -192,6 +155,13 @@ with open('robust_model.pkl', 'wb') as f:
 print("Model training completed successfully!")
 print(f"Saved robust_model.pkl and robust_vectorizer.pkl")
 
+# Export memory-mappable artifacts, which the API prefers over the pickles
+if isinstance(final_model, LogisticRegression):
+    version = export_version(tfidf, final_model)
+    print(f"Exported model artifacts version {version} to model_artifacts/")
+else:
+    print("Final model is not a logistic regression; skipping artifact export")
+
 # Test with the specific spam messages provided
 test_messages = [
     "Congratulations! You've won a $1000 gift card! Click here to claim: http://bit.ly/claim-now Reply within 24 hours or prize expires.",
@@ -0,0 +1,39 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+import metrics
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls with the same key: the first caller starts
+    the computation and callers arriving while it runs await the same result
+    (or exception). Nothing is kept once it finishes, so this only absorbs
+    bursts of identical requests; the ad cache covers repeats over time.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(func())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            metrics.coalesced_calls.inc(kind=self.name)
+        # Shielded, so a caller that goes away (client disconnect) doesn't cancel the work the others wait for
+        return await asyncio.shield(flight)
+
+    def _finish(self, key: str, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Mark the exception as retrieved in case every waiter has gone away
+        if not flight.cancelled():
+            flight.exception()
+
+    def status(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights)}
@@ -0,0 +1,31 @@
+# SQLite tables shared by the worker processes (ad jobs, the feedback log).
+import os
+import sqlite3
+from typing import Optional, Sequence
+
+class ProcessLocalConnection:
+    """
+    A SQLite connection opened lazily and once per process: connections must not
+    cross a fork, so a forked worker opens its own. The schema statements run on
+    each new connection; with wal the database uses write-ahead logging, so
+    readers in other processes don't block the writer. The connection is shared
+    by the process's threads, so callers serialize its use with their own lock.
+    """
+    def __init__(self, path: str, schema: Sequence[str] = (), wal: bool = False, timeout: float = 30):
+        self.path = path
+        self.schema = tuple(schema)
+        self.wal = wal
+        self.timeout = timeout
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def get(self) -> sqlite3.Connection:
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout)
+            if self.wal:
+                self._db.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                self._db.execute(statement)
+            self._db.commit()
+            self._pid = os.getpid()
+        return self._db
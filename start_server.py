@@ -2,8 +2,247 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import argparse
+import asyncio
+import gc
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import traceback
+
+from typing import Optional
+
 import uvicorn
-from enhanced_api import app
+from config import get_server_config
+
+# Workers that exit sooner than this after starting are restarted with a delay
+MIN_WORKER_LIFETIME = 5.0
+RESTART_DELAY = 1.0
+SUPERVISOR_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP) if hasattr(signal, 'SIGHUP') else ()
+
+def parse_args():
+    defaults = get_server_config()
+    parser = argparse.ArgumentParser(description="Run the Enhanced Cyber Awareness Ad API")
+    parser.add_argument('--host', default=defaults['host'], help="bind address (SERVER_HOST)")
+    parser.add_argument('--port', type=int, default=defaults['port'], help="bind port (SERVER_PORT)")
+    parser.add_argument('--workers', type=int, default=defaults['workers'],
+                        help="worker processes, 0 = one per CPU (SERVER_WORKERS)")
+    parser.add_argument('--backlog', type=int, default=defaults['backlog'], help="listen backlog (SERVER_BACKLOG)")
+    parser.add_argument('--max-requests', type=int, default=defaults['max_requests'],
+                        help="recycle a worker after this many requests, 0 = never (SERVER_MAX_REQUESTS)")
+    parser.add_argument('--max-requests-jitter', type=int, default=defaults['max_requests_jitter'],
+                        help="random extra requests per worker so they don't recycle together (SERVER_MAX_REQUESTS_JITTER)")
+    parser.add_argument('--graceful-timeout', type=float, default=defaults['graceful_timeout'],
+                        help="seconds to finish in-flight requests on shutdown (SERVER_GRACEFUL_TIMEOUT)")
+    args = parser.parse_args()
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    return args
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Listening socket created once in the parent and inherited by every worker"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock: socket.socket, args):
+    """Serve on the shared socket until stopped or recycled (runs in the forked child)"""
+    random.seed()
+    # Counts inherited from the parent (the preload) belong to no worker
+    import metrics
+    metrics.REGISTRY.reset_totals()
+    max_requests = None
+    if args.max_requests > 0:
+        max_requests = args.max_requests + random.randint(0, max(args.max_requests_jitter, 0))
+    config = uvicorn.Config(
+        app,
+        backlog=args.backlog,
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=args.graceful_timeout
+    )
+    asyncio.run(uvicorn.Server(config).serve(sockets=[sock]))
+
+class Supervisor:
+    """Forks the workers, restarts the ones that exit and forwards shutdown signals"""
+    def __init__(self, app, sock: socket.socket, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> start time
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        # Hold signals across the fork so the child never runs the supervisor's handlers
+        # and a shutdown that arrives meanwhile still reaches the new worker
+        signal.pthread_sigmask(signal.SIG_BLOCK, SUPERVISOR_SIGNALS)
+        if self.stopping:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SUPERVISOR_SIGNALS)
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                for sig in SUPERVISOR_SIGNALS:
+                    signal.signal(sig, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, SUPERVISOR_SIGNALS)
+                run_worker(self.app, self.sock, self.args)
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        self.workers[pid] = time.monotonic()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, SUPERVISOR_SIGNALS)
+        print(f"Started worker {pid}")
+
+    def signal_workers(self, sig):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def handle_stop(self, signum, frame):
+        if not self.stopping:
+            print("Shutting down workers...")
+            self.stopping = True
+            self.signal_workers(signal.SIGTERM)
+
+    def handle_reload(self, signum, frame):
+        # SIGHUP: recycle every worker, one by one, without dropping the socket
+        self.reload_requested = True
+
+    def retire_metrics(self, pid: int):
+        # Fold an exited worker's counts into the retired totals (a new worker may get its pid)
+        directory = os.environ.get('METRICS_DIR')
+        if not directory:
+            return
+        import metrics
+        try:
+            metrics.REGISTRY.retire_snapshot(directory, pid)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not retire the metrics of worker {pid}: {e}")
+
+    def reap(self):
+        """Collect exited workers, restarting them unless we are shutting down"""
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            self.retire_metrics(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            print(f"Worker {pid} exited with code {code}; restarting")
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(RESTART_DELAY)
+            self.spawn()
+
+    def rolling_restart(self):
+        self.reload_requested = False
+        for pid in list(self.workers):
+            if self.stopping:
+                return
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+            # Wait for the replacement before recycling the next worker
+            while pid in self.workers and not self.stopping:
+                time.sleep(0.1)
+                self.reap()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        for _ in range(self.args.workers):
+            self.spawn()
+
+        while self.workers and not self.stopping:
+            if self.reload_requested:
+                self.rolling_restart()
+            time.sleep(0.5)
+            self.reap()
+
+        # Give workers the graceful timeout to drain, then force them down
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        if self.workers:
+            print(f"Killing {len(self.workers)} worker(s) that did not stop in time")
+            self.signal_workers(signal.SIGKILL)
+            for pid in list(self.workers):
+                os.waitpid(pid, 0)
+                self.retire_metrics(pid)
+        self.sock.close()
+
+def prepare_metrics_dir() -> Optional[str]:
+    """
+    Shared directory for the workers' metrics snapshots (before enhanced_api reads METRICS_DIR).
+    Returns the directory if it is a temporary one to remove on exit.
+    """
+    directory = os.environ.get('METRICS_DIR')
+    temporary = None
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        import metrics
+        metrics.clear_snapshots(directory)
+    else:
+        directory = temporary = os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='spam-api-metrics-')
+    print(f"Worker metrics are collected in {directory}")
+    return temporary
+
+def preload():
+    """Load the models and rule detector once so forked workers share them copy-on-write"""
+    import enhanced_api
+    # Fill the lazy per-process caches (stop words, tokenizer self-check) before forking
+    enhanced_api.hybrid_spam_detection("Congratulations! You have won a free prize, click here to claim.")
+    # Keep the preloaded objects out of the workers' GC passes, which would touch their pages
+    gc.collect()
+    gc.freeze()
+    return enhanced_api.app
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8007)
\ No newline at end of file
+    args = parse_args()
+    # The Gemini rate limits are per process: split them between the workers
+    os.environ.setdefault('GEMINI_LIMIT_PROCESSES', str(args.workers))
+
+    temporary_metrics_dir = prepare_metrics_dir() if args.workers > 1 else None
+
+    if args.workers == 1:
+        from enhanced_api import app
+        if args.max_requests > 0:
+            # uvicorn would just exit after max_requests: there is no supervisor to start a new worker
+            print(f"Warning: --max-requests {args.max_requests} is ignored with a single worker; "
+                  f"use --workers 2 or more to recycle workers")
+        uvicorn.run(app, host=args.host, port=args.port, backlog=args.backlog,
+                    timeout_graceful_shutdown=args.graceful_timeout)
+    elif not hasattr(os, 'fork'):
+        # No fork on Windows: let uvicorn spawn the workers (each loads its own models)
+        uvicorn.run("enhanced_api:app", host=args.host, port=args.port, backlog=args.backlog,
+                    workers=args.workers, limit_max_requests=args.max_requests or None,
+                    timeout_graceful_shutdown=args.graceful_timeout)
+    else:
+        app = preload()
+        sock = bind_socket(args.host, args.port, args.backlog)
+        print(f"Serving on {args.host}:{args.port} with {args.workers} workers (pid {os.getpid()})")
+        Supervisor(app, sock, args).run()
+    if temporary_metrics_dir:
+        shutil.rmtree(temporary_metrics_dir, ignore_errors=True)
@@ -0,0 +1,15 @@
+import csv
+import os
+import sys
+from typing import List
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+@pytest.fixture(scope='session')
+def spam_messages() -> List[str]:
+    """Every message of spam.csv"""
+    with open(os.path.join(REPO_DIR, 'spam.csv'), newline='', encoding='latin-1') as f:
+        return [row['v2'] for row in csv.DictReader(f)]
@@ -0,0 +1,16 @@
+# Stored translations must be found whatever the case or padding of the requested language,
+# as with the ad cache keys.
+from ad_cache import ad_cache_key
+from ad_library import AdLibrary, build_library
+
+def test_translation_language_is_normalized(spam_messages, tmp_path):
+    spam = [text for text in spam_messages if 'free' in text.lower()][:200]
+    out_dir = build_library(spam, str(tmp_path / 'library'), lambda text: "AD: " + text[:20],
+                            lambda ad, languages: {lang: f"{lang}: {ad}" for lang in languages},
+                            [' Hindi'], clusters=4, min_size=2, min_cohesion=0.0)
+    library = AdLibrary(out_dir, min_similarity=0.3, min_example_similarity=0.8)
+    ad = library.clusters[0]['ad']
+    assert library.translation(ad, 'hindi') == f" Hindi: {ad}"
+    assert library.translation(ad, 'HINDI ') == f" Hindi: {ad}"
+    assert library.translation(ad, 'tamil') is None
+    assert ad_cache_key('translation', ad, 'Hindi') == ad_cache_key('translation', ad, ' hindi')
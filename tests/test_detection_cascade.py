@@ -0,0 +1,80 @@
+# Early exit must never change a result: whatever the skipped stage would have
+# returned, combine_predictions gives what the deciding stage claimed ('exact'),
+# or at least its label with no more than the full confidence ('label').
+import itertools
+
+import numpy as np
+import pytest
+
+from detection_cascade import (ML_OVERRIDE_CONFIDENCE, RULE_OVERRIDE_CONFIDENCE, combine_predictions,
+                               decided_by_ml, decided_by_rules)
+from improved_rule_based_detector import ImprovedRuleBasedSpamDetector
+
+SPAM_THRESHOLD = ImprovedRuleBasedSpamDetector().spam_threshold
+
+# Confidences around every bound the combination compares against
+CONFIDENCES = sorted(set(np.round(np.linspace(0.0, 1.0, 101), 4)) |
+                     {SPAM_THRESHOLD, RULE_OVERRIDE_CONFIDENCE, ML_OVERRIDE_CONFIDENCE,
+                      np.nextafter(RULE_OVERRIDE_CONFIDENCE, 1.0), np.nextafter(ML_OVERRIDE_CONFIDENCE, 1.0),
+                      np.nextafter(1.0, 0.0)})
+
+def rule_results():
+    """Every (prediction, confidence) the rule detector can return: spam iff the score passes its threshold"""
+    for confidence in CONFIDENCES:
+        yield (1 if confidence > SPAM_THRESHOLD else 0), float(confidence)
+
+def ml_results():
+    """Every ML result, including a failed stage (None)"""
+    yield None, 0.0
+    for prediction, confidence in itertools.product((0, 1), CONFIDENCES):
+        yield prediction, float(confidence)
+
+def assert_decision(decision, full, mode):
+    if mode == 'exact':
+        assert decision == full
+    else:
+        assert decision[0] == full[0]
+        assert decision[1] <= full[1]
+
+@pytest.mark.parametrize('mode', ['exact', 'label'])
+def test_rule_exit_matches_combined_result(mode):
+    decisions = 0
+    for rule_prediction, rule_confidence in rule_results():
+        decision = decided_by_rules(rule_prediction, rule_confidence, mode)
+        if decision is None:
+            continue
+        decisions += 1
+        for ml_prediction, ml_confidence in ml_results():
+            full = combine_predictions(ml_prediction, ml_confidence, rule_prediction, rule_confidence)
+            assert_decision(decision, full, mode)
+    assert decisions > 0
+
+@pytest.mark.parametrize('mode', ['exact', 'label'])
+def test_ml_exit_matches_combined_result(mode):
+    decisions = 0
+    for ml_prediction, ml_confidence in ml_results():
+        decision = decided_by_ml(ml_prediction, ml_confidence, mode, SPAM_THRESHOLD)
+        if decision is None:
+            continue
+        decisions += 1
+        for rule_prediction, rule_confidence in rule_results():
+            full = combine_predictions(ml_prediction, ml_confidence, rule_prediction, rule_confidence)
+            assert_decision(decision, full, mode)
+    assert decisions > 0
+
+def test_off_mode_never_exits_early():
+    for rule_prediction, rule_confidence in rule_results():
+        assert decided_by_rules(rule_prediction, rule_confidence, 'off') is None
+    for ml_prediction, ml_confidence in ml_results():
+        assert decided_by_ml(ml_prediction, ml_confidence, 'off', SPAM_THRESHOLD) is None
+
+def test_rule_exit_on_real_messages(spam_messages):
+    # Rule results the detector actually produces, including saturated scores
+    detector = ImprovedRuleBasedSpamDetector()
+    for text in spam_messages:
+        rule_prediction, rule_confidence = detector.predict(text)
+        decision = decided_by_rules(rule_prediction, rule_confidence, 'exact')
+        if decision is None:
+            continue
+        for ml_prediction, ml_confidence in ml_results():
+            assert decision == combine_predictions(ml_prediction, ml_confidence, rule_prediction, rule_confidence)
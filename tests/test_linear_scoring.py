@@ -0,0 +1,48 @@
+# The linear scoring kernels must agree with the model's own predict_proba,
+# for pickled sklearn vectorizers (dict path) and exported artifacts (array path).
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import REPO_DIR
+from linear_scoring import ArtifactTextScorer, LinearTextScorer, build_linear_scorer
+from model_artifacts import export_version, load_artifacts
+
+@pytest.fixture(scope='module')
+def sklearn_model():
+    with open(os.path.join(REPO_DIR, 'robust_vectorizer.pkl'), 'rb') as f:
+        vectorizer = pickle.load(f)
+    with open(os.path.join(REPO_DIR, 'robust_model.pkl'), 'rb') as f:
+        classifier = pickle.load(f)
+    return vectorizer, classifier
+
+@pytest.fixture(scope='module')
+def artifact_model(sklearn_model, tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('artifacts'))
+    version = export_version(*sklearn_model, root=root, version='v1', activate=False)
+    return load_artifacts(os.path.join(root, version))
+
+def assert_matches(scorer, vectorizer, classifier, texts):
+    probs = classifier.predict_proba(vectorizer.transform(texts))
+    labels = classifier.classes_[probs.argmax(axis=1)]
+    for (label, prob), (single_label, single_prob), expected_label, expected_prob in zip(
+            scorer.predict_many(texts), [scorer.predict(text) for text in texts], labels, probs.max(axis=1)):
+        assert prob == pytest.approx(expected_prob, abs=1e-9)
+        assert single_prob == pytest.approx(expected_prob, abs=1e-9)
+        if abs(expected_prob - 0.5) > 1e-9:
+            assert label == single_label == expected_label
+
+def test_sklearn_vectorizer_uses_dict_kernel(sklearn_model, spam_messages):
+    scorer = build_linear_scorer(*sklearn_model)
+    assert type(scorer) is LinearTextScorer
+    assert_matches(scorer, *sklearn_model, [text.lower() for text in spam_messages[:1000]])
+
+def test_artifact_vectorizer_uses_vocabulary_lookup(artifact_model, spam_messages):
+    scorer = build_linear_scorer(*artifact_model)
+    assert isinstance(scorer, ArtifactTextScorer)
+    assert scorer.weights == {}
+    texts = [text.lower() for text in spam_messages[:1000]] + ["", "zzzz unknown words only"]
+    assert_matches(scorer, *artifact_model, texts)
+    assert scorer.predict_many([]) == []
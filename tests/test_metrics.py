@@ -0,0 +1,72 @@
+# Worker snapshots in a shared METRICS_DIR: an exited worker's counts move to the
+# retired totals once, and a new process reusing its pid can't make them go backwards.
+import os
+import shutil
+
+from metrics import RETIRED_FILE, MetricsRegistry
+
+DEAD_PID = 999999999
+
+def registry():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_requests_total', 'Requests', ['route'])
+    gauge = registry.gauge('test_queue_depth', 'Queue depth')
+    histogram = registry.histogram('test_seconds', 'Latency', buckets=(0.1, 1.0))
+    return registry, counter, gauge, histogram
+
+def write_as(registry, directory, pid):
+    """Write a snapshot as if by another (exited) process with the given pid"""
+    registry._snapshot_pid = None
+    registry.write_snapshot(directory)
+    shutil.move(os.path.join(directory, f'{os.getpid()}.json'), os.path.join(directory, f'{pid}.json'))
+    registry._snapshot_pid = None
+
+def value(text, line):
+    return [row for row in text.splitlines() if row.startswith(line + ' ')][0].split()[-1]
+
+def test_exited_worker_totals_are_kept_once(tmp_path):
+    directory = str(tmp_path)
+    worker, counter, gauge, histogram = registry()
+    counter.inc(5, route='/a')
+    gauge.set(7)
+    histogram.observe(0.5)
+    write_as(worker, directory, DEAD_PID)
+
+    scraper, counter, _, _ = registry()
+    counter.inc(1, route='/a')
+    before = scraper.render(directory)
+    assert value(before, 'test_requests_total{route="/a"}') == '6'
+
+    assert scraper.retire_snapshot(directory, DEAD_PID)
+    assert not os.path.exists(os.path.join(directory, f'{DEAD_PID}.json'))
+    after = scraper.render(directory)
+    assert value(after, 'test_requests_total{route="/a"}') == '6'
+    assert value(after, 'test_seconds_count') == '1'
+    assert f'worker="{DEAD_PID}"' not in after
+    # Retiring twice is harmless
+    assert not scraper.retire_snapshot(directory, DEAD_PID)
+
+    # A new worker with the same pid starts from zero without hiding the old counts
+    worker, counter, _, _ = registry()
+    counter.inc(2, route='/a')
+    write_as(worker, directory, DEAD_PID)
+    assert value(scraper.render(directory), 'test_requests_total{route="/a"}') == '8'
+    assert scraper.retire_snapshot(directory, DEAD_PID)
+    assert value(scraper.render(directory), 'test_requests_total{route="/a"}') == '8'
+    assert sorted(os.listdir(directory)) == sorted([f'{os.getpid()}.json', RETIRED_FILE])
+
+def test_snapshot_read_before_it_was_retired_is_not_counted_twice(tmp_path):
+    directory = str(tmp_path)
+    worker, counter, _, _ = registry()
+    counter.inc(3, route='/a')
+    write_as(worker, directory, DEAD_PID)
+    path = os.path.join(directory, f'{DEAD_PID}.json')
+    with open(path, encoding='utf-8') as f:
+        snapshot = f.read()
+
+    scraper, _, _, _ = registry()
+    scraper.retire_snapshot(directory, DEAD_PID)
+    # The worker's file as a concurrent scrape may still see it
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(snapshot)
+    assert value(scraper.render(directory), 'test_requests_total{route="/a"}') == '3'
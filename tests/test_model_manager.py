@@ -0,0 +1,62 @@
+# Canary check of candidate models: a fixed labelled sample, an absolute floor
+# and a bound on how much worse than the active model a candidate may be.
+import os
+
+import numpy as np
+import pytest
+
+from model_manager import CanaryAccuracyError, ModelBundle, ModelManager, ModelValidationError, load_canary
+
+from conftest import REPO_DIR
+
+class FixedVectorizer:
+    def transform(self, texts):
+        return texts
+
+class AnswerKey:
+    """Classifier that gets exactly the given texts wrong"""
+    classes_ = np.array([0, 1])
+
+    def __init__(self, canary, wrong):
+        self.answers = {text: label if text not in wrong else 1 - label for text, label in canary}
+
+    def predict_proba(self, texts):
+        return np.array([[0.0, 1.0] if self.answers[text] == 1 else [1.0, 0.0] for text in texts])
+
+def bundle(version, canary, wrong=0):
+    return ModelBundle(version, FixedVectorizer(), AnswerKey(canary, {text for text, _ in canary[:wrong]}), 'test')
+
+@pytest.fixture(scope='module')
+def canary():
+    return load_canary(os.path.join(REPO_DIR, 'spam.csv'), size=200)
+
+def test_canary_is_a_fixed_labelled_sample(canary):
+    assert len(canary) == 200
+    assert len({text for text, _ in canary}) == 200
+    assert {label for _, label in canary} == {0, 1}
+    assert load_canary(os.path.join(REPO_DIR, 'spam.csv'), size=200) == canary
+
+def test_absolute_floor(canary):
+    manager = ModelManager('/nonexistent', lambda text: text, canary_min_accuracy=0.9, canary=canary)
+    assert manager.validate(bundle('good', canary, wrong=20)) == 0.9
+    with pytest.raises(CanaryAccuracyError):
+        manager.validate(bundle('bad', canary, wrong=21))
+
+def test_regression_against_active_model(canary):
+    manager = ModelManager('/nonexistent', lambda text: text, canary_min_accuracy=0.5, canary=canary,
+                           canary_max_regression=0.02)
+    active = bundle('active', canary, wrong=2)
+    manager.validate(active)
+    manager.activate(active)
+    # 99% active: 97% still passes, 96.5% doesn't
+    assert manager.validate(bundle('close', canary, wrong=6)) == 0.97
+    with pytest.raises(CanaryAccuracyError):
+        manager.validate(bundle('worse', canary, wrong=7))
+
+def test_unusable_model_is_not_an_accuracy_failure(canary):
+    def broken(text):
+        raise LookupError("no stopwords")
+    manager = ModelManager('/nonexistent', broken, canary=canary)
+    with pytest.raises(ModelValidationError) as error:
+        manager.validate(bundle('any', canary))
+    assert not isinstance(error.value, CanaryAccuracyError)
@@ -0,0 +1,77 @@
+# The band lookup must find what a scan of every indexed fingerprint finds:
+# the closest entry within max_distance bits, and nothing further away.
+import random
+
+import pytest
+
+from near_duplicates import FINGERPRINT_BITS, NearDuplicateIndex
+
+VERSION = 'test'
+
+def flip_bits(fingerprint: int, count: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(FINGERPRINT_BITS), count):
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+def scan_nearest_distance(fingerprints, query: int, max_distance: int):
+    """Distance to the closest fingerprint within max_distance, by comparing against all of them"""
+    distances = [(query ^ fingerprint).bit_count() for fingerprint in fingerprints]
+    within = [distance for distance in distances if distance <= max_distance]
+    return min(within) if within else None
+
+@pytest.mark.parametrize('max_distance', [0, 3, 5, 9])
+def test_bands_partition_the_fingerprint(max_distance):
+    index = NearDuplicateIndex(max_distance=max_distance)
+    covered = 0
+    for offset, mask in index._bands:
+        assert covered & (mask << offset) == 0
+        covered |= mask << offset
+    assert covered == (1 << FINGERPRINT_BITS) - 1
+    assert len(index._bands) == max_distance + 1
+
+@pytest.mark.parametrize('max_distance', [0, 3, 5, 9])
+def test_lookup_matches_full_scan(max_distance):
+    rng = random.Random(max_distance)
+    index = NearDuplicateIndex(max_entries=10000, max_distance=max_distance)
+    fingerprints = [rng.getrandbits(FINGERPRINT_BITS) for _ in range(300)]
+    for fingerprint in fingerprints:
+        index.add(fingerprint, VERSION, 1, 0.9)
+    for _ in range(2000):
+        query = flip_bits(rng.choice(fingerprints), rng.randint(0, max_distance + 3), rng)
+        expected = scan_nearest_distance(fingerprints, query, max_distance)
+        match = index.lookup(query, VERSION)
+        if expected is None:
+            assert match is None
+        else:
+            assert match is not None
+            assert match.similarity == 1.0 - expected / FINGERPRINT_BITS
+
+def test_evicted_and_other_version_entries_are_not_found():
+    rng = random.Random(1)
+    index = NearDuplicateIndex(max_entries=50, max_distance=3)
+    fingerprints = [rng.getrandbits(FINGERPRINT_BITS) for _ in range(100)]
+    for fingerprint in fingerprints:
+        index.add(fingerprint, VERSION, 0, 0.1)
+    survivors = fingerprints[50:]
+    for fingerprint in fingerprints[:50]:
+        # Only a surviving entry that happens to be close can still answer
+        expected = scan_nearest_distance(survivors, fingerprint, 3)
+        match = index.lookup(fingerprint, VERSION)
+        assert (match is None) == (expected is None)
+    for fingerprint in survivors:
+        assert index.lookup(fingerprint, VERSION).similarity == 1.0
+        assert index.lookup(fingerprint, 'other') is None
+    # Evicted entries leave no fingerprints behind in the band buckets
+    bucketed = set().union(*(bucket for buckets in index._buckets for bucket in buckets.values()))
+    assert bucketed == set(index._entries)
+
+def test_variants_of_a_message_are_found(spam_messages):
+    index = NearDuplicateIndex()
+    message = "WINNER!! As a valued network customer you have been selected to receive a £900 prize reward! " \
+              "To claim call 09061701461. Claim code KL341. Valid 12 hours only."
+    index.add(index.fingerprint(message), VERSION, 1, 0.95)
+    variant = message.replace('£900', '£2000').replace('09061701461', '09061702893')
+    match = index.lookup(index.fingerprint(variant), VERSION)
+    assert match is not None and match.prediction == 1
+    unrelated = [text for text in spam_messages if index.fingerprint(text) is not None][:200]
+    assert all(index.lookup(index.fingerprint(text), VERSION) is None for text in unrelated if 'WINNER' not in text)
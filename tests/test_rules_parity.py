@@ -0,0 +1,86 @@
+# The compiled rule detector must give exactly the features (and so the
+# verdicts) of the original one, which tested every keyword of every list
+# separately and ran each pattern through re on every call.
+import random
+import re
+
+import pytest
+
+from improved_rule_based_detector import CompiledTermMatcher, ImprovedRuleBasedSpamDetector, OrderedPatternMatcher
+
+EXTRA_MESSAGES = [
+    "Congratulations! You've won a $1000 gift card! Click here to claim: http://bit.ly/claim-now Reply within 24 hours or prize expires.",
+    "Your account has been suspended. Verify here: http://bank-verify.com Click now or account will be locked.",
+    "Your computer has viruses. Call now: 1-800-555-0123 Immediate assistance required.",
+    "Congratulations! You've won ₹10 lakh in the online lottery. To claim your prize, send your bank account details and pay a processing fee.",
+    "Lucky Winner! You've won ₹10,00,000. Click the link and enter your details to receive the amount.",
+    "बधाई हो! आपने ₹10,00,000 जीते हैं। राशि पाने के लिए लिंक पर क्लिक करें और अपना विवरण दर्ज करें",
+    "बधाई हो! आपने ₹10,00,000 जीते हैं। राशि पाने के लिए लिंक पर क्लिक करें http://bank-verify.com",
+    "पैसा भेजें, संपर्क करें: urgent cash prize, reply now",
+    # Kelvin and Angstrom signs lowercase to ASCII letters
+    "Keep this: you KNOW you won a free prize Å",
+    "Hey, are we still meeting for lunch tomorrow?",
+    "",
+    "won\nprize\n\nclaim 12345 call 0800",
+]
+
+def reference_features(detector: ImprovedRuleBasedSpamDetector, text: str) -> dict:
+    """extract_features as it was before the rules were compiled"""
+    text_lower = text.lower()
+    spam_keyword_count = 0
+    for keyword in detector.spam_keywords:
+        if keyword in text_lower:
+            spam_keyword_count += 1
+        elif any(keyword in word for word in text_lower.split()):
+            spam_keyword_count += 1
+    suspicious_pattern_count = 0
+    for pattern in detector.suspicious_patterns:
+        suspicious_pattern_count += len(re.findall(pattern, text_lower))
+    high_confidence_matches = 0
+    for pattern in detector.high_confidence_patterns:
+        if re.search(pattern, text_lower, re.IGNORECASE):
+            high_confidence_matches += 1
+    return {
+        'spam_keyword_count': spam_keyword_count,
+        'suspicious_pattern_count': suspicious_pattern_count,
+        'high_confidence_matches': high_confidence_matches,
+        'urgency_count': sum(1 for word in detector.urgency_indicators if word in text_lower),
+        'money_count': sum(1 for word in detector.money_terms if word in text_lower),
+        'action_count': sum(1 for word in detector.action_requests if word in text_lower),
+        'text_length': len(text),
+        'word_count': len(text.split())
+    }
+
+@pytest.fixture(scope='module')
+def detector() -> ImprovedRuleBasedSpamDetector:
+    return ImprovedRuleBasedSpamDetector()
+
+def fuzz_messages(detector: ImprovedRuleBasedSpamDetector, count: int = 500):
+    """Random mixes of keywords, digits, links and other scripts"""
+    rng = random.Random(2)
+    vocabulary = (detector.spam_keywords + detector.urgency_indicators + detector.money_terms +
+                  detector.action_requests + ['http://x.co/a', '₹', '$', '09061701461', '£1000', '\n', 'தமிழ்',
+                                              'hello', 'a', 'the', 'ok', '!!', '...'])
+    for _ in range(count):
+        yield ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 30)))
+
+def test_term_matcher_matches_substring_search(detector):
+    terms = detector.spam_keywords + detector.money_terms + ['', 'a', 'aa']
+    matcher = CompiledTermMatcher(terms)
+    for text in EXTRA_MESSAGES + list(fuzz_messages(detector, 200)):
+        text = text.lower()
+        assert matcher.find(text) == {term for term in terms if term in text}
+
+def test_ordered_pattern_matcher_matches_regex(detector, spam_messages):
+    texts = [text.lower() for text in spam_messages + EXTRA_MESSAGES + list(fuzz_messages(detector))]
+    # Near misses on one line and pieces spread over several lines
+    texts += ['congratulations ' * 50 + 'won', 'you have won\n 1000 prize', 'won 12 won 1234 cash ' * 20]
+    for pattern in detector.high_confidence_patterns:
+        matcher = OrderedPatternMatcher(pattern, re.IGNORECASE)
+        regex = re.compile(pattern, re.IGNORECASE)
+        for text in texts:
+            assert matcher.search(text) == (regex.search(text) is not None), (pattern, text)
+
+def test_features_match_reference(detector, spam_messages):
+    for text in spam_messages + EXTRA_MESSAGES + list(fuzz_messages(detector)):
+        assert detector.extract_features(text) == reference_features(detector, text), text
@@ -0,0 +1,22 @@
+# The shared SQLite helper: one connection per process, schema and journal mode applied on open.
+import os
+
+from sqlite_store import ProcessLocalConnection
+
+def test_connection_is_reopened_in_a_new_process(tmp_path, monkeypatch):
+    store = ProcessLocalConnection(str(tmp_path / 'jobs.db'), ["CREATE TABLE IF NOT EXISTS jobs (id TEXT)"], wal=True)
+    db = store.get()
+    assert store.get() is db
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    db.execute("INSERT INTO jobs VALUES ('a')")
+    db.commit()
+
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    forked = store.get()
+    assert forked is not db
+    assert forked.execute("SELECT id FROM jobs").fetchall() == [('a',)]
+
+def test_rollback_journal_by_default(tmp_path):
+    store = ProcessLocalConnection(str(tmp_path / 'feedback.db'), ["CREATE TABLE IF NOT EXISTS feedback (id INTEGER)"])
+    assert store.get().execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
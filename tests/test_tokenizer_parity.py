@@ -0,0 +1,82 @@
+# The fast tokenizer must give exactly the tokens of nltk.word_tokenize for
+# every text it accepts, and advanced_text_preprocessing the output of the
+# original implementation. Without the NLTK punkt data the fast tokenizer is
+# checked against the Treebank tokenizer alone (the texts it accepts are one
+# sentence to Punkt anyway).
+import random
+import re
+
+import nltk
+import pytest
+from nltk.corpus import stopwords
+from nltk.stem.porter import PorterStemmer
+
+from text_preprocessing import (_EMAIL_OR_NUMBER, _URL, _WHITESPACE, _fast_tokenize, _fast_tokenizer_enabled,
+                                _treebank, advanced_text_preprocessing)
+
+def _has_nltk_data(probe) -> bool:
+    try:
+        probe()
+        return True
+    except LookupError:
+        return False
+
+HAS_PUNKT = _has_nltk_data(lambda: nltk.word_tokenize("Data. Check"))
+HAS_STOPWORDS = _has_nltk_data(lambda: stopwords.words('english'))
+
+def clean(text: str) -> str:
+    """The text advanced_text_preprocessing hands to the tokenizer"""
+    text = _EMAIL_OR_NUMBER.sub('', _URL.sub('', text.lower()))
+    return _WHITESPACE.sub(' ', text).strip()
+
+def fuzz_texts(count: int = 3000):
+    """Random strings of words, contractions and every punctuation the Treebank rules handle"""
+    rng = random.Random(6)
+    pieces = ['ok', 'win', 'free', "i'm", "don't", "we're", "boys'", 'cannot', 'gonna', 'wanna', 'gimme', 'lemme',
+              'gotta', 'it', 'a', '1', '12', ',', ':', ';', '.', '..', '...', '?', '!', '-', '--', '---', '(', ')',
+              '[', ']', '{', '}', '<', '>', '@', '#', '$', '%', '&', '*', '/', "'", '"', '`', '–', '—', 'é', 'क्लिक']
+    for _ in range(count):
+        separator = rng.choice([' ', ''])
+        yield separator.join(rng.choice(pieces) for _ in range(rng.randint(1, 12))).strip()
+
+def reference_preprocessing(text: str) -> str:
+    """advanced_text_preprocessing as it was before the fast path"""
+    text = text.lower()
+    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\S+@\S+', '', text)
+    text = re.sub(r'\d{3,}', '', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    tokens = [token for token in nltk.word_tokenize(text) if token.isalpha() and len(token) > 1]
+    stop_words = set(stopwords.words('english'))
+    tokens = [token for token in tokens if token not in stop_words]
+    stemmer = PorterStemmer()
+    return ' '.join(stemmer.stem(token) for token in tokens)
+
+def test_self_check_passes():
+    assert _fast_tokenizer_enabled()
+
+def test_fast_tokenize_matches_treebank(spam_messages):
+    accepted = 0
+    for text in [clean(message) for message in spam_messages] + list(fuzz_texts()):
+        tokens = _fast_tokenize(text)
+        if tokens is not None:
+            accepted += 1
+            assert tokens == _treebank.tokenize(text), text
+    # The comparison means nothing if everything falls back to NLTK
+    assert accepted > len(spam_messages) // 2
+
+def test_fast_path_covers_most_of_spam_csv(spam_messages):
+    accepted = sum(1 for message in spam_messages if _fast_tokenize(clean(message)) is not None)
+    assert accepted / len(spam_messages) > 0.5
+
+@pytest.mark.skipif(not HAS_PUNKT, reason="NLTK punkt data not installed")
+def test_fast_tokenize_matches_word_tokenize(spam_messages):
+    for text in [clean(message) for message in spam_messages] + list(fuzz_texts()):
+        tokens = _fast_tokenize(text)
+        if tokens is not None:
+            assert tokens == nltk.word_tokenize(text), text
+
+@pytest.mark.skipif(not (HAS_PUNKT and HAS_STOPWORDS), reason="NLTK punkt or stopwords data not installed")
+def test_preprocessing_matches_reference(spam_messages):
+    for text in spam_messages:
+        assert advanced_text_preprocessing(text) == reference_preprocessing(text), text
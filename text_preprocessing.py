@@ -0,0 +1,251 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem.porter import PorterStemmer
+from nltk.tokenize.destructive import NLTKWordTokenizer
+
+from text_scripts import LATIN, detect_scripts
+
+# Bump whenever advanced_text_preprocessing changes its output, so cached results are recomputed
+PREPROCESSING_VERSION = 1
+
+# Regexes of the cleaning steps, compiled once
+_URL = re.compile(r'http\S+|www\S+|https\S+', flags=re.MULTILINE)
+# Emails and 3+ digit numbers in one pass; an email always wins at the start of its chunk,
+# so this matches removing emails first and numbers second
+_EMAIL_OR_NUMBER = re.compile(r'\S+@\S+|\d{3,}')
+_WHITESPACE = re.compile(r'\s+')
+
+# The fast tokenizer reproduces NLTK's Treebank rules for plain text only.
+# Anything involving quotes or a sentence-internal period (where Punkt's
+# sentence splitting changes the tokens) goes through nltk.word_tokenize.
+_QUOTES = re.compile(r'["`‘’“”«»„]|\'\'')
+_SINGLE_PERIOD = re.compile(r'(?<!\.)\.(?!\.)')
+_ADJACENT_COMMA_COLON = re.compile(r'[:,]{2}')
+
+# Treebank punctuation rules that can fire on that plain text, in Treebank order
+_COMMA_COLON = re.compile(r'([:,])([^\d])')
+_TRAILING_COMMA_COLON = re.compile(r'([:,])$')
+_SPLIT_PUNCTUATION = re.compile(r'\.{2,}|[;@#$%&\u2012-\u2015?!*\]\[\(\)\{\}<>]|--')
+_CLITIC = re.compile(r"^([^\W\d_]+)('s|'m|'d|'ll|'re|'ve|n't|')$")
+_CONTRACTION_HINT = re.compile(r'cannot|gimme|gonna|gotta|lemme|wanna')
+
+_treebank = NLTKWordTokenizer()
+_ps = PorterStemmer()
+_stop_words: Optional[frozenset] = None
+_stop_words_warned = False
+
+# Strings the fast tokenizer is checked against at first use, covering every rule it mirrors
+_SELF_CHECK_TEXTS = [
+    "ok lar... joking wif u oni...",
+    "free entry in a wkly comp to win fa cup final tkts st may",
+    "i'm gonna be home soon and i don't want to talk about this stuff anymore tonight, k?",
+    "we're wanna cannot gimme lemme gotta you'll they've he'd it's can't boys' end.",
+    "wait:that,is ok: a,1 b:2 (yes) [no] {x} <y> a--b a---b x;y @z #1 $5 %6 &7 *8 – —!?!",
+    "cannot-do x/gonna wanna-be ... .. end..",
+    "ok.",
+]
+
+def _get_stop_words() -> frozenset:
+    """English stopwords, read from the NLTK corpus once per process"""
+    global _stop_words, _stop_words_warned
+    if _stop_words is None:
+        try:
+            _stop_words = frozenset(stopwords.words('english'))
+        except Exception as e:
+            # Fallback if stopwords not available (retried on the next call); serving degrades, training refuses
+            if not _stop_words_warned:
+                _stop_words_warned = True
+                print(f"Warning: NLTK stopwords unavailable ({type(e).__name__}), preprocessing without stopword removal")
+            return frozenset()
+    return _stop_words
+
+def require_stop_words() -> frozenset:
+    """English stopwords, raising LookupError when the NLTK corpus is missing"""
+    stop_words = _get_stop_words()
+    if not stop_words:
+        raise LookupError("NLTK stopwords corpus not found; run nltk.download('stopwords') "
+                          "before preprocessing a training corpus")
+    return stop_words
+
+@lru_cache(maxsize=65536)
+def stem(token: str) -> str:
+    """PorterStemmer.stem, memoized; vocabulary is small so most calls are cache hits"""
+    return _ps.stem(token)
+
+def _fast_tokenize(text: str) -> Optional[List[str]]:
+    """
+    Tokenize like NLTKWordTokenizer for text without quotes or sentence-internal periods.
+    Returns None when the text needs the full nltk.word_tokenize.
+    """
+    if _QUOTES.search(text) or _ADJACENT_COMMA_COLON.search(text):
+        return None
+    if '.' in text:
+        single_periods = [m.start() for m in _SINGLE_PERIOD.finditer(text)]
+        if single_periods:
+            # Only a period that ends the whole text is unambiguous
+            if single_periods != [len(text) - 1]:
+                return None
+            text = text[:-1] + ' . '
+    if ',' in text or ':' in text:
+        text = _COMMA_COLON.sub(r' \1 \2', text)
+        text = _TRAILING_COMMA_COLON.sub(r' \1 ', text)
+    text = _SPLIT_PUNCTUATION.sub(r' \g<0> ', text)
+
+    tokens = []
+    for token in text.split():
+        if "'" in token:
+            match = _CLITIC.match(token)
+            if match is None:
+                return None
+            tokens.append(match.group(1))
+            tokens.append(match.group(2))
+        else:
+            tokens.append(token)
+
+    if _CONTRACTION_HINT.search(text):
+        joined = " " + " ".join(tokens) + " "
+        for regexp in NLTKWordTokenizer.CONTRACTIONS2:
+            joined = regexp.sub(r" \1 \2 ", joined)
+        tokens = joined.split()
+    return tokens
+
+@lru_cache(maxsize=1)
+def _fast_tokenizer_enabled() -> bool:
+    """Use the fast tokenizer only if it agrees with the installed NLTK version"""
+    for text in _SELF_CHECK_TEXTS:
+        if _fast_tokenize(text) != _treebank.tokenize(text):
+            print("Fast tokenizer disagrees with this NLTK version; using nltk.word_tokenize")
+            return False
+    return True
+
+def tokenize(text: str) -> List[str]:
+    """Equivalent of nltk.word_tokenize(text) for the cleaned, lowercased text we feed it"""
+    if _fast_tokenizer_enabled():
+        tokens = _fast_tokenize(text)
+        if tokens is not None:
+            return tokens
+    return nltk.word_tokenize(text)
+
+def advanced_text_preprocessing(text: str) -> str:
+    """Advanced text preprocessing for better feature extraction"""
+    # Convert to lowercase
+    text = text.lower()
+
+    # Remove URLs, then email addresses and phone numbers
+    text = _URL.sub('', text)
+    text = _EMAIL_OR_NUMBER.sub('', text)
+
+    # Remove extra whitespace
+    text = _WHITESPACE.sub(' ', text).strip()
+
+    # Tokenize, keeping alphabetic tokens only
+    stop_words = _get_stop_words()
+    tokens = []
+    for token in tokenize(text):
+        if not token.isalpha() or len(token) < 2:
+            continue
+        # English stop words and stemming; tokens written only in another script are kept as they are
+        if _is_english_token(token):
+            if token in stop_words:
+                continue
+            token = stem(token)
+        tokens.append(token)
+
+    return " ".join(tokens)
+
+def _is_english_token(token: str) -> bool:
+    if token.isascii():
+        return True
+    scripts = detect_scripts(token)
+    return LATIN in scripts or not scripts
+
+def preprocessing_version() -> str:
+    """Cache version: our code version plus what else decides the output (NLTK, stop words)"""
+    return f"{PREPROCESSING_VERSION}:nltk-{nltk.__version__}:stopwords-{len(_get_stop_words())}"
+
+def _content_key(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+def _preprocess_shard(texts: List[str]) -> List[str]:
+    return [advanced_text_preprocessing(text) for text in texts]
+
+class PreprocessingCache:
+    """SQLite store of preprocessed text keyed by content hash and preprocessing version"""
+    def __init__(self, path: str, version: str):
+        self.version = version
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS preprocessed_text "
+            "(key TEXT NOT NULL, version TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (key, version))"
+        )
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        found = {}
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(keys), 900):
+            batch = keys[start:start + 900]
+            rows = self._db.execute(
+                f"SELECT key, value FROM preprocessed_text WHERE version = ? AND key IN ({','.join('?' * len(batch))})",
+                [self.version] + batch
+            )
+            found.update(rows)
+        return found
+
+    def set_many(self, items: Dict[str, str]):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO preprocessed_text (key, version, value) VALUES (?, ?, ?)",
+                [(key, self.version, value) for key, value in items.items()]
+            )
+
+    def close(self):
+        self._db.close()
+
+def preprocess_corpus(texts: Iterable[str], cache_path: Optional[str] = None, workers: int = 0,
+                      shard_size: int = 1000) -> List[str]:
+    """
+    advanced_text_preprocessing over a whole corpus, in order.
+    Unique texts missing from the cache are sharded across a process pool
+    (workers=0 uses every CPU, 1 stays in this process); cache_path=None disables the cache.
+    Raises LookupError without the NLTK stopwords: a model trained (or output cached)
+    without stopword removal would silently differ from the one we ship.
+    """
+    require_stop_words()
+    texts = list(texts)
+    keys = [_content_key(text) for text in texts]
+    unique_texts = dict(zip(keys, texts))
+
+    cache = PreprocessingCache(cache_path, preprocessing_version()) if cache_path else None
+    results = cache.get_many(list(unique_texts)) if cache else {}
+    missing = [key for key in unique_texts if key not in results]
+
+    if missing:
+        missing_texts = [unique_texts[key] for key in missing]
+        shards = [missing_texts[i:i + shard_size] for i in range(0, len(missing_texts), shard_size)]
+        workers = workers or os.cpu_count() or 1
+        # Forked workers only; spawned ones would re-run the calling training script
+        if workers > 1 and len(shards) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with ProcessPoolExecutor(max_workers=min(workers, len(shards)),
+                                     mp_context=multiprocessing.get_context('fork')) as pool:
+                processed = [value for shard in pool.map(_preprocess_shard, shards) for value in shard]
+        else:
+            processed = _preprocess_shard(missing_texts)
+        fresh = dict(zip(missing, processed))
+        results.update(fresh)
+        if cache:
+            cache.set_many(fresh)
+
+    if cache:
+        cache.close()
+    print(f"Preprocessed {len(texts)} texts ({len(unique_texts)} unique): "
+          f"{len(unique_texts) - len(missing)} from cache, {len(missing)} computed")
+    return [results[key] for key in keys]
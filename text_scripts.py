@@ -0,0 +1,55 @@
+# Writing systems of message text.
+#
+# Keywords, patterns and preprocessing steps are each written for one script
+# (English keywords, Hindi keywords, the Porter stemmer) and can only apply to
+# text containing that script. Detecting the scripts of a message once lets
+# each step skip everything written for the others, so adding a language
+# doesn't slow down messages in the languages we already have.
+import re
+from typing import Dict, FrozenSet, Iterable, List, Tuple, TypeVar
+
+LATIN = 'latin'
+DEVANAGARI = 'devanagari'
+
+# Letters of each script as a regex character class. Latin includes its
+# extended blocks and the Kelvin and Angstrom signs, which case-insensitive
+# matching maps onto ASCII letters. Add a row per new script.
+SCRIPT_CHARACTERS: Dict[str, str] = {
+    LATIN: 'A-Za-z\u00c0-\u024f\u1e00-\u1eff\u212a\u212b',
+    DEVANAGARI: '\u0900-\u097f',
+}
+
+_SCRIPT_REGEXES = [(script, re.compile(f'[{chars}]')) for script, chars in SCRIPT_CHARACTERS.items()]
+_ASCII_LETTER = re.compile(r'[A-Za-z]')
+_ASCII_SCRIPTS = frozenset([LATIN])
+_NO_SCRIPTS: FrozenSet[str] = frozenset()
+
+# Regex syntax after which a letter may not be needed for a match ('.*' excepted)
+_ESCAPE = re.compile(r'\\.')
+_OPTIONAL_SYNTAX = re.compile(r'[\[\]()|?{}]|(?<!\.)\*')
+
+T = TypeVar('T')
+
+def detect_scripts(text: str) -> FrozenSet[str]:
+    """Scripts with at least one letter in text"""
+    if text.isascii():
+        return _ASCII_SCRIPTS if _ASCII_LETTER.search(text) else _NO_SCRIPTS
+    return frozenset(script for script, regex in _SCRIPT_REGEXES if regex.search(text))
+
+def pattern_scripts(pattern: str) -> FrozenSet[str]:
+    """
+    Scripts a text must contain for the regex to match. Escapes (\\d, \\S, ...)
+    require nothing, and a pattern with alternatives or optional parts is
+    conservatively taken to require no script at all.
+    """
+    literal = _ESCAPE.sub('', pattern)
+    if _OPTIONAL_SYNTAX.search(literal):
+        return _NO_SCRIPTS
+    return detect_scripts(literal)
+
+def partition_by_script(items: Iterable[Tuple[FrozenSet[str], T]]) -> List[Tuple[FrozenSet[str], List[T]]]:
+    """Group (required scripts, item) pairs into one list per set of required scripts"""
+    groups: Dict[FrozenSet[str], List[T]] = {}
+    for scripts, item in items:
+        groups.setdefault(scripts, []).append(item)
+    return list(groups.items())